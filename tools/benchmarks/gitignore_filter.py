@@ -0,0 +1,116 @@
+"""Benchmark gitignore.PathFilter over a walk of the repository.
+
+Compares the filter using the merged pattern regexps with one that checks
+every pattern in turn, as PathFilter did previously. The directory walk is
+done once up front so that only the filtering is timed.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.gitignore_filter [--ignore-file .gitignore]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import timeit
+
+from tools import localpaths  # noqa: F401
+
+from tools.gitignore.gitignore import PathFilter
+from tools.manifest.vcs import walk
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+
+# Typical entries of a WPT checkout's .gitignore, used in addition to the
+# repository's own rules so that the benchmark has a realistic number of
+# patterns even where the .gitignore is short
+default_extras = [
+    ".git/",
+    "*#",
+    "*.py[co]",
+    "*.sw[po]",
+    "*~",
+    "\\#*",
+    "_certs",
+    ".virtualenv",
+    "config.json",
+    "node_modules",
+    "scratch",
+    "testharness_runner.html",
+    "webdriver/.idea",
+    ".vscode/",
+    ".DS_Store",
+    "*.rej",
+    "_venv*",
+    ".wptcache/",
+    "/.tox",
+    "/MANIFEST.json",
+]
+
+
+class UnmergedPathFilter(PathFilter):
+    """PathFilter without the merged regexps, so that every path is checked
+    against each of the patterns"""
+
+    def _compile(self):
+        always = re.compile("")
+        self.compiled_file = (always, None)
+        self.compiled_dir = (always, None)
+
+
+def walk_tree(root):
+    """Materialize a walk of root, so that it can be filtered repeatedly"""
+    rv = []
+    trivial = PathFilter(root, extras=[".git/"])
+    for dirpath, dirnames, filenames in trivial(walk(root)):
+        rv.append((dirpath, list(dirnames), list(filenames)))
+    return rv
+
+
+def run_filter(cls, root, ignore_file, extras, tree):
+    path_filter = cls(None, extras)
+    if ignore_file:
+        with open(ignore_file) as f:
+            for line in f:
+                path_filter._read_line(line)
+        path_filter._compile()
+    kept = 0
+    for dirpath, dirnames, filenames in path_filter.filter(
+            (dirpath, list(dirnames), list(filenames))
+            for dirpath, dirnames, filenames in tree):
+        kept += len(filenames)
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=wpt_root,
+                        help="Directory to walk")
+    parser.add_argument("--ignore-file", default=os.path.join(wpt_root, ".gitignore"),
+                        help="gitignore file to read rules from")
+    parser.add_argument("--no-extras", action="store_true",
+                        help="Only use the rules in the ignore file")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to run each case; the best time is reported")
+    args = parser.parse_args()
+
+    extras = [".git/"] if args.no_extras else default_extras
+    ignore_file = args.ignore_file if os.path.exists(args.ignore_file) else None
+
+    tree = walk_tree(args.root)
+    print("%d directories, %d files" % (len(tree), sum(len(item[2]) for item in tree)))
+
+    results = {}
+    for name, cls in [("unmerged", UnmergedPathFilter), ("merged", PathFilter)]:
+        results[name] = run_filter(cls, args.root, ignore_file, extras, tree)
+        t = min(timeit.repeat(lambda: run_filter(cls, args.root, ignore_file, extras, tree),
+                              number=1, repeat=args.repeat))
+        print("%-10s %8.3f s  (%d files kept)" % (name, t, results[name]))
+    assert results["merged"] == results["unmerged"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark many concurrent HTTP/2 streams.
+
+Each round opens a number of connections, and on each one sends a number
+of requests without waiting for the responses, then reads all the
+responses. Reports the request rate and the largest number of threads
+the process had running while handling them, for the default bounded pool
+of stream workers and for a pool large enough to give every stream its
+own thread, as before. The thread counts include one client thread for
+each connection.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.h2_streams [--connections 1 4] [--streams 10 100] [--size 1024]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import ssl
+import threading
+import time
+
+from tools import localpaths  # noqa: F401
+
+from hyper import HTTP20Connection, tls
+
+import wptserve
+from wptserve.handlers import handler
+from wptserve.server import Http2WebTestRequestHandler, WebTestServer
+
+here = os.path.dirname(__file__)
+certs = os.path.join(here, os.pardir, "certs")
+
+
+class UnboundedWebTestServer(WebTestServer):
+    h2_max_workers = 100000
+
+
+class ThreadCounter(object):
+    def __init__(self):
+        self.max_threads = 0
+
+    def update(self):
+        self.max_threads = max(self.max_threads, threading.active_count())
+
+
+def make_handler(counter, body):
+    @handler
+    def response_handler(request, response):
+        counter.update()
+        # Give the other streams a chance to start
+        time.sleep(0.01)
+        return [("Content-Type", "text/plain")], body
+    return response_handler
+
+
+def run_client(port, streams, size):
+    context = tls.init_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(["h2"])
+    conn = HTTP20Connection("localhost:%i" % port, secure=True, ssl_context=context)
+    conn.connect()
+    try:
+        stream_ids = [conn.request("GET", "/body") for _ in range(streams)]
+        for stream_id in stream_ids:
+            resp = conn.get_response(stream_id)
+            data = resp.read()
+            if resp.status != 200 or len(data) != size:
+                raise ValueError("Unexpected response with status %s" % resp.status)
+    finally:
+        conn.close()
+
+
+def run_clients(port, connections, streams, size):
+    errors = []
+
+    def client():
+        try:
+            run_client(port, streams, size)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client) for _ in range(connections)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise errors[0]
+    return connections * streams / elapsed
+
+
+def run(server_cls, connections, streams, size):
+    counter = ThreadCounter()
+    server = wptserve.server.WebTestHttpd(host="localhost", port=0, use_ssl=True,
+                                          key_file=os.path.join(certs, "web-platform.test.key"),
+                                          certificate=os.path.join(certs, "web-platform.test.pem"),
+                                          handler_cls=Http2WebTestRequestHandler,
+                                          http2=True, server_cls=server_cls,
+                                          routes=[("GET", "/body", make_handler(counter, b"x" * size))])
+    server.start(False)
+    try:
+        rate = run_clients(server.port, connections, streams, size)
+    finally:
+        server.stop()
+    return rate, counter.max_threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4],
+                        help="Numbers of concurrent connections to test")
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 100],
+                        help="Numbers of concurrent streams to test, up to the "
+                        "server's limit of 100 streams per connection")
+    parser.add_argument("--size", type=int, default=1024,
+                        help="Size of each response body, in bytes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    wptserve.logger.set_logger(logging.getLogger())
+
+    print("%-12s %-8s %-10s %12s %8s" % ("connections", "streams", "workers", "requests/s", "threads"))
+    for connections in args.connections:
+        for streams in args.streams:
+            for name, server_cls in [("unbounded", UnboundedWebTestServer),
+                                     ("bounded", WebTestServer)]:
+                rate, threads = run(server_cls, connections, streams, args.size)
+                print("%-12d %-8d %-10s %12.0f %8d" % (connections, streams, name, rate, threads))
+
+
+if __name__ == "__main__":
+    main()
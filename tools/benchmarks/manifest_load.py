@@ -0,0 +1,69 @@
+"""Benchmark loading the manifest in the JSON and database formats.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.manifest_load [--manifest MANIFEST.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from tools import localpaths  # noqa: F401
+
+from tools.manifest import manifest
+from tools.manifest.log import get_logger
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+logger = get_logger()
+
+
+def load(path, types=None, touch=None):
+    m = manifest._load(logger, wpt_root, path, types=types, allow_cached=False)
+    assert m is not None
+    if touch == "path":
+        for _ in m.iterpath(os.path.join("dom", "historical.html")):
+            pass
+    elif touch == "type":
+        for _ in m.itertypes(*types):
+            pass
+    return m
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", default=os.path.join(wpt_root, "MANIFEST.json"),
+                        help="JSON manifest to benchmark (built if missing)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to run each case; the best time is reported")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.manifest):
+        manifest.load_and_update(wpt_root, args.manifest, "/")
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmp_dir, "MANIFEST" + manifest.db.extension)
+        manifest.write(load(args.manifest), db_path)
+
+        cases = [("open", None, None),
+                 ("iterpath", None, "path"),
+                 ("testharness only", ["testharness"], "type")]
+        print("%-20s %12s %12s" % ("case", "json (s)", "db (s)"))
+        for name, types, touch in cases:
+            times = []
+            for path in (args.manifest, db_path):
+                times.append(min(timeit.repeat(lambda: load(path, types, touch),
+                                               number=1, repeat=args.repeat)))
+            print("%-20s %12.3f %12.3f" % (name, times[0], times[1]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
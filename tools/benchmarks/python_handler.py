@@ -0,0 +1,116 @@
+"""Benchmark requests to a .py handler through wptserve.
+
+Compares PythonScriptHandler with its previous behaviour of reading and
+compiling the script, and copying sys.modules, on every request.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.python_handler [--script fetch/api/resources/inspect-headers.py]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+from six.moves import http_client
+
+from tools import localpaths  # noqa: F401
+
+import wptserve
+from wptserve.handlers import HTTPException, PythonScriptHandler, filesystem_path
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+
+
+class UncachedPythonScriptHandler(PythonScriptHandler):
+    """PythonScriptHandler as it was before scripts were cached"""
+
+    def _set_path_and_load_file(self, request, response, func):
+        path = filesystem_path(self.base_path, request, self.url_base)
+
+        sys_path = sys.path[:]
+        sys_modules = sys.modules.copy()
+        try:
+            environ = {"__file__": path}
+            sys.path.insert(0, os.path.dirname(path))
+            with open(path, 'rb') as f:
+                exec(compile(f.read(), path, 'exec'), environ, environ)
+
+            if func is not None:
+                return func(request, response, environ, path)
+
+        except IOError:
+            raise HTTPException(404)
+        finally:
+            sys.path = sys_path
+            sys.modules = sys_modules
+
+
+def run_clients(port, path, clients, requests):
+    errors = []
+
+    def client():
+        for _ in range(requests):
+            # wptserve writes the headers of a response in separate packets,
+            # so reusing connections would mostly measure delayed ACKs
+            conn = http_client.HTTPConnection("localhost", port)
+            try:
+                conn.request("GET", path, headers={"Connection": "close"})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    errors.append(resp.status)
+            finally:
+                conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise ValueError("Got unexpected responses with status %s" % errors[0])
+    return clients * requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", default="fetch/api/resources/inspect-headers.py",
+                        help="Path of the handler to request, relative to the root of the repository")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="Number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="Number of requests made by each client")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    wptserve.logger.set_logger(logging.getLogger())
+
+    routes = [("*", "/uncached/*.py", UncachedPythonScriptHandler(url_base="/uncached/")),
+              ("*", "*.py", PythonScriptHandler())]
+    server = wptserve.server.WebTestHttpd(host="localhost", port=0, use_ssl=False,
+                                          certificate=None, doc_root=wpt_root,
+                                          routes=routes)
+    server.start(False)
+    try:
+        script = args.script.replace(os.path.sep, "/")
+        for name, path in [("uncached", "/uncached/" + script),
+                           ("cached", "/" + script)]:
+            # Warm up
+            run_clients(server.port, path, 1, 10)
+            rate = run_clients(server.port, path, args.clients, args.requests)
+            print("%-10s %8.0f requests/s" % (name, rate))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
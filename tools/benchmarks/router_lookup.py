@@ -0,0 +1,92 @@
+"""Benchmark looking up handlers in the wptserve router.
+
+Builds the routes that wpt serve uses, with a number of extra mount points,
+and compares the indexed Router.get_handler with trying every route in turn.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.router_lookup [--mount-points 10]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import timeit
+
+from six.moves.urllib.parse import urlsplit
+
+from tools import localpaths  # noqa: F401
+
+from tools.manifest.vcs import walk
+from tools.serve import serve
+from wptserve.router import Router, any_method
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+
+
+class Request(object):
+    def __init__(self, method, path):
+        self.method = method
+        self.url_parts = urlsplit(path)
+        self.route_match = None
+
+
+def linear_get_handler(router, request):
+    """Router.get_handler before routes were indexed"""
+    for method, regexp, handler in reversed(router.routes):
+        if (request.method == method or
+            method in (any_method, "*") or
+            (request.method == "HEAD" and method == "GET")):
+            m = regexp.match(request.url_parts.path)
+            if m:
+                match_parts = m.groupdict().copy()
+                if len(match_parts) < len(m.groups()):
+                    match_parts["*"] = m.groups()[-1]
+                request.route_match = match_parts
+                return handler
+    return None
+
+
+def sample_paths(count):
+    rv = []
+    for dirpath, dirnames, filenames in walk(wpt_root):
+        dirnames[:] = [item for item in dirnames if item[0] != "."]
+        for filename, _ in filenames:
+            rv.append("/" + os.path.join(dirpath, filename).replace(os.path.sep, "/"))
+            if len(rv) >= count:
+                return rv
+    return rv
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mount-points", type=int, default=10,
+                        help="Number of extra mount points to add to the default routes")
+    parser.add_argument("--paths", type=int, default=10000,
+                        help="Number of paths from the repository to look up")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to run each case; the best time is reported")
+    args = parser.parse_args()
+
+    aliases = [{"url-path": "/mount%d/" % i, "local-dir": wpt_root}
+               for i in range(args.mount_points)]
+    router = Router(wpt_root, serve.build_routes(aliases))
+    requests = [Request("GET", path) for path in sample_paths(args.paths)]
+    print("%d routes, %d paths" % (len(router.routes), len(requests)))
+
+    for request in requests:
+        assert router.get_handler(request) is linear_get_handler(router, request), request.url_parts.path
+
+    for name, get_handler in [("linear", lambda request: linear_get_handler(router, request)),
+                              ("indexed", router.get_handler)]:
+        def run():
+            for request in requests:
+                get_handler(request)
+        t = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        print("%-10s %10.0f lookups/s" % (name, len(requests) / t))
+
+
+if __name__ == "__main__":
+    main()
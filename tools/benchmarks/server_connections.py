@@ -0,0 +1,106 @@
+"""Benchmark wptserve with increasing numbers of keep-alive connections.
+
+Compares the default threading server with the asyncio server. For each
+number of connections, all the connections are opened and then each makes
+a series of requests, reusing its connection. Reports the request rate and
+the number of threads the server had running with all the connections
+open.
+
+Requires Python 3. Run from the root of the repository as:
+
+    python -m tools.benchmarks.server_connections [--connections 16 128 512]
+"""
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+from tools import localpaths  # noqa: F401
+
+import wptserve
+from wptserve.aioserver import AsyncioWebTestServer
+from wptserve.handlers import handler
+
+body = b"x" * 1024
+
+
+@handler
+def small_response(request, response):
+    return [("Content-Type", "text/plain")], body
+
+
+async def client(port, requests, ready, go):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    ready()
+    await go.wait()
+    request = b"GET /small HTTP/1.1\r\nHost: localhost:%d\r\n\r\n" % port
+    try:
+        for _ in range(requests):
+            writer.write(request)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = None
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            if not head.startswith(b"HTTP/1.1 200") or length is None:
+                raise ValueError("Unexpected response %r" % head)
+            await reader.readexactly(length)
+    finally:
+        writer.close()
+
+
+async def run_clients(port, connections, requests):
+    go = asyncio.Event()
+    opened = []
+    tasks = [asyncio.ensure_future(client(port, requests, lambda: opened.append(None), go))
+             for _ in range(connections)]
+    while len(opened) < connections:
+        await asyncio.sleep(0.01)
+    # Give the server time to accept all the connections
+    await asyncio.sleep(0.5)
+    threads = threading.active_count()
+    start = time.time()
+    go.set()
+    await asyncio.gather(*tasks)
+    return connections * requests / (time.time() - start), threads
+
+
+def run(server_cls, connections, requests):
+    server = wptserve.server.WebTestHttpd(host="localhost", port=0, use_ssl=False,
+                                          certificate=None, server_cls=server_cls,
+                                          routes=[("GET", "/small", small_response)])
+    server.start(False)
+    try:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run_clients(server.port, connections, requests))
+        finally:
+            loop.close()
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, nargs="+", default=[16, 128, 512],
+                        help="Numbers of concurrent connections to test")
+    parser.add_argument("--requests", type=int, default=20,
+                        help="Number of requests made on each connection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    wptserve.logger.set_logger(logging.getLogger())
+
+    print("%-12s %-10s %12s %8s" % ("connections", "engine", "requests/s", "threads"))
+    for connections in args.connections:
+        for name, server_cls in [("threading", None), ("asyncio", AsyncioWebTestServer)]:
+            rate, threads = run(server_cls, connections, args.requests)
+            print("%-12d %-10s %12.0f %8d" % (connections, name, rate, threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark puts and takes on the wptserve stash from several processes.
+
+Each process repeatedly puts a value in the stash and takes it again. Compares
+the multiprocessing manager backend, with the separate membership check, get
+and pop that Stash used to make for each operation and with its single call
+to put or take, against the socket backend. Each backend is run over a Unix
+socket, where available, and over TCP, as wpt serve uses when binding to a
+host.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.stash [--processes 1 4] [--operations 2000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import socket
+import time
+import uuid
+
+from tools import localpaths  # noqa: F401
+
+from wptserve import stash
+
+
+class UncombinedStash(stash.Stash):
+    """Stash before put and take were each made a single call to the manager"""
+
+    def put(self, key, value, path=None):
+        internal_key = self._wrap_key(key, path)
+        if internal_key in self.data:
+            raise stash.StashError("Tried to overwrite existing shared stash value")
+        self.data[internal_key] = value
+
+    def take(self, key, path=None):
+        internal_key = self._wrap_key(key, path)
+        value = self.data.get(internal_key, None)
+        if value is not None:
+            try:
+                self.data.pop(internal_key)
+            except KeyError:
+                pass
+        return value
+
+
+def worker(stash_cls, address, authkey, backend, operations, results):
+    store = stash_cls("/", address, authkey, backend)
+    keys = [str(uuid.uuid4()) for _ in range(operations)]
+    start = time.time()
+    for key in keys:
+        store.put(key, "value")
+        if store.take(key) != "value":
+            raise ValueError("Took the wrong value")
+    results.put(time.time() - start)
+
+
+def run(stash_cls, backend, address, processes, operations):
+    server, address, authkey = stash.backends[backend](address, str(uuid.uuid4()))
+    try:
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=worker,
+                                           args=(stash_cls, address, authkey, backend,
+                                                 operations, results))
+                   for _ in range(processes)]
+        for process in workers:
+            process.start()
+        elapsed = max(results.get() for _ in workers)
+        for process in workers:
+            process.join()
+    finally:
+        server.shutdown()
+    # Each iteration is a put and a take
+    return 2 * processes * operations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4],
+                        help="Numbers of concurrent processes to test")
+    parser.add_argument("--operations", type=int, default=2000,
+                        help="Number of puts and takes made by each process")
+    args = parser.parse_args()
+
+    transports = [("tcp", ("127.0.0.1", 0))]
+    if hasattr(socket, "AF_UNIX"):
+        transports.insert(0, ("unix", None))
+    variants = [("manager (before)", UncombinedStash, "manager"),
+                ("manager", stash.Stash, "manager"),
+                ("socket", stash.Stash, "socket")]
+
+    print("%-10s %-10s %-18s %12s" % ("processes", "transport", "backend", "ops/s"))
+    for processes in args.processes:
+        for transport, address in transports:
+            for name, stash_cls, backend in variants:
+                rate = run(stash_cls, backend, address, processes, args.operations)
+                print("%-10d %-10s %-18s %12.0f" % (processes, transport, name, rate))
+
+
+if __name__ == "__main__":
+    main()
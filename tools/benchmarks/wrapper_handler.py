@@ -0,0 +1,99 @@
+"""Benchmark requests for the documents generated from .any.js, .worker.js
+and .window.js files through wptserve.
+
+Compares the wrapper handlers with their previous behaviour of reading the
+// META comments of the js file twice and rendering the whole wrapper on
+every request.
+
+Run from the root of the repository as:
+
+    python -m tools.benchmarks.wrapper_handler [--test fetch/cross-origin-resource-policy/fetch.any.js]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+
+from tools import localpaths  # noqa: F401
+
+import wptserve
+from manifest.sourcefile import read_script_metadata, js_meta_re
+from serve import serve
+from wptserve.handlers import HTTPException, filesystem_path
+
+from .python_handler import run_clients
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+
+
+class UncachedMixin(object):
+    """Restores the behaviour of wrapper handlers before the generated
+    documents were cached"""
+
+    def _get_template(self, request, path):
+        meta = "\n".join(self._get_meta(request))
+        script = "\n".join(self._get_script(request))
+        return self.wrapper % {"meta": serve.escape_format(meta),
+                               "script": serve.escape_format(script),
+                               "path": serve.escape_format(path),
+                               "query": "%(query)s"}
+
+    def _get_metadata(self, request):
+        path = self._get_path(filesystem_path(self.base_path, request, self.url_base), False)
+        try:
+            with open(path, "rb") as f:
+                for key, value in read_script_metadata(f, js_meta_re):
+                    yield key, value
+        except IOError:
+            raise HTTPException(404)
+
+
+handler_types = [(".any.html", serve.AnyHtmlHandler),
+                 (".any.worker.html", serve.WorkersHandler),
+                 (".any.sharedworker.html", serve.SharedWorkersHandler),
+                 (".any.worker.js", serve.AnyWorkerHandler)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", default="fetch/cross-origin-resource-policy/fetch.any.js",
+                        help="Path of the .any.js file to request, relative to the root of the repository")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="Number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="Number of requests made by each client")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    wptserve.logger.set_logger(logging.getLogger())
+
+    routes = []
+    for suffix, handler_cls in handler_types:
+        uncached_cls = type("Uncached" + handler_cls.__name__, (UncachedMixin, handler_cls), {})
+        routes.append(("GET", "/uncached/*" + suffix, uncached_cls(url_base="/uncached/")))
+        routes.append(("GET", "*" + suffix, handler_cls()))
+    server = wptserve.server.WebTestHttpd(host="localhost", port=0, use_ssl=False,
+                                          certificate=None, doc_root=wpt_root,
+                                          routes=routes)
+    server.start(False)
+    try:
+        test = args.test.replace(os.path.sep, "/")
+        assert test.endswith(".any.js")
+        print("%-24s %10s %10s" % ("suffix", "uncached", "cached"))
+        for suffix, _ in handler_types:
+            path = "/" + test[:-len(".any.js")] + suffix + "?query"
+            rates = []
+            for prefix in ["/uncached", ""]:
+                # Warm up
+                run_clients(server.port, prefix + path, 1, 10)
+                rates.append(run_clients(server.port, prefix + path, args.clients, args.requests))
+            print("%-24s %10.0f %10.0f" % (suffix, rates[0], rates[1]))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ if MYPY:
     from typing import cast
 
     T = TypeVar('T')
+    Rule = Tuple[bool, Pattern[str]]
+    MergedRules = Tuple[Optional[Pattern[str]], Optional[Pattern[str]]]
 
 
 end_space = re.compile(r"([^\\]\s)*$")
@@ -153,6 +155,8 @@ class PathFilter(object):
         self.literals_dir = defaultdict(dict)  # type: Dict[Optional[str], Dict[str, List[Tuple[bool, Pattern[str]]]]]
         self.patterns_file = []  # type: List[Tuple[Tuple[bool, Pattern[str]], List[Tuple[bool, Pattern[str]]]]]
         self.patterns_dir = []  # type: List[Tuple[Tuple[bool, Pattern[str]], List[Tuple[bool, Pattern[str]]]]]
+        self.compiled_file = (None, None)  # type: MergedRules
+        self.compiled_dir = (None, None)  # type: MergedRules
         self.cache = cache or {}  # type: MutableMapping[str, bool]
 
         if extras is None:
@@ -163,6 +167,7 @@ class PathFilter(object):
         else:
             args = None, extras
         self._read_ignore(*args)
+        self._compile()
 
     def _read_ignore(self, ignore_path, extras):
         # type: (Optional[str], List[str]) -> None
@@ -218,6 +223,28 @@ class PathFilter(object):
                 if not dir_only:
                     self.patterns_file.append((rule, []))
 
+    def _compile(self):
+        # type: () -> None
+        """Merge the patterns into a single regexp matching names and another
+        matching paths, for each of files and directories. These are used to
+        reject most paths with at most two matches, rather than trying every
+        pattern in turn; only paths that match one of the merged regexps
+        need to be checked against the individual patterns and their
+        exclusions."""
+        self.compiled_file = self._merge_patterns(self.patterns_file)
+        self.compiled_dir = self._merge_patterns(self.patterns_dir)
+
+    @staticmethod
+    def _merge_patterns(patterns):
+        # type: (List[Tuple[Rule, List[Rule]]]) -> MergedRules
+        rv = []  # type: List[Optional[Pattern[str]]]
+        for name_only in (True, False):
+            sources = ["(?:%s)" % pattern.pattern
+                       for (component_only, pattern), _ in patterns
+                       if component_only == name_only]
+            rv.append(re.compile("|".join(sources)) if sources else None)
+        return rv[0], rv[1]
+
     def filter(self,
                iterator  # type: Iterable[Tuple[str, List[Tuple[str, T]], List[Tuple[str, T]]]]
                ):
@@ -231,9 +258,12 @@ class PathFilter(object):
             keep_dirs = []  # type: List[Tuple[str, T]]
             keep_files = []  # type: List[Tuple[str, T]]
 
-            for iter_items, literals, patterns, target, suffix in [
-                    (dirnames, self.literals_dir, self.patterns_dir, keep_dirs, "/"),
-                    (filenames, self.literals_file, self.patterns_file, keep_files, "")]:
+            for iter_items, literals, patterns, compiled, target, suffix in [
+                    (dirnames, self.literals_dir, self.patterns_dir, self.compiled_dir, keep_dirs, "/"),
+                    (filenames, self.literals_file, self.patterns_file, self.compiled_file, keep_files, "")]:
+                name_re, path_re = compiled
+                dir_literals = literals.get(dirpath, empty)
+                any_literals = literals.get(None, empty)
                 for item in iter_items:
                     name = item[0]
                     if dirpath:
@@ -244,15 +274,21 @@ class PathFilter(object):
                         if not self.cache[path]:
                             target.append(item)
                         continue
-                    for rule_dir in [None, dirpath]:
-                        if name in literals.get(rule_dir, empty):
-                            exclude = literals[rule_dir][name]
+                    for rule_literals in (any_literals, dir_literals):
+                        if name in rule_literals:
+                            exclude = rule_literals[name]
                             if not any(rule.match(name if name_only else path)
                                        for name_only, rule in exclude):
                                 # Skip this item
                                 self.cache[path] = True
                                 break
                     else:
+                        if ((name_re is None or not name_re.match(name)) and
+                            (path_re is None or not path_re.match(path))):
+                            self.cache[path] = False
+                            target.append(item)
+                            continue
+
                         for (component_only, pattern), exclude in patterns:
                             if component_only:
                                 match = pattern.match(name)
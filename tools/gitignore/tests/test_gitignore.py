@@ -61,6 +61,17 @@ filter_data = [
     (["a.foo", "!a.py"],
      [("", ["foo"], ["a", "a.foo", "a.py"])],
      [(["foo"], ["a", "a.py"])]),
+    (["*.pyc", "b/*.txt", "c*/", "**/d/e", "!*/d/e"],
+     [("", ["b", "c1", "x"], ["a.pyc", "a.txt", "c2"]),
+      ("b", ["d"], ["a.txt", "a.py", "b.pyc"]),
+      ("b/d", [], ["e"]),
+      ("x", ["d"], ["a.txt"]),
+      ("x/d", [], ["e", "f"])],
+     [(["b", "x"], ["a.txt", "c2"]),
+      (["d"], ["a.py"]),
+      ([], ["e"]),
+      (["d"], ["a.txt"]),
+      ([], ["e", "f"])]),
 ]
 
 
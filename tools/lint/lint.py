@@ -3,6 +3,9 @@ from __future__ import print_function, unicode_literals
 import abc
 import argparse
 import ast
+import hashlib
+import inspect
+import io
 import json
 import logging
 import os
@@ -12,17 +15,22 @@ import sys
 import tempfile
 
 from collections import defaultdict
+from multiprocessing import Pool, cpu_count
 
 from . import fnmatch
 from . import rules
 from .. import localpaths
 from ..gitignore.gitignore import PathFilter
 from ..wpt import testfiles
+from ..manifest import XMLParser, deps, parsecache, sourcefile
+from ..manifest.deps import DependencyIndex, blob_id, decode, extract_references
+from ..manifest.parsecache import ParseCache
 from ..manifest.vcs import walk
 
 from ..manifest.sourcefile import SourceFile, js_meta_re, python_meta_re, space_chars, get_any_variants, get_default_any_variants
+import html5lib
 from six import binary_type, iteritems, itervalues, with_metaclass
-from six.moves import range
+from six.moves import range, zip
 from six.moves.urllib.parse import urlsplit, urljoin
 
 MYPY = False
@@ -42,10 +50,16 @@ if MYPY:
     from typing import Union
 
     Whitelist = Dict[Text, Dict[Text, Set[Optional[int]]]]
+    CacheEntry = Tuple[Text, List[rules.Error], Dict[Text, bool]]
+    LintResult = Tuple[List[rules.Error], Optional[List[rules.Error]], Optional[CacheEntry], Optional[Set[Text]]]
 
 
 logger = None  # type: Optional[logging.Logger]
 
+# Cache shared with the manifest update, into which the metadata of the
+# markup files that are parsed for linting is stored
+parse_cache = None  # type: Optional[ParseCache]
+
 def setup_logging(prefix=False):
     # type: (bool) -> None
     global logger
@@ -411,6 +425,14 @@ def check_parsed(repo_root, path, f):
 
     errors = []  # type: List[rules.Error]
 
+    parse_cache_key = source_file.parse_cache_key
+    if (parse_cache is not None and
+        parse_cache_key is not None and
+        not source_file.name_is_non_test):
+        # The lints below need the whole document, so the source file
+        # isn't given the cache to read from; only store what we parse
+        parse_cache.set(parse_cache_key, source_file.metadata_nodes)
+
     if path.startswith("css/"):
         if (source_file.type == "support" and
             not source_file.name_is_non_test and
@@ -748,6 +770,159 @@ def check_file_contents(repo_root, path, f):
     return errors
 
 
+def reference_paths(source_file):
+    # type: (SourceFile) -> List[Text]
+    """
+    Paths, relative to the repository root, of the reference files whose
+    existence is checked by ``check_parsed`` for ``source_file``.
+    """
+    rv = []  # type: List[Text]
+    for reftest_node in source_file.reftest_nodes:
+        href = reftest_node.attrib.get("href", "").strip(space_chars)
+        parts = urlsplit(href)
+        if parts.scheme or parts.netloc:
+            continue
+        ref_path = urlsplit(urljoin(source_file.url, href)).path
+        if ref_path:
+            rv.append(ref_path[1:])
+    return rv
+
+
+def lint_version():
+    # type: () -> Text
+    """
+    Identifier for the current set of lints, derived from the source of the
+    modules implementing them and parsing the files, and the html5lib
+    version. Cached results from a different version are discarded.
+    """
+    h = hashlib.sha1()
+    h.update(("%s.%s" % sys.version_info[:2]).encode("ascii"))
+    h.update(html5lib.__version__.encode("ascii"))
+    for module in (sys.modules[__name__], rules, fnmatch, sourcefile, XMLParser, parsecache,
+                   deps):
+        source_path = inspect.getsourcefile(module)
+        assert source_path is not None
+        with open(source_path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class LintCache(object):
+    """
+    On-disk cache of the results of the file content lints, keyed by path and
+    content hash. Since the NON-EXISTENT-REF lint depends on other files,
+    each entry also records whether the references of the file existed,
+    and is only used while that is unchanged.
+
+    :param path: the path of the cache file
+    """
+
+    def __init__(self, path):
+        # type: (str) -> None
+        self.path = path
+        self.version = lint_version()
+        self.data = {}  # type: Dict[Text, CacheEntry]
+        self.modified = False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        if data.get("version") == self.version:
+            self.data = data["files"]
+
+    def get(self, path):
+        # type: (Text) -> Optional[CacheEntry]
+        return self.data.get(path)
+
+    def set(self, path, entry):
+        # type: (Text, CacheEntry) -> None
+        if self.data.get(path) != entry:
+            self.data[path] = entry
+            self.modified = True
+
+    def dump(self):
+        # type: () -> None
+        if not self.modified:
+            return
+        dir_name = os.path.dirname(self.path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with tempfile.NamedTemporaryFile("w", dir=dir_name, delete=False) as f:
+            json.dump({"version": self.version, "files": self.data}, f)
+        os.rename(f.name, self.path)
+        self.modified = False
+
+
+def set_parse_cache(cache):
+    # type: (Optional[ParseCache]) -> None
+    global parse_cache
+    parse_cache = cache
+
+
+def could_be_test(source_file):
+    # type: (SourceFile) -> bool
+    """
+    Whether ``source_file`` could be a test, judging by its name, and so
+    might be stored in the dependency index.
+    """
+    return (not source_file.name_is_non_test and
+            (source_file.markup_type is not None or source_file.ext in (".js", ".py")))
+
+
+def lint_path(args):
+    # type: (Tuple[str, str, Optional[CacheEntry], bool, Optional[Text]]) -> LintResult
+    """
+    Runs the path and file content lints for a single path. This is a
+    module-level function so that it can be run on a worker process.
+
+    :param args: tuple of the repository root, the path of the file within
+                 the repository, the cached entry for the file or ``None``,
+                 whether the results are cached, and the hash stored for
+                 the file in the dependency index or ``None``
+    :returns: a tuple of the path errors, the file content errors (``None``
+              for directories), the new cache entry for the file (``None``
+              if the results aren't cached) and the paths it references,
+              if the results are cached and it could be a test that isn't
+              up to date in the dependency index (otherwise ``None``)
+    """
+    repo_root, path, cached, use_cache, indexed_hash = args
+    path_errors = check_path(repo_root, path)
+
+    abs_path = os.path.join(repo_root, path)
+    if os.path.isdir(abs_path):
+        return path_errors, None, None, None
+
+    with open(abs_path, "rb") as f:
+        data = f.read()
+    # The git object id, so that the dependency index can use it
+    content_hash = blob_id(data)
+    source_file = SourceFile(repo_root, path, "/", contents=data, parse_cache=parse_cache)
+    if (cached is not None and cached[0] == content_hash and
+        all(os.path.isfile(os.path.join(repo_root, ref_path)) == exists
+            for ref_path, exists in iteritems(cached[2]))):
+        file_errors = [(error_type, description, error_path, line_number)
+                       for error_type, description, error_path, line_number
+                       in cached[1]]  # type: List[rules.Error]
+        refs_exist = cached[2]
+    else:
+        file_errors = check_file_contents(repo_root, path, io.BytesIO(data))
+        refs_exist = {}
+        if (use_cache and
+            source_file.markup_type is not None and
+            not source_file.name_is_non_test):
+            # check_parsed has just stored the metadata in the parse cache,
+            # so this doesn't parse the file again
+            refs_exist = {ref_path: os.path.isfile(os.path.join(repo_root, ref_path))
+                          for ref_path in reference_paths(source_file)}
+    if not use_cache:
+        return path_errors, file_errors, None, None
+    references = None
+    if content_hash != indexed_hash and could_be_test(source_file):
+        references = extract_references(path.replace(os.path.sep, "/"), decode(data))
+    return path_errors, file_errors, (content_hash, file_errors, refs_exist), references
+
+
 def output_errors_text(errors):
     # type: (List[rules.Error]) -> None
     assert logger is not None
@@ -846,6 +1021,11 @@ def create_parser():
                         "option if the lint script exists outside the repository")
     parser.add_argument("--all", action="store_true", help="If no paths are passed, try to lint the whole "
                         "working directory, not just files that changed")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes to lint files with; 0 means one per CPU (default 1)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse the results for files whose contents are unchanged since the "
+                        "last run with this option, storing them under .wptcache")
     return parser
 
 
@@ -867,11 +1047,28 @@ def main(**kwargs):
 
     paths = lint_paths(kwargs, repo_root)
 
-    return lint(repo_root, paths, output_format)
+    cache_path = None  # type: Optional[str]
+    if kwargs.get(str("cache")):
+        cache_path = os.path.join(repo_root, str(".wptcache"), str("lint.json"))
 
+    return lint(repo_root, paths, output_format,
+                jobs=kwargs.get(str("jobs"), 1),
+                cache_path=cache_path)
 
-def lint(repo_root, paths, output_format):
-    # type: (str, List[str], str) -> int
+
+def lint(repo_root, paths, output_format, jobs=1, cache_path=None):
+    # type: (str, List[str], str, Optional[int], Optional[str]) -> int
+    """
+    Lint the given paths, printing any errors found.
+
+    :param jobs: the number of processes used to lint files; ``None`` or 0
+                 means one per CPU. Errors are reported in the order of
+                 ``paths`` regardless.
+    :param cache_path: the path of a file caching the results of the file
+                       content lints between runs, or ``None`` to disable
+                       caching
+    :returns: the number of errors
+    """
     error_count = defaultdict(int)  # type: Dict[Text, int]
     last = None
 
@@ -913,13 +1110,62 @@ def lint(repo_root, paths, output_format):
             paths.remove(path)
             continue
 
-        errors = check_path(repo_root, path)
-        last = process_errors(errors) or last
+    cache = None
+    if cache_path is not None:
+        cache = LintCache(cache_path)
+        set_parse_cache(ParseCache(os.path.join(os.path.dirname(cache_path), "parse.db")))
+
+    # The references of the files that are read are stored in the index used
+    # by tests-affected, so it doesn't need to read the same files again
+    index_entries = []  # type: List[Tuple[Text, Text, Set[Text]]]
+
+    index = None
+    indexed_hashes = {}  # type: Dict[Text, Text]
+    if cache_path is not None:
+        index = DependencyIndex(os.path.join(os.path.dirname(cache_path), "deps.db"))
+        indexed_hashes = index.hashes()
+
+    to_lint = [(repo_root, path, cache.get(path) if cache is not None else None,
+                cache is not None, indexed_hashes.get(path.replace(os.path.sep, "/")))
+               for path in paths]
+
+    if jobs is None or jobs < 1:
+        jobs = cpu_count()
+
+    pool = None
+    if jobs > 1 and len(to_lint) > 1:
+        pool = Pool(jobs, initializer=set_parse_cache, initargs=(parse_cache,))
+        results = pool.imap(lint_path, to_lint,
+                            chunksize=max(1, len(to_lint) // (jobs * 16)))  # type: Iterable[LintResult]
+    else:
+        results = (lint_path(item) for item in to_lint)
 
-        if not os.path.isdir(abs_path):
-            with open(abs_path, 'rb') as f:
-                errors = check_file_contents(repo_root, path, f)
-                last = process_errors(errors) or last
+    try:
+        for path, (path_errors, file_errors, cache_entry, references) in zip(paths, results):
+            last = process_errors(path_errors) or last
+            if file_errors is not None:
+                last = process_errors(file_errors) or last
+            if cache is not None and cache_entry is not None:
+                cache.set(path, cache_entry)
+            if references is not None:
+                assert cache_entry is not None
+                index_entries.append((path, cache_entry[0], references))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if cache is not None:
+        cache.dump()
+    if index is not None:
+        try:
+            if index_entries:
+                index.add(index_entries)
+        finally:
+            index.close()
+    if parse_cache is not None:
+        parse_cache.prune()
+        set_parse_cache(None)
 
     errors = check_all_paths(repo_root, paths)
     last = process_errors(errors) or last
@@ -1,12 +1,14 @@
 from __future__ import unicode_literals
 
 import os
+import shutil
 import sys
 
 import mock
 import six
 
 from ...localpaths import repo_root
+from ...manifest.deps import DependencyIndex
 from .. import lint as lint_mod
 from ..lint import filter_whitelist_errors, parse_whitelist, lint, create_parser
 
@@ -155,6 +157,95 @@ def test_lint_failing(caplog):
     assert "broken.html:1" in caplog.text
 
 
+def test_lint_parallel(caplog):
+    paths = ["broken.html", "okay.html", "about_blank.html", "dependency.html"]
+    rv = lint(_dummy_repo, list(paths), "normal")
+    serial_text = caplog.text
+    caplog.clear()
+
+    rv_parallel = lint(_dummy_repo, list(paths), "normal", jobs=2)
+    assert rv_parallel == rv
+    assert caplog.text == serial_text
+
+
+def test_lint_cache(caplog, tmpdir):
+    cache_path = str(tmpdir.join("lint.json"))
+    rv = lint(_dummy_repo, ["broken.html", "okay.html"], "normal", cache_path=cache_path)
+    assert rv == 1
+    assert os.path.exists(cache_path)
+    text = caplog.text
+    caplog.clear()
+
+    with _mock_lint("check_path") as mocked_check_path:
+        with _mock_lint("check_file_contents") as mocked_check_file_contents:
+            rv = lint(_dummy_repo, ["broken.html", "okay.html"], "normal", cache_path=cache_path)
+            assert rv == 1
+            assert mocked_check_path.call_count == 2
+            assert not mocked_check_file_contents.called
+    assert caplog.text == text
+
+
+def test_lint_cache_version(tmpdir):
+    cache_path = str(tmpdir.join("lint.json"))
+    lint(_dummy_repo, ["okay.html"], "normal", cache_path=cache_path)
+    with mock.patch(lint_mod.__name__ + ".lint_version", return_value="other"):
+        with _mock_lint("check_file_contents") as mocked_check_file_contents:
+            lint(_dummy_repo, ["okay.html"], "normal", cache_path=cache_path)
+            assert mocked_check_file_contents.call_count == 1
+
+
+def test_lint_cache_dependency_index(tmpdir):
+    cache_path = str(tmpdir.join("lint.json"))
+    lint(_dummy_repo, ["ref/existent_relative.html"], "normal", cache_path=cache_path)
+    index = DependencyIndex(str(tmpdir.join("deps.db")))
+    try:
+        assert index.referencing(["/ref/existent_relative-ref.html"]) == {
+            "ref/existent_relative.html"}
+    finally:
+        index.close()
+
+
+def test_lint_cache_dependency_index_unchanged(tmpdir):
+    cache_path = str(tmpdir.join("lint.json"))
+    paths = ["ref/existent_relative.html", "ref/existent_relative-ref.html"]
+    lint(_dummy_repo, list(paths), "normal", cache_path=cache_path)
+    with _mock_lint("extract_references") as mocked_extract_references:
+        lint(_dummy_repo, list(paths), "normal", cache_path=cache_path)
+        assert not mocked_extract_references.called
+
+    # The references aren't extracted again when only the lint cache is missing
+    os.remove(cache_path)
+    with _mock_lint("extract_references") as mocked_extract_references:
+        lint(_dummy_repo, list(paths), "normal", cache_path=cache_path)
+        assert not mocked_extract_references.called
+
+
+def test_lint_cache_dependency_index_non_test(tmpdir):
+    cache_path = str(tmpdir.join("lint.json"))
+    with _mock_lint("extract_references") as mocked_extract_references:
+        lint(_dummy_repo, ["lint.whitelist", "okay.html", "ref/existent_relative.html"], "normal",
+             cache_path=cache_path)
+        assert mocked_extract_references.call_count == 1
+        assert mocked_extract_references.call_args[0][0] == "ref/existent_relative.html"
+
+
+def test_lint_cache_deleted_reference(caplog, tmpdir):
+    repo = tmpdir.mkdir("repo")
+    repo.join("lint.whitelist").write("")
+    ref_dir = repo.mkdir("ref")
+    for name in ["existent_relative.html", "existent_relative-ref.html"]:
+        shutil.copy(os.path.join(_dummy_repo, "ref", name), str(ref_dir.join(name)))
+    cache_path = str(tmpdir.join("lint.json"))
+
+    rv = lint(str(repo), ["ref/existent_relative.html"], "normal", cache_path=cache_path)
+    assert rv == 0
+
+    ref_dir.join("existent_relative-ref.html").remove()
+    rv = lint(str(repo), ["ref/existent_relative.html"], "normal", cache_path=cache_path)
+    assert rv == 1
+    assert "NON-EXISTENT-REF" in caplog.text
+
+
 def test_ref_existent_relative(caplog):
     with _mock_lint("check_path") as mocked_check_path:
         with _mock_lint("check_file_contents") as mocked_check_file_contents:
@@ -443,7 +534,9 @@ def test_main_with_args():
                 m.assert_called_once_with(repo_root,
                                           [os.path.relpath(os.path.join(os.getcwd(), x), repo_root)
                                            for x in ['a', 'b', 'c']],
-                                          "normal")
+                                          "normal",
+                                          jobs=1,
+                                          cache_path=None)
     finally:
         sys.argv = orig_argv
 
@@ -455,7 +548,23 @@ def test_main_no_args():
         with _mock_lint('lint', return_value=True) as m:
             with _mock_lint('changed_files', return_value=['foo', 'bar']):
                 lint_mod.main(**vars(create_parser().parse_args()))
-                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal")
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal",
+                                          jobs=1,
+                                          cache_path=None)
+    finally:
+        sys.argv = orig_argv
+
+
+def test_main_cache():
+    orig_argv = sys.argv
+    try:
+        sys.argv = ['./lint', '--cache']
+        with _mock_lint('lint', return_value=True) as m:
+            with _mock_lint('changed_files', return_value=['foo', 'bar']):
+                lint_mod.main(**vars(create_parser().parse_args()))
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal",
+                                          jobs=1,
+                                          cache_path=os.path.join(repo_root, ".wptcache", "lint.json"))
     finally:
         sys.argv = orig_argv
 
@@ -467,6 +576,8 @@ def test_main_all():
         with _mock_lint('lint', return_value=True) as m:
             with _mock_lint('all_filesystem_paths', return_value=['foo', 'bar']):
                 lint_mod.main(**vars(create_parser().parse_args()))
-                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal")
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal",
+                                          jobs=1,
+                                          cache_path=None)
     finally:
         sys.argv = orig_argv
@@ -0,0 +1,50 @@
+import argparse
+import os
+
+from . import manifest
+from .log import get_logger
+
+here = os.path.dirname(__file__)
+
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
+
+logger = get_logger()
+
+MYPY = False
+if MYPY:
+    # MYPY is set to True when run under Mypy.
+    from typing import Any
+
+
+def convert(tests_root, src, dest):
+    # type: (str, str, str) -> None
+    """Convert the manifest at src to the format implied by the
+    extension of dest (see manifest.write)"""
+    m = manifest._load(logger, tests_root, src, allow_cached=False)
+    if m is None:
+        raise manifest.ManifestError("Failed to load manifest from %s" % src)
+    manifest.write(m, dest)
+
+
+def abs_path(path):
+    # type: (str) -> str
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def create_parser():
+    # type: () -> argparse.ArgumentParser
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "src", type=abs_path, help="Path to existing manifest file (JSON or database).")
+    parser.add_argument(
+        "dest", type=abs_path,
+        help="Path to output manifest file; a %s extension selects the database format, "
+        "anything else JSON." % manifest.db.extension)
+    parser.add_argument(
+        "--tests-root", type=abs_path, default=wpt_root, help="Path to root of tests.")
+    return parser
+
+
+def run(*args, **kwargs):
+    # type: (*Any, **Any) -> None
+    convert(kwargs["tests_root"], kwargs["src"], kwargs["dest"])
@@ -0,0 +1,279 @@
+"""SQLite-backed storage for the manifest.
+
+This is an alternative on-disk format to MANIFEST.json. Rather than
+decoding the whole document on load, the path hashes and the items for
+each test type are stored in indexed tables and only decoded when they
+are accessed, so loading a subset of the manifest costs time proportional
+to the amount of data that is actually used."""
+
+import json
+import os
+import sqlite3
+from collections import MutableMapping
+
+from six import binary_type, iteritems, text_type
+
+from .utils import from_os_path, to_os_path
+
+MYPY = False
+if MYPY:
+    # MYPY is set to True when run under Mypy.
+    from typing import Any
+    from typing import Dict
+    from typing import Iterator
+    from typing import List
+    from typing import Optional
+    from typing import Set
+    from typing import Text
+    from typing import Tuple
+    from typing import Union
+
+extension = ".db"
+
+_magic = b"SQLite format 3\0"
+
+_schema = [
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE paths (path TEXT PRIMARY KEY, hash TEXT NOT NULL, type TEXT NOT NULL)",
+    "CREATE TABLE items (type TEXT NOT NULL, path TEXT NOT NULL, data TEXT NOT NULL, "
+    "PRIMARY KEY (type, path))",
+]
+
+
+def _to_text(value):
+    # type: (Union[bytes, Text]) -> Text
+    if isinstance(value, binary_type):
+        return value.decode("utf8")
+    return value
+
+
+def is_db_path(path):
+    # type: (Union[bytes, Text]) -> bool
+    """Return whether a path should be written using this format"""
+    return _to_text(path).endswith(extension)
+
+
+def is_db(path):
+    # type: (Union[bytes, Text]) -> bool
+    """Return whether an existing file is a manifest database"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(_magic)) == _magic
+    except IOError:
+        return False
+
+
+def connect(path):
+    # type: (Union[bytes, Text]) -> Tuple[sqlite3.Connection, Dict[Text, Any]]
+    """Open a manifest database read-only.
+
+    :returns: Tuple of (connection, metadata dict)"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    try:
+        meta = {key: json.loads(value)
+                for key, value in conn.execute("SELECT key, value FROM meta")}
+    except sqlite3.DatabaseError:
+        conn.close()
+        raise ValueError("%s is not a manifest database" % path)
+    return conn, meta
+
+
+def write(obj, path):
+    # type: (Dict[Text, Any], Union[bytes, Text]) -> None
+    """Write the JSON-compatible representation of a manifest, as returned
+    by Manifest.to_json, to a database at path.
+
+    The database is built in a temporary file that replaces any existing
+    file at path once it is complete, so that readers never see a partial
+    manifest."""
+    tmp_path = path + (b".tmp" if isinstance(path, binary_type) else u".tmp")
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        for statement in _schema:
+            conn.execute(statement)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [(key, json.dumps(obj[key]))
+                          for key in ("url_base", "version", "revision", "local_changes")
+                          if key in obj])
+        conn.executemany("INSERT INTO paths VALUES (?, ?, ?)",
+                         ((rel_path, _to_text(file_hash), item_type)
+                          for rel_path, (file_hash, item_type) in iteritems(obj["paths"])))
+        for item_type, type_paths in iteritems(obj["items"]):
+            conn.executemany("INSERT INTO items VALUES (?, ?, ?)",
+                             ((item_type, rel_path, json.dumps(tests, separators=(',', ':')))
+                              for rel_path, tests in iteritems(type_paths)))
+        conn.commit()
+    finally:
+        conn.close()
+
+    if os.name == "nt" and os.path.exists(path):
+        os.unlink(path)
+    os.rename(tmp_path, path)
+
+
+class DbMapping(MutableMapping):  # type: ignore
+    """Mapping backed by a table of a manifest database.
+
+    Lookups query the database directly, so that only the entries that are
+    accessed get decoded. Modifications are kept in memory and never written
+    back to the database."""
+
+    key_column = None  # type: str
+    table = None  # type: str
+
+    def __init__(self, conn, where="", args=()):
+        # type: (sqlite3.Connection, str, Tuple[Any, ...]) -> None
+        self.conn = conn
+        self.where = where
+        self.args = args
+        self.overlay = {}  # type: Dict[Text, Any]
+        self.deleted = set()  # type: Set[Text]
+
+    def _query(self, columns, extra_where="", extra_args=()):
+        # type: (str, str, Tuple[Any, ...]) -> sqlite3.Cursor
+        clauses = [item for item in (self.where, extra_where) if item]
+        sql = "SELECT %s FROM %s" % (columns, self.table)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return self.conn.execute(sql, self.args + extra_args)
+
+    def to_db_key(self, key):
+        # type: (Union[bytes, Text]) -> Text
+        return _to_text(key)
+
+    def from_db_key(self, key):
+        # type: (Text) -> Text
+        return key
+
+    def decode(self, row):
+        # type: (Tuple[Any, ...]) -> Any
+        raise NotImplementedError
+
+    def value_columns(self):
+        # type: () -> str
+        raise NotImplementedError
+
+    def _db_get(self, key):
+        # type: (Text) -> Optional[Tuple[Any, ...]]
+        row = self._query(self.value_columns(),
+                          "%s = ?" % self.key_column,
+                          (key,)).fetchone()  # type: Optional[Tuple[Any, ...]]
+        return row
+
+    def __getitem__(self, key):
+        # type: (Union[bytes, Text]) -> Any
+        db_key = self.to_db_key(key)
+        if db_key in self.overlay:
+            return self.overlay[db_key]
+        if db_key in self.deleted:
+            raise KeyError(key)
+        row = self._db_get(db_key)
+        if row is None:
+            raise KeyError(key)
+        return self.decode(row)
+
+    def __contains__(self, key):
+        # type: (Any) -> bool
+        db_key = self.to_db_key(key)
+        if db_key in self.overlay:
+            return True
+        if db_key in self.deleted:
+            return False
+        return self._db_get(db_key) is not None
+
+    def __setitem__(self, key, value):
+        # type: (Union[bytes, Text], Any) -> None
+        db_key = self.to_db_key(key)
+        self.deleted.discard(db_key)
+        self.overlay[db_key] = value
+
+    def __delitem__(self, key):
+        # type: (Union[bytes, Text]) -> None
+        db_key = self.to_db_key(key)
+        in_db = db_key not in self.deleted and self._db_get(db_key) is not None
+        if db_key in self.overlay:
+            del self.overlay[db_key]
+        elif not in_db:
+            raise KeyError(key)
+        if in_db:
+            self.deleted.add(db_key)
+
+    def __iter__(self):
+        # type: () -> Iterator[Text]
+        for db_key in self.overlay:
+            yield self.from_db_key(db_key)
+        for (db_key,) in self._query(self.key_column).fetchall():
+            if db_key not in self.overlay and db_key not in self.deleted:
+                yield self.from_db_key(db_key)
+
+    def iteritems(self):
+        # type: () -> Iterator[Tuple[Text, Any]]
+        for db_key, value in iteritems(self.overlay):
+            yield self.from_db_key(db_key), value
+        for row in self._query("%s, %s" % (self.key_column, self.value_columns())).fetchall():
+            if row[0] not in self.overlay and row[0] not in self.deleted:
+                yield self.from_db_key(row[0]), self.decode(row[1:])
+
+    def items(self):
+        # type: () -> List[Tuple[Text, Any]]
+        return list(self.iteritems())
+
+    def __len__(self):
+        # type: () -> int
+        rv = self._query("COUNT(*)").fetchone()[0] - len(self.deleted)  # type: int
+        for db_key in self.overlay:
+            if db_key in self.deleted or self._db_get(db_key) is None:
+                rv += 1
+        return rv
+
+
+class DbPathHash(DbMapping):
+    """Mapping of os path -> (hash, item type), replacing Manifest._path_hash"""
+
+    key_column = "path"
+    table = "paths"
+
+    def to_db_key(self, key):
+        # type: (Union[bytes, Text]) -> Text
+        return from_os_path(_to_text(key))
+
+    def from_db_key(self, key):
+        # type: (Text) -> Text
+        return to_os_path(key)
+
+    def value_columns(self):
+        # type: () -> str
+        return "hash, type"
+
+    def decode(self, row):
+        # type: (Tuple[Any, ...]) -> Tuple[Text, Text]
+        return row[0], row[1]
+
+
+class DbTypeJson(DbMapping):
+    """Mapping of url path -> JSON data of the items of one test type,
+    usable as TypeData.json_data"""
+
+    key_column = "path"
+    table = "items"
+
+    def __init__(self, conn, item_type):
+        # type: (sqlite3.Connection, Text) -> None
+        super(DbTypeJson, self).__init__(conn, "type = ?", (text_type(item_type),))
+
+    def value_columns(self):
+        # type: () -> str
+        return "data"
+
+    def decode(self, row):
+        # type: (Tuple[Any, ...]) -> Any
+        return json.loads(row[0])
+
+
+def item_types(conn):
+    # type: (sqlite3.Connection) -> Set[Text]
+    """Set of test types that have items in the database"""
+    return {row[0] for row in conn.execute("SELECT DISTINCT type FROM items")}
@@ -0,0 +1,318 @@
+"""Index of the files referenced by each test.
+
+``wpt tests-affected`` needs the tests that use a changed support file.
+Rather than reading every test on each run, the paths referenced by each
+test (every run of characters that can appear in a URL and contains a
+``/`` or ``.``, and the interfaces used with idlharness.js) are extracted
+once and stored in an SQLite database together with the content hash of
+the test. The database has an index from referenced path to test, so
+finding the tests that reference a set of files is a single query.
+:py:meth:`DependencyIndex.update` refreshes the entries from the hashes
+recorded in the manifest, so only tests that changed since the last
+update are read again. Other tools that read the files anyway, like
+lint, can add entries with :py:meth:`DependencyIndex.add`, so that the next
+update doesn't need to read those files again.
+
+References are only found where the full path, or a path relative to the
+test, appears in the test; a test that builds a URL at runtime from
+several parts isn't found. This finds at least the tests that searching
+the contents of every test for the changed paths finds."""
+
+import hashlib
+import os
+import posixpath
+import re
+import sqlite3
+from multiprocessing import Pool, cpu_count
+
+from six import binary_type
+from six.moves.urllib.parse import unquote
+
+from .utils import from_os_path
+
+MYPY = False
+if MYPY:
+    # MYPY is set to True when run under Mypy.
+    from typing import Dict
+    from typing import Iterable
+    from typing import Optional
+    from typing import Set
+    from typing import Text
+    from typing import Tuple
+    from typing import Union
+
+# Bump this whenever the way references are extracted changes
+version = 2
+
+_schema = [
+    "CREATE TABLE IF NOT EXISTS tests (path TEXT PRIMARY KEY, hash TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS refs (ref TEXT NOT NULL, path TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS refs_ref ON refs (ref)",
+    "CREATE INDEX IF NOT EXISTS refs_path ON refs (path)",
+]
+
+# Runs of characters that can be part of a URL, without regard to any
+# quotes around them, since pairing up quotes goes wrong in scripts, e.g. in
+# location.pathname.replace(/[^\/]+$/, '')+'resources/a.py'. Characters that
+# separate a URL from the surrounding markup or code, like =, (, ), [, ], {
+# and }, aren't included, so a URL template like
+# http://{{host}}:{{ports[http][0]}}/common/utils.js ends in a run holding
+# its path. Closing tags aren't URLs, so runs starting after a < are
+# skipped.
+_reference_re = re.compile(r"(?<!<)[\w.~:/?#@%&+!$-]+", re.UNICODE)
+
+# Quoted names of the interfaces used by idlharness.js tests
+_interface_re = re.compile(r"""["'`]([\w.-]+?)(?:\.idl)?(?=["'`])""", re.UNICODE)
+
+# Literals longer than this are assumed not to be URLs
+_max_reference_length = 1000
+
+# Below this many files to read, starting worker processes costs more than
+# it saves
+_parallel_min_files = 100
+
+
+def decode(data):
+    # type: (bytes) -> Text
+    """Decode the contents of a test file, using any UTF-16 BOM"""
+    if data.startswith(b"\xfe\xff"):
+        return data.decode("utf-16be", "replace")
+    if data.startswith(b"\xff\xfe"):
+        return data.decode("utf-16le", "replace")
+    return data.decode("utf8", "replace")
+
+
+def blob_id(data):
+    # type: (bytes) -> Text
+    """Get the git object id of a file with the given contents, which is
+    also the hash the manifest records for it"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def resolve(base_dir, value):
+    # type: (Text, Text) -> Optional[Text]
+    """Get the path in the repository, starting with /, that a URL
+    found in a test refers to, or None if it can't refer to a file.
+
+    :param base_dir: Directory containing the test, starting with /
+    :param value: URL as it appears in the test"""
+    if len(value) > _max_reference_length:
+        return None
+    value = unquote(value).split("#", 1)[0].split("?", 1)[0]
+    if "://" in value or value.startswith("//"):
+        # Only the path matters; the host is usually a template, e.g.
+        # http://{{host}}:{{ports[http][0]}}/common/utils.js, which
+        # urlsplit rejects
+        host_start = value.index("//") + 2
+        path_start = value.find("/", host_start)
+        if path_start == -1:
+            return None
+        value = value[path_start:]
+    if not value or value.endswith("/") or ("." not in value and "/" not in value):
+        return None
+    path = posixpath.normpath(posixpath.join(base_dir, value))
+    if path.startswith("//"):
+        path = path[1:]
+    return path
+
+
+def extract_references(rel_path, contents):
+    # type: (Text, Text) -> Set[Text]
+    """Get the set of paths, starting with /, that a test refers to.
+
+    :param rel_path: Path of the test relative to the root of the repository,
+                     using / as the separator
+    :param contents: Decoded contents of the test"""
+    base_dir = posixpath.dirname("/" + rel_path)
+    refs = set()
+    for match in _reference_re.finditer(contents):
+        value = match.group(0)
+        path = resolve(base_dir, value)
+        if path is not None:
+            refs.add(path)
+        if "/" not in value:
+            continue
+        # Tests also build URLs by adding a path to a prefix, e.g.
+        # "xhr/resources/a.py" in /xhr/test.html may be resolved against the
+        # root or against the test, so the paths that the end of the URL
+        # refers to, starting at each /, are also added, either from the
+        # root or relative to the test
+        value = unquote(value).split("#", 1)[0].split("?", 1)[0]
+        start = value.find("/", 1)
+        while start != -1:
+            for suffix in (value[start:], value[start + 1:]):
+                path = resolve(base_dir, suffix)
+                if path is not None:
+                    refs.add(path)
+            start = value.find("/", start + 1)
+
+    if "idlharness.js" in contents:
+        # idl_test and friends take the names of the interfaces in
+        # /interfaces that they load
+        for match in _interface_re.finditer(contents):
+            refs.add("/interfaces/%s.idl" % match.group(1))
+    return refs
+
+
+def read_references(args):
+    # type: (Tuple[Union[bytes, Text], Text]) -> Tuple[Text, Optional[Set[Text]]]
+    """Read a test and extract its references. This is a module-level
+    function so that it can be run on a worker process.
+
+    :param args: Tuple of the root of the repository and the path of the
+                 test relative to it, using / as the separator
+    :returns: Tuple of the path and the references, or None if the test
+              couldn't be read"""
+    tests_root, path = args
+    try:
+        with open(os.path.join(tests_root, path), "rb") as f:
+            contents = decode(f.read())
+    except (IOError, OSError):
+        return path, None
+    return path, extract_references(path, contents)
+
+
+class DependencyIndex(object):
+    def __init__(self, path):
+        # type: (Union[bytes, Text]) -> None
+        """SQLite-backed index of the paths referenced by each test.
+
+        :param path: Path to the index database"""
+        self.path = path
+        self._conn = None  # type: Optional[sqlite3.Connection]
+
+    @property
+    def conn(self):
+        # type: () -> sqlite3.Connection
+        if self._conn is None:
+            dir_path = os.path.dirname(self.path)
+            if dir_path and not os.path.exists(dir_path):
+                try:
+                    os.makedirs(dir_path)
+                except OSError:
+                    # Another process may have created it in the meantime
+                    if not os.path.isdir(dir_path):
+                        raise
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA synchronous = OFF")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+                conn.execute("DROP TABLE IF EXISTS tests")
+                conn.execute("DROP TABLE IF EXISTS refs")
+                conn.execute("PRAGMA user_version = %d" % version)
+            for statement in _schema:
+                conn.execute(statement)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def update(self, tests_root, tests, jobs=1):
+        # type: (Union[bytes, Text], Iterable[Tuple[Text, Text]], Optional[int]) -> int
+        """Bring the index up to date with a set of tests. Tests that are
+        not in the index, or whose hash differs from the one in the index,
+        are read and have their references extracted; tests in the index
+        that are not in the set are removed.
+
+        :param tests_root: Path to the root of the repository
+        :param tests: Iterable of (path, hash) for every test, where path is
+                      relative to tests_root
+        :param jobs: Number of processes used to read the tests; ``None`` or
+                     0 means one per CPU
+        :returns: The number of tests that were read"""
+        conn = self.conn
+        stored = self.hashes()
+        current = {}
+        for rel_path, file_hash in tests:
+            if isinstance(file_hash, binary_type):
+                file_hash = file_hash.decode("ascii")
+            current[from_os_path(rel_path)] = file_hash
+
+        outdated = [path for path in stored if current.get(path) != stored[path]]
+        to_read = [(tests_root, path) for path, file_hash in current.items()
+                   if stored.get(path) != file_hash]
+
+        with conn:
+            self._remove(outdated)
+
+        if jobs is None or jobs < 1:
+            jobs = cpu_count()
+
+        pool = None
+        if jobs > 1 and len(to_read) > _parallel_min_files:
+            pool = Pool(jobs)
+            chunksize = max(1, len(to_read) // (jobs * 16))
+            results = pool.imap_unordered(read_references, to_read,
+                                          chunksize)  # type: Iterable[Tuple[Text, Optional[Set[Text]]]]
+        else:
+            results = (read_references(item) for item in to_read)
+
+        try:
+            # Tests that couldn't be read aren't stored, so they're read
+            # again on the next update
+            with conn:
+                self._store((path, current[path], refs) for path, refs in results
+                            if refs is not None)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return len(to_read)
+
+    def hashes(self):
+        # type: () -> Dict[Text, Text]
+        """Get the hash stored for each test in the index, keyed by the path
+        of the test relative to the root of the repository, using / as the
+        separator"""
+        return dict(self.conn.execute("SELECT path, hash FROM tests"))
+
+    def add(self, entries):
+        # type: (Iterable[Tuple[Text, Text, Iterable[Text]]]) -> None
+        """Store the references of files that were read elsewhere. Entries
+        for files that aren't tests are removed by the next update.
+
+        :param entries: Iterable of (path, hash, references), with the path
+                        relative to the root of the repository"""
+        conn = self.conn
+        stored = self.hashes()
+        entries = [(from_os_path(path), file_hash, refs) for path, file_hash, refs in entries]
+        entries = [item for item in entries if stored.get(item[0]) != item[1]]
+        with conn:
+            self._remove(item[0] for item in entries if item[0] in stored)
+            self._store(entries)
+
+    def _remove(self, paths):
+        # type: (Iterable[Text]) -> None
+        rows = [(path,) for path in paths]
+        self.conn.executemany("DELETE FROM tests WHERE path = ?", rows)
+        self.conn.executemany("DELETE FROM refs WHERE path = ?", rows)
+
+    def _store(self, entries):
+        # type: (Iterable[Tuple[Text, Text, Iterable[Text]]]) -> None
+        conn = self.conn
+        for path, file_hash, refs in entries:
+            conn.executemany("INSERT INTO refs VALUES (?, ?)",
+                             ((ref, path) for ref in refs))
+            conn.execute("INSERT INTO tests VALUES (?, ?)", (path, file_hash))
+
+    def referencing(self, paths):
+        # type: (Iterable[Text]) -> Set[Text]
+        """Get the tests that reference any of a set of paths.
+
+        :param paths: Paths starting with /, relative to the root of the
+                      repository and using / as the separator
+        :returns: Set of test paths relative to the root of the repository,
+                  using / as the separator"""
+        paths = list(paths)
+        rv = set()  # type: Set[Text]
+        # Stay below SQLite's limit on the number of parameters in a query
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            query = ("SELECT DISTINCT path FROM refs WHERE ref IN (%s)" %
+                     ", ".join("?" * len(chunk)))
+            rv.update(row[0] for row in self.conn.execute(query, chunk))
+        return rv
+
+    def close(self):
+        # type: () -> None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -2,9 +2,10 @@ import itertools
 import json
 import os
 from collections import MutableMapping, defaultdict
-from six import iteritems, iterkeys, itervalues, string_types, binary_type, text_type
+from multiprocessing import Pool, cpu_count
+from six import PY3, iteritems, iterkeys, itervalues, string_types, binary_type, text_type
 
-from . import vcs
+from . import db, vcs
 from .item import (ConformanceCheckerTest, ManifestItem, ManualTest, RefTest, RefTestNode,
                    SupportFile, TestharnessTest, VisualTest, WebDriverSpecTest)
 from .log import get_logger
@@ -38,6 +39,10 @@ except ImportError:
 
 CURRENT_VERSION = 6
 
+# Below this number of changed files the cost of starting a process pool
+# outweighs the time saved by parsing the files in parallel.
+PARALLEL_MIN_FILES = 25
+
 
 class ManifestError(Exception):
     pass
@@ -77,7 +82,7 @@ class TypeData(TypeDataType):
         over the class."""
         self.manifest = manifest
         self.type_cls = type_cls
-        self.json_data = {}  # type: Optional[Dict[Text, List[Any]]]
+        self.json_data = {}  # type: Optional[MutableMapping[Text, List[Any]]]
         self.tests_root = None  # type: Optional[str]
         self.data = {}  # type: Dict[Text, Set[ManifestItem]]
 
@@ -169,15 +174,15 @@ class TypeData(TypeDataType):
                 if key in self.data:
                     continue
                 data = set()
-                for test in self.json_data.get(path, []):
+                for test in value:
                     manifest_item = self.type_cls.from_json(self.manifest, path, test)
                     data.add(manifest_item)
                 self.data[key] = data
             self.json_data = None
 
     def set_json(self, tests_root, data):
-        # type: (str, Dict[Text, Any]) -> None
-        if not isinstance(data, dict):
+        # type: (str, MutableMapping[Text, Any]) -> None
+        if not isinstance(data, MutableMapping):
             raise ValueError("Got a %s expected a dict" % (type(data)))
         self.tests_root = tests_root
         self.json_data = data
@@ -191,10 +196,12 @@ class TypeData(TypeDataType):
         }
 
         if self.json_data is not None:
-            if not data:
+            if not data and isinstance(self.json_data, dict):
                 # avoid copying if there's nothing here yet
                 return self.json_data
-            data.update(self.json_data)
+            # Iterate over the items so that a database is read in one query
+            # rather than one per path
+            data.update(iteritems(self.json_data))
 
         return data
 
@@ -249,6 +256,10 @@ class Manifest(object):
         self._reftest_nodes_by_url = None  # type: Optional[Dict[Text, Union[RefTest, RefTestNode]]]
         self.tests_root = tests_root  # type: Optional[str]
         self.url_base = url_base  # type: Text
+        # The git commit the manifest was last updated from, and the files
+        # that differed from that commit at the time, if known.
+        self.revision = None  # type: Optional[Text]
+        self.local_changes = []  # type: List[Text]
 
     def __iter__(self):
         # type: () -> Iterable[Tuple[str, Text, Set[ManifestItem]]]
@@ -261,6 +272,14 @@ class Manifest(object):
                 tests = self._data[item_type][path]
                 yield item_type, path, tests
 
+    def iterhashes(self, *types):
+        # type: (*str) -> Iterable[Tuple[Text, Text]]
+        """Get (path, hash) for each file containing items of the given
+        types, or of any type if none are given"""
+        for path, (file_hash, item_type) in iteritems(self._path_hash):
+            if not types or item_type in types:
+                yield path, file_hash
+
     def iterpath(self, path):
         # type: (Text) -> Iterable[ManifestItem]
         for type_tests in self._data.values():
@@ -296,15 +315,19 @@ class Manifest(object):
         # type: (Text) -> Optional[ManifestItem]
         return self.reftest_nodes_by_url.get(url)
 
-    def update(self, tree):
-        # type: (Iterable[Tuple[Union[SourceFile, bytes], bool]]) -> bool
+    def update(self, tree, jobs=1):
+        # type: (Iterable[Tuple[Union[SourceFile, bytes, Text], bool]], Optional[int]) -> bool
         """Update the manifest given an iterable of items that make up the updated manifest.
 
         The iterable must either generate tuples of the form (SourceFile, True) for paths
         that are to be updated, or (path, False) for items that are not to be updated. This
         unusual API is designed as an optimistaion meaning that SourceFile items need not be
         constructed in the case we are not updating a path, but the absence of an item from
-        the iterator may be used to remove defunct entries from the manifest."""
+        the iterator may be used to remove defunct entries from the manifest.
+
+        :param jobs: Number of processes used to parse the updated files; ``None``
+                     or 0 means one per CPU. Results are always merged on the
+                     calling process."""
         all_reftest_nodes = []  # type: List[Tuple[ManifestItem, Text]]
         seen_files = set()  # type: Set[Text]
 
@@ -320,30 +343,53 @@ class Manifest(object):
 
         reftest_types = ("reftest", "reftest_node")
 
-        for source_file, update in tree:
-            if not update:
-                assert isinstance(source_file, (binary_type, text_type))
-                rel_path = source_file  # type: Text
-                seen_files.add(rel_path)
-                assert rel_path in path_hash
-                old_hash, old_type = path_hash[rel_path]  # type: Tuple[Text, Text]
-                if old_type in reftest_types:
-                    manifest_items = data[old_type][rel_path]  # type: Iterable[ManifestItem]
-                    all_reftest_nodes.extend((item, old_hash) for item in manifest_items)
+        def updated_files():
+            # type: () -> Iterator[Tuple[SourceFile, Optional[Text]]]
+            for source_file, update in tree:
+                if not update:
+                    assert isinstance(source_file, (binary_type, text_type))
+                    rel_path = source_file  # type: Text
+                    seen_files.add(rel_path)
+                    assert rel_path in path_hash
+                    old_hash, old_type = path_hash[rel_path]  # type: Tuple[Text, Text]
+                    if old_type in reftest_types:
+                        manifest_items = data[old_type][rel_path]  # type: Iterable[ManifestItem]
+                        all_reftest_nodes.extend((item, old_hash) for item in manifest_items)
+                else:
+                    assert not isinstance(source_file, (binary_type, text_type))
+                    seen_files.add(source_file.rel_path)
+                    old_entry = path_hash.get(source_file.rel_path)
+                    yield source_file, old_entry[0] if old_entry is not None else None
+
+        if jobs is None or jobs < 1:
+            jobs = cpu_count()
+
+        pool = None
+        if jobs > 1:
+            # The tree has to be fully consumed on this process before
+            # handing work to the pool, since iterating it mutates the
+            # local state above.
+            to_update = list(updated_files())  # type: List[Tuple[SourceFile, Optional[Text]]]
+            if len(to_update) > PARALLEL_MIN_FILES:
+                pool = Pool(jobs)
+                chunksize = max(1, len(to_update) // (jobs * 16))
+                results = pool.imap(compute_manifest_items, to_update,
+                                    chunksize)  # type: Iterable[Tuple[Text, Text, Optional[Text], Optional[Iterable[ManifestItem]]]]
             else:
-                assert not isinstance(source_file, bytes)
-                rel_path = source_file.rel_path
-                seen_files.add(rel_path)
-
-                file_hash = source_file.hash  # type: Text
+                results = map(compute_manifest_items, to_update)
+        elif PY3:
+            results = map(compute_manifest_items, updated_files())
+        else:
+            results = itertools.imap(compute_manifest_items, updated_files())
 
+        try:
+            for rel_path, file_hash, new_type, manifest_items in results:
                 is_new = rel_path not in path_hash  # type: bool
                 hash_changed = False  # type: bool
 
                 if not is_new:
                     old_hash, old_type = path_hash[rel_path]
-                    if old_hash != file_hash:
-                        new_type, manifest_items = source_file.manifest_items()
+                    if new_type is not None:
                         hash_changed = True
                         if new_type != old_type:
                             del data[old_type][rel_path]
@@ -353,19 +399,24 @@ class Manifest(object):
                         new_type = old_type
                         if old_type in reftest_types:
                             manifest_items = data[old_type][rel_path]
-                else:
-                    new_type, manifest_items = source_file.manifest_items()
 
+                assert new_type is not None
                 if new_type in reftest_types:
+                    assert manifest_items is not None
                     all_reftest_nodes.extend((item, file_hash) for item in manifest_items)
                     if is_new or hash_changed:
                         reftest_changes = True
                 elif is_new or hash_changed:
+                    assert manifest_items is not None
                     data[new_type][rel_path] = set(manifest_items)
 
                 if is_new or hash_changed:
                     path_hash[rel_path] = (file_hash, new_type)
                     changed = True
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         deleted = prev_files - seen_files
         if deleted:
@@ -454,6 +505,11 @@ class Manifest(object):
               "paths": {from_os_path(k): v for k, v in iteritems(self._path_hash)},
               "items": out_items,
               "version": CURRENT_VERSION}  # type: Dict[Text, Any]
+        # revision and local_changes are optional; a manifest without them
+        # is updated with a full walk of the tests root
+        if self.revision is not None:
+            rv["revision"] = self.revision
+            rv["local_changes"] = [from_os_path(item) for item in self.local_changes]
         return rv
 
     @classmethod
@@ -468,6 +524,8 @@ class Manifest(object):
             raise ManifestError
 
         self._path_hash = {to_os_path(k): v for k, v in iteritems(obj["paths"])}
+        self.revision = obj.get("revision")
+        self.local_changes = [to_os_path(item) for item in obj.get("local_changes", [])]
 
         for test_type, type_paths in iteritems(obj["items"]):
             # Drop "stub" items, which are no longer supported but may be
@@ -488,6 +546,54 @@ class Manifest(object):
 
         return self
 
+    @classmethod
+    def from_db(cls, tests_root, path, types=None):
+        # type: (str, Union[bytes, Text], Optional[Container[Text]]) -> Manifest
+        """Load a manifest from a database written by :func:`write` (see
+        :mod:`manifest.db`). Nothing beyond the manifest metadata is read
+        until the corresponding paths or test types are accessed."""
+        conn, meta = db.connect(path)
+        if meta.get("version") != CURRENT_VERSION:
+            conn.close()
+            raise ManifestVersionMismatch
+
+        self = cls(tests_root, url_base=meta.get("url_base", "/"))
+        self._path_hash = db.DbPathHash(conn)  # type: ignore
+        self.revision = meta.get("revision")
+        self.local_changes = [to_os_path(item) for item in meta.get("local_changes", [])]
+
+        for test_type in db.item_types(conn):
+            if test_type not in item_classes:
+                conn.close()
+                raise ManifestError
+
+            if types and test_type not in types:
+                continue
+
+            self._data[test_type].set_json(tests_root, db.DbTypeJson(conn, test_type))
+
+        return self
+
+
+def compute_manifest_items(update):
+    # type: (Tuple[SourceFile, Optional[Text]]) -> Tuple[Text, Text, Optional[Text], Optional[Iterable[ManifestItem]]]
+    """Compute the manifest entry for a single updated file.
+
+    This is a module-level function so that it can be run on a worker process
+    by :meth:`Manifest.update`; both the argument and the return value are
+    picklable.
+
+    :param update: Tuple of (SourceFile, hash of the file currently in the manifest
+                   or None if the file is new)
+    :returns: Tuple of (rel_path, hash, type, items), where type and items are None
+              if the file hash is unchanged"""
+    source_file, old_hash = update
+    file_hash = source_file.hash  # type: Text
+    if file_hash == old_hash:
+        return source_file.rel_path, file_hash, None, None
+    new_type, manifest_items = source_file.manifest_items()
+    return source_file.rel_path, file_hash, new_type, list(manifest_items)
+
 
 def load(tests_root, manifest, types=None):
     # type: (str, Union[IO[bytes], str], Optional[Container[Text]]) -> Optional[Manifest]
@@ -512,7 +618,14 @@ def _load(logger,  # type: Logger
     if allow_cached and manifest_path in __load_cache:
         return __load_cache[manifest_path]
 
-    if isinstance(manifest, string_types):
+    if isinstance(manifest, string_types) and db.is_db(manifest):
+        logger.debug("Opening manifest database at %s" % manifest)
+        try:
+            rv = Manifest.from_db(tests_root, manifest, types=types)
+        except ValueError:
+            logger.warning("%r may be corrupted", manifest)
+            return None
+    elif isinstance(manifest, string_types):
         if os.path.exists(manifest):
             logger.debug("Opening manifest at %s" % manifest)
         else:
@@ -547,7 +660,8 @@ def load_and_update(tests_root,  # type: bytes
                     working_copy=True,  # type: bool
                     types=None,  # type: Optional[Container[Text]]
                     write_manifest=True,  # type: bool
-                    allow_cached=True  # type: bool
+                    allow_cached=True,  # type: bool
+                    jobs=1  # type: Optional[int]
                     ):
     # type: (...) -> Manifest
     logger = get_logger()
@@ -575,7 +689,14 @@ def load_and_update(tests_root,  # type: bytes
     if rebuild or update:
         tree = vcs.get_tree(tests_root, manifest, manifest_path, cache_root,
                             working_copy, rebuild)
-        changed = manifest.update(tree)
+        changed = manifest.update(tree, jobs=jobs)
+        # Only record the new revision alongside a change to the items, so
+        # that new commits alone don't cause the manifest to be rewritten. An
+        # older revision is still valid to update from, as any file that
+        # changed since then is included in the diff against it.
+        if changed:
+            manifest.revision = tree.revision
+            manifest.local_changes = tree.local_changes
         if write_manifest and changed:
             write(manifest, manifest_path)
         tree.dump_caches()
@@ -585,9 +706,14 @@ def load_and_update(tests_root,  # type: bytes
 
 def write(manifest, manifest_path):
     # type: (Manifest, bytes) -> None
+    """Write the manifest to manifest_path. Paths with the manifest.db
+    extension are written as a database, anything else as JSON."""
     dir_name = os.path.dirname(manifest_path)
     if not os.path.exists(dir_name):
         os.makedirs(dir_name)
+    if db.is_db_path(manifest_path):
+        db.write(manifest.to_json(), manifest_path)
+        return
     with open(manifest_path, "wb") as f:
         # Use ',' instead of the default ', ' separator to prevent trailing
         # spaces: https://docs.python.org/2/library/json.html#json.dump
@@ -0,0 +1,187 @@
+"""Cache of the metadata extracted from parsing markup files.
+
+Parsing HTML and XML is the dominant cost of building the manifest and of
+linting. Both only need a small amount of information from the parsed
+document (the ``<meta>``, ``<link>`` and ``<script>`` nodes that
+SourceFile inspects), so that information is stored in an SQLite database
+keyed by the hash of the file content. Whichever of lint and the manifest
+update parses a file first stores its metadata, and the other reads it
+back rather than parsing the file again.
+
+The database is bounded in size; once it holds more than ``max_size``
+bytes of data, the least recently used entries are evicted by
+:py:meth:`ParseCache.prune`."""
+
+import json
+import os
+import sqlite3
+import time
+
+from six import binary_type
+
+MYPY = False
+if MYPY:
+    # MYPY is set to True when run under Mypy.
+    from typing import Any
+    from typing import Dict
+    from typing import List
+    from typing import Optional
+    from typing import Text
+    from typing import Union
+
+# Bump this whenever the format of the stored metadata changes
+version = 1
+
+default_max_size = 64 * 1024 * 1024
+
+_schema = [
+    "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, data TEXT NOT NULL, "
+    "size INTEGER NOT NULL, atime REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)",
+]
+
+# Marker returned by ParseCache.get for keys that are not in the cache,
+# distinct from None which records a file that failed to parse
+missing = object()
+
+
+class CachedNode(object):
+    """Stand-in for an ElementTree Element restored from the cache; only the
+    attributes of the node are retained"""
+
+    __slots__ = ("attrib",)
+
+    def __init__(self, attrib):
+        # type: (Dict[Text, Text]) -> None
+        self.attrib = attrib
+
+    def __repr__(self):
+        # type: () -> str
+        return "<CachedNode %r>" % (self.attrib,)
+
+
+class ParseCache(object):
+    def __init__(self, path, max_size=default_max_size):
+        # type: (Union[bytes, Text], int) -> None
+        """SQLite-backed cache of parsed markup metadata.
+
+        The database connection is opened lazily, and not pickled, so the
+        same cache object can be passed to worker processes.
+
+        :param path: Path to the cache database
+        :param max_size: Approximate upper bound on the size of the stored
+                         data, in bytes"""
+        self.path = path
+        self.max_size = max_size
+        self._conn = None  # type: Optional[sqlite3.Connection]
+
+    def __getstate__(self):
+        # type: () -> Dict[str, Any]
+        rv = self.__dict__.copy()
+        rv["_conn"] = None
+        return rv
+
+    @property
+    def conn(self):
+        # type: () -> sqlite3.Connection
+        if self._conn is None:
+            dir_path = os.path.dirname(self.path)
+            if dir_path and not os.path.exists(dir_path):
+                try:
+                    os.makedirs(dir_path)
+                except OSError:
+                    # Another process may have created it in the meantime
+                    if not os.path.isdir(dir_path):
+                        raise
+            # Autocommit, so that concurrent writers only hold the lock for
+            # the duration of a single statement
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA synchronous = OFF")
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+            except sqlite3.OperationalError:
+                pass
+            for statement in _schema:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def key(file_hash, markup_type):
+        # type: (Union[bytes, Text], Text) -> Text
+        """Cache key for a file with the given content hash, parsed as the
+        given markup type"""
+        if isinstance(file_hash, binary_type):
+            file_hash = file_hash.decode("ascii")
+        return u"%s:%s:%s" % (version, markup_type, file_hash)
+
+    def get(self, key):
+        # type: (Text) -> Any
+        """Get the metadata stored for key.
+
+        :returns: ``missing`` if there is no entry, ``None`` if the file
+                  failed to parse, or otherwise a dict mapping node kinds
+                  to lists of :py:class:`CachedNode`."""
+        try:
+            row = self.conn.execute("SELECT data FROM entries WHERE key = ?",
+                                    (key,)).fetchone()
+        except sqlite3.DatabaseError:
+            return missing
+        if row is None:
+            return missing
+        try:
+            self.conn.execute("UPDATE entries SET atime = ? WHERE key = ?",
+                              (time.time(), key))
+        except sqlite3.OperationalError:
+            # Failing to record the access only makes eviction less precise
+            pass
+        data = json.loads(row[0])
+        if data is None:
+            return None
+        return {kind: [CachedNode(attrib) for attrib in nodes]
+                for kind, nodes in data.items()}
+
+    def set(self, key, nodes):
+        # type: (Text, Optional[Dict[Text, List[Any]]]) -> None
+        """Store the metadata for key.
+
+        :param nodes: None if the file failed to parse, or otherwise a dict
+                      mapping node kinds to lists of ElementTree Elements or
+                      :py:class:`CachedNode`"""
+        if nodes is None:
+            data = None  # type: Optional[Dict[Text, List[Dict[Text, Text]]]]
+        else:
+            data = {kind: [dict(node.attrib) for node in kind_nodes]
+                    for kind, kind_nodes in nodes.items()}
+        value = json.dumps(data, separators=(',', ':'))
+        try:
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                              (key, value, len(value), time.time()))
+        except sqlite3.DatabaseError:
+            pass
+
+    def prune(self):
+        # type: () -> None
+        """Evict the least recently used entries until the cache is smaller
+        than max_size"""
+        try:
+            total = self.conn.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0
+            if total <= self.max_size:
+                return
+            # Evict down to 3/4 of the limit so that we don't prune on every run
+            excess = total - (self.max_size * 3) // 4
+            evict = []
+            for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY atime"):
+                evict.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", evict)
+        except sqlite3.DatabaseError:
+            pass
+
+    def close(self):
+        # type: () -> None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -33,6 +33,7 @@ except ImportError:
 import html5lib
 
 from . import XMLParser
+from . import parsecache
 from .item import (ManifestItem, ManualTest, WebDriverSpecTest, RefTestNode, TestharnessTest,
                    SupportFile, ConformanceCheckerTest, VisualTest)
 from .utils import ContextManagerBytesIO, cached_property
@@ -159,6 +160,52 @@ def global_variant_url(url, suffix):
     return replace_end(url, ".js", suffix)
 
 
+xhtml_ns = u"{http://www.w3.org/1999/xhtml}"
+
+# Nodes that SourceFile extracts from parsed markup, as a mapping of tag name
+# -> (attribute name -> (attribute value -> node kind))
+_metadata_node_kinds = {
+    xhtml_ns + u"meta": {u"name": {u"timeout": u"timeout",
+                                   u"viewport-size": u"viewport",
+                                   u"device-pixel-ratio": u"dpi",
+                                   u"fuzzy": u"fuzzy",
+                                   u"variant": u"variant",
+                                   u"flags": u"css_flag"}},
+    xhtml_ns + u"script": {u"src": {u"/resources/testharness.js": u"testharness",
+                                    u"/resources/testdriver.js": u"testdriver"}},
+    xhtml_ns + u"link": {u"rel": {u"match": u"match",
+                                  u"mismatch": u"mismatch",
+                                  u"help": u"spec_link"}},
+}  # type: Dict[Text, Dict[Text, Dict[Text, Text]]]
+
+metadata_node_kinds = {kind
+                       for attrs in _metadata_node_kinds.values()
+                       for values in attrs.values()
+                       for kind in values.values()}  # type: Set[Text]
+
+
+def extract_metadata_nodes(root):
+    # type: (Union[ElementTree.Element, ElementTree.ElementTree]) -> Dict[Text, List[ElementTree.Element]]
+    """Find all the nodes in a document that SourceFile uses, in a single
+    pass over the tree.
+
+    :returns: A dict mapping each node kind to the list of matching
+              descendants of root, in document order"""
+    rv = {kind: [] for kind in metadata_node_kinds}  # type: Dict[Text, List[ElementTree.Element]]
+    for node in root.iter():
+        attrs = _metadata_node_kinds.get(node.tag)
+        if attrs is None or node is root:
+            continue
+        for attr_name, values in attrs.items():
+            value = node.attrib.get(attr_name)
+            if value is None:
+                continue
+            kind = values.get(value)
+            if kind is not None:
+                rv[kind].append(node)
+    return rv
+
+
 def _parse_html(f):
     # type: (BinaryIO) -> ElementTree.ElementTree
     doc = html5lib.parse(f, treebuilder="etree", useChardet=False)
@@ -192,14 +239,16 @@ class SourceFile(object):
                          ("css", "CSS2", "archive"),
                          ("css", "common")}  # type: Set[Tuple[bytes, ...]]
 
-    def __init__(self, tests_root, rel_path, url_base, hash=None, contents=None):
-        # type: (AnyStr, AnyStr, Text, Optional[bytes], Optional[bytes]) -> None
+    def __init__(self, tests_root, rel_path, url_base, hash=None, contents=None, parse_cache=None):
+        # type: (AnyStr, AnyStr, Text, Optional[bytes], Optional[bytes], Optional[parsecache.ParseCache]) -> None
         """Object representing a file in a source tree.
 
         :param tests_root: Path to the root of the source tree
         :param rel_path: File path relative to tests_root
         :param url_base: Base URL used when converting file paths to urls
         :param contents: Byte array of the contents of the file or ``None``.
+        :param parse_cache: ParseCache used to avoid reparsing markup files
+                            whose content has been seen before, or ``None``.
         """
 
         assert not os.path.isabs(rel_path), rel_path
@@ -231,6 +280,7 @@ class SourceFile(object):
         self.url_base = url_base
         self.contents = contents
         self.items_cache = None  # type: Optional[Tuple[Text, List[ManifestItem]]]
+        self.parse_cache = parse_cache
         self._hash = hash
 
     def __getstate__(self):
@@ -450,13 +500,47 @@ class SourceFile(object):
 
         return root
 
+    @cached_property
+    def parse_cache_key(self):
+        # type: () -> Optional[Text]
+        """Key of the file in a ParseCache, or None if it doesn't contain
+        markup"""
+        if not self.markup_type:
+            return None
+        return parsecache.ParseCache.key(self.hash, self.markup_type)
+
+    @cached_property
+    def metadata_nodes(self):
+        # type: () -> Optional[Dict[Text, List[Any]]]
+        """Dict mapping kinds of node to the list of nodes of that kind in
+        the file, or None if the file doesn't contain markup or fails to
+        parse. When the metadata is read from the parse cache the nodes
+        are CachedNodes rather than ElementTree Elements, and only have an
+        attrib dict."""
+        key = self.parse_cache_key
+        if key is None:
+            return None
+
+        if self.parse_cache is not None:
+            cached = self.parse_cache.get(key)  # type: Optional[Dict[Text, List[Any]]]
+            if cached is not parsecache.missing:
+                return cached
+
+        rv = None  # type: Optional[Dict[Text, List[Any]]]
+        if self.root is not None:
+            rv = extract_metadata_nodes(self.root)
+
+        if self.parse_cache is not None:
+            self.parse_cache.set(key, rv)
+        return rv
+
     @cached_property
     def timeout_nodes(self):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes in a test that
         specify timeouts"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='timeout']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"timeout"]
 
     @cached_property
     def script_metadata(self):
@@ -480,7 +564,7 @@ class SourceFile(object):
             if any(m == (b"timeout", b"long") for m in self.script_metadata):
                 return "long"
 
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
 
         if self.timeout_nodes:
@@ -495,14 +579,14 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes in a test that
         specify viewport sizes"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='viewport-size']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"viewport"]
 
     @cached_property
     def viewport_size(self):
         # type: () -> Optional[Text]
         """The viewport size of a test or reference file"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
 
         if not self.viewport_nodes:
@@ -515,14 +599,14 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes in a test that
         specify device pixel ratios"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='device-pixel-ratio']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"dpi"]
 
     @cached_property
     def dpi(self):
         # type: () -> Optional[Text]
         """The device pixel ratio of a test or reference file"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
 
         if not self.dpi_nodes:
@@ -535,14 +619,14 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes in a test that
         specify reftest fuzziness"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='fuzzy']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"fuzzy"]
 
     @cached_property
     def fuzzy(self):
         # type: () -> Dict[Optional[Tuple[Text, Text, Text]], List[List[int]]]
         rv = {}  # type: Dict[Optional[Tuple[Text, Text, Text]], List[List[int]]]
-        if self.root is None:
+        if self.metadata_nodes is None:
             return rv
 
         if not self.fuzzy_nodes:
@@ -611,15 +695,15 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes representing a
         testharness.js script"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}script[@src='/resources/testharness.js']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"testharness"]
 
     @cached_property
     def content_is_testharness(self):
         # type: () -> Optional[bool]
         """Boolean indicating whether the file content represents a
         testharness.js test"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
         return bool(self.testharness_nodes)
 
@@ -628,8 +712,8 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes representing a
         test variant"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='variant']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"variant"]
 
     @cached_property
     def test_variants(self):
@@ -660,15 +744,15 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes representing a
         testdriver.js script"""
-        assert self.root is not None
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}script[@src='/resources/testdriver.js']")
+        assert self.metadata_nodes is not None
+        return self.metadata_nodes[u"testdriver"]
 
     @cached_property
     def has_testdriver(self):
         # type: () -> Optional[bool]
         """Boolean indicating whether the file content represents a
         testharness.js test"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
         return bool(self.testdriver_nodes)
 
@@ -677,12 +761,10 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes representing a
         to a reftest <link>"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return []
 
-        match_links = self.root.findall(".//{http://www.w3.org/1999/xhtml}link[@rel='match']")
-        mismatch_links = self.root.findall(".//{http://www.w3.org/1999/xhtml}link[@rel='mismatch']")
-        return match_links + mismatch_links
+        return self.metadata_nodes[u"match"] + self.metadata_nodes[u"mismatch"]
 
     @cached_property
     def references(self):
@@ -710,9 +792,9 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes representing a
         flag <meta>"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return []
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='flags']")
+        return self.metadata_nodes[u"css_flag"]
 
     @cached_property
     def css_flags(self):
@@ -730,7 +812,7 @@ class SourceFile(object):
         # type: () -> Optional[bool]
         """Boolean indicating whether the file content represents a
         CSS WG-style manual test"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
         # return True if the intersection between the two sets is non-empty
         return bool(self.css_flags & {"animated", "font", "history", "interact", "paged", "speech", "userstyle"})
@@ -740,9 +822,9 @@ class SourceFile(object):
         # type: () -> List[ElementTree.Element]
         """List of ElementTree Elements corresponding to nodes representing a
         <link rel=help>, used to point to specs"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return []
-        return self.root.findall(".//{http://www.w3.org/1999/xhtml}link[@rel='help']")
+        return self.metadata_nodes[u"spec_link"]
 
     @cached_property
     def spec_links(self):
@@ -759,7 +841,7 @@ class SourceFile(object):
         # type: () -> Optional[bool]
         """Boolean indicating whether the file content represents a
         CSS WG-style visual test"""
-        if self.root is None:
+        if self.metadata_nodes is None:
             return None
         return bool(self.ext in {'.xht', '.html', '.xhtml', '.htm', '.xml', '.svg'} and
                     self.spec_links)
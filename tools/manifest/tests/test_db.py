@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+
+import mock
+import pytest
+
+from .. import db, item, manifest, sourcefile
+
+
+def normalize(obj):
+    # File hashes are bytes on Python 3 until the manifest is written
+    return json.loads(json.dumps(obj, default=lambda value: value.decode("ascii")))
+
+
+def make_manifest():
+    m = manifest.Manifest("/foobar")
+    sources = [
+        sourcefile.SourceFile("/foobar", "a/test.html", "/",
+                              contents=b"<script src=/resources/testharness.js></script>"),
+        sourcefile.SourceFile("/foobar", "a/ref.html", "/",
+                              contents=b"<link rel=match href=/a/ref-ref.html>"),
+        sourcefile.SourceFile("/foobar", "a/ref-ref.html", "/", contents=b"<p>ref</p>"),
+        sourcefile.SourceFile("/foobar", "b/support.js", "/", contents=b"var a;"),
+    ]
+    m.update([(s, True) for s in sources])
+    return m
+
+
+def test_roundtrip(tmpdir):
+    m = make_manifest()
+    path = str(tmpdir.join("MANIFEST.db"))
+    manifest.write(m, path)
+
+    assert db.is_db(path)
+    loaded = manifest.Manifest.from_db("/foobar", path)
+    assert normalize(loaded.to_json()) == normalize(m.to_json())
+
+
+def test_load_types(tmpdir):
+    m = make_manifest()
+    path = str(tmpdir.join("MANIFEST.db"))
+    manifest.write(m, path)
+
+    loaded = manifest.Manifest.from_db("/foobar", path, types=["testharness"])
+    assert [test_type for test_type, _, _ in loaded] == ["testharness"]
+    assert [test.url for test in loaded.iterpath(os.path.join("a", "test.html"))] == ["/a/test.html"]
+
+
+def test_iterpath_lazy(tmpdir):
+    m = make_manifest()
+    path = str(tmpdir.join("MANIFEST.db"))
+    manifest.write(m, path)
+
+    loaded = manifest.Manifest.from_db("/foobar", path)
+    tests = list(loaded.iterpath(os.path.join("a", "ref.html")))
+    assert [test.url for test in tests] == ["/a/ref.html"]
+    assert isinstance(tests[0], item.RefTest)
+    assert os.path.join("b", "support.js") not in loaded._data["support"].data
+
+
+def test_load_all_single_query(tmpdir):
+    m = make_manifest()
+    path = str(tmpdir.join("MANIFEST.db"))
+    manifest.write(m, path)
+
+    loaded = manifest.Manifest.from_db("/foobar", path)
+    with mock.patch.object(db.DbTypeJson, "decode", autospec=True,
+                           side_effect=lambda self, row: json.loads(row[0])) as decode:
+        with mock.patch.object(db.DbTypeJson, "_db_get", autospec=True) as db_get:
+            assert len(list(loaded)) == 4
+            assert decode.call_count == 4
+            assert not db_get.called
+
+    loaded = manifest.Manifest.from_db("/foobar", path)
+    with mock.patch.object(db.DbTypeJson, "_db_get", autospec=True) as db_get:
+        assert normalize(loaded.to_json()) == normalize(m.to_json())
+        assert not db_get.called
+
+
+def test_from_db_unknown_type(tmpdir):
+    path = str(tmpdir.join("MANIFEST.db"))
+    db.write({"url_base": "/",
+              "version": manifest.CURRENT_VERSION,
+              "paths": {},
+              "items": {"unknown": {"a": [["a", {}]]}}},
+             path)
+    conn = sqlite3.connect(path)
+    with mock.patch.object(db, "connect", return_value=(conn, {"version": manifest.CURRENT_VERSION})):
+        with pytest.raises(manifest.ManifestError):
+            manifest.Manifest.from_db("/foobar", path)
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_update_from_db(tmpdir):
+    m = make_manifest()
+    path = str(tmpdir.join("MANIFEST.db"))
+    manifest.write(m, path)
+
+    loaded = manifest.Manifest.from_db("/foobar", path)
+    sources = [
+        sourcefile.SourceFile("/foobar", "a/test.html", "/",
+                              contents=b"<meta name=timeout content=long>"
+                              b"<script src=/resources/testharness.js></script>"),
+        sourcefile.SourceFile("/foobar", "a/ref.html", "/",
+                              contents=b"<link rel=match href=/a/ref-ref.html>"),
+        sourcefile.SourceFile("/foobar", "a/ref-ref.html", "/", contents=b"<p>ref</p>"),
+    ]
+    assert loaded.update([(s, True) for s in sources])
+
+    json_data = loaded.to_json()
+    assert "b/support.js" not in json_data["paths"]
+    assert json_data["items"]["testharness"] == {
+        "a/test.html": [("a/test.html", {"timeout": "long"})]
+    }
+
+    manifest.write(loaded, path)
+    assert normalize(manifest.Manifest.from_db("/foobar", path).to_json()) == normalize(json_data)
+
+
+def test_db_mapping(tmpdir):
+    path = str(tmpdir.join("MANIFEST.db"))
+    db.write({"url_base": "/",
+              "version": manifest.CURRENT_VERSION,
+              "paths": {"a": ["0" * 40, "support"], "b": ["1" * 40, "support"]},
+              "items": {}},
+             path)
+    conn, meta = db.connect(path)
+    assert meta == {"url_base": "/", "version": manifest.CURRENT_VERSION}
+
+    paths = db.DbPathHash(conn)
+    assert len(paths) == 2
+    assert paths["a"] == ("0" * 40, "support")
+
+    del paths["a"]
+    paths["c"] = ("2" * 40, "support")
+    assert "a" not in paths
+    assert sorted(paths) == ["b", "c"]
+    assert len(paths) == 2
+    assert dict(paths.items()) == {"b": ("1" * 40, "support"),
+                                   "c": ("2" * 40, "support")}
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ..deps import DependencyIndex, blob_id, decode, extract_references, resolve
+
+
+testharness = u"""<!doctype html>
+<p>Don't match across this apostrophe</p>
+<script src=/resources/testharness.js></script>
+<script src="support/helper.sub.js?pipe=sub"></script>
+<link rel=stylesheet href='../common/style.css'>
+<style>div { background: url(img/a.png) }</style>
+<script>
+fetch("http://{{host}}:{{ports[http][0]}}/fetch/api/resources/data.json");
+new Worker(`worker.js#frag`);
+</script>
+"""
+
+worker = u"""// META: script=/common/utils.js
+// META: script=resources/helper.js
+importScripts("/resources/testharness.js");
+"""
+
+idlharness = u"""<!doctype html>
+<script src=/resources/idlharness.js></script>
+<script>
+idl_test(['dom', 'html.idl'], ['uievents'], () => {});
+</script>
+"""
+
+
+def test_extract_references():
+    # The ends of URLs are also included, so these are a subset
+    assert extract_references(u"a/b/test.html", testharness) >= {
+        u"/resources/testharness.js",
+        u"/a/b/support/helper.sub.js",
+        u"/a/common/style.css",
+        u"/a/b/img/a.png",
+        u"/fetch/api/resources/data.json",
+        u"/a/b/worker.js",
+    }
+
+
+def test_extract_references_meta():
+    # The ends of URLs are also included, so these are a subset
+    assert extract_references(u"a/test.any.js", worker) >= {
+        u"/common/utils.js",
+        u"/a/resources/helper.js",
+        u"/resources/testharness.js",
+    }
+
+
+def test_extract_references_idlharness():
+    refs = extract_references(u"a/idlharness.window.html", idlharness)
+    assert {u"/interfaces/dom.idl",
+            u"/interfaces/html.idl",
+            u"/interfaces/uievents.idl"} <= refs
+    assert u"/interfaces/dom.idl" not in extract_references(u"a/test.html",
+                                                            u"test(['dom'])")
+
+
+def test_extract_references_unpaired_quotes():
+    # The quotes of the regexp and the empty string don't pair up
+    refs = extract_references(u"xhr/timeout-cors-async.htm", u"""
+var url = location.pathname.replace(/[^\\/]+$/, '')+'resources/corsenabled.py';
+""")
+    assert u"/xhr/resources/corsenabled.py" in refs
+
+
+def test_extract_references_prefixed():
+    refs = extract_references(u"xhr/test.htm", u"""
+let url = "xhr/resources/access-control.py?origin=" + origin;
+fetch(`../resources/stash-put.py%3fkey=${key}`);
+""")
+    assert {u"/xhr/resources/access-control.py",
+            u"/resources/stash-put.py"} <= refs
+
+
+@pytest.mark.parametrize("value,expected", [
+    (u"/common/utils.js", u"/common/utils.js"),
+    (u"support/a.js?x=1#y", u"/a/b/support/a.js"),
+    (u"../../../x.js", u"/x.js"),
+    (u"//{{domains[www]}}:{{ports[http][0]}}/x/y.html", u"/x/y.html"),
+    (u"a.py%3fx=1", u"/a/b/a.py"),
+    (u"https://example.com", None),
+    (u"support/", None),
+    (u"foo", None),
+    (u"", None),
+])
+def test_resolve(value, expected):
+    assert resolve(u"/a/b", value) == expected
+
+
+def test_decode():
+    assert decode(u"é".encode("utf8")) == u"é"
+    assert decode(b"\xff\xfe" + u"src".encode("utf-16le")) == u"﻿src"
+
+
+def test_update(tmpdir):
+    tmpdir.join("a").ensure(dir=True)
+    tmpdir.join("a", "test.html").write_text(testharness, "utf8")
+    tmpdir.join("a", "test.any.js").write_text(worker, "utf8")
+
+    index = DependencyIndex(str(tmpdir.join(".wptcache", "deps.db")))
+    tests = [(u"a/test.html", u"1"), (u"a/test.any.js", u"1")]
+    assert index.update(str(tmpdir), tests) == 2
+    assert index.referencing([u"/resources/testharness.js"]) == {u"a/test.html",
+                                                                 u"a/test.any.js"}
+    assert index.referencing([u"/common/utils.js"]) == {u"a/test.any.js"}
+    assert index.referencing([u"/common/utils.js", u"/a/support/helper.sub.js"]) == {
+        u"a/test.html", u"a/test.any.js"}
+    assert index.referencing([u"/common/other.js"]) == set()
+
+    # Unchanged hashes mean nothing is read again
+    assert index.update(str(tmpdir), tests) == 0
+
+    tmpdir.join("a", "test.any.js").write_text(u"// META: script=/common/other.js\n", "utf8")
+    assert index.update(str(tmpdir), [(u"a/test.any.js", u"2")]) == 1
+    assert index.referencing([u"/resources/testharness.js"]) == set()
+    assert index.referencing([u"/common/other.js"]) == {u"a/test.any.js"}
+    index.close()
+
+    # The data persists across instances
+    index = DependencyIndex(str(tmpdir.join(".wptcache", "deps.db")))
+    assert index.referencing([u"/common/other.js"]) == {u"a/test.any.js"}
+    index.close()
+
+
+def test_referencing_many(tmpdir):
+    tmpdir.join("test.html").write_text(u"<script src=/x/999.js></script>", "utf8")
+    index = DependencyIndex(str(tmpdir.join("deps.db")))
+    index.update(str(tmpdir), [(u"test.html", u"1")])
+    assert index.referencing(u"/x/%i.js" % i for i in range(1200)) == {u"test.html"}
+    index.close()
+
+
+def test_update_parallel(tmpdir):
+    tests = []
+    for i in range(150):
+        tmpdir.join("test%i.html" % i).write_text(u"<script src=support/%i.js></script>" % i,
+                                                 "utf8")
+        tests.append((u"test%i.html" % i, u"1"))
+    index = DependencyIndex(str(tmpdir.join("deps.db")))
+    assert index.update(str(tmpdir), tests, jobs=2) == 150
+    assert index.referencing([u"/support/3.js", u"/support/149.js"]) == {u"test3.html",
+                                                                         u"test149.html"}
+    index.close()
+
+
+def test_add(tmpdir):
+    tmpdir.join("test.html").write_text(u"<script src=/a.js></script>", "utf8")
+    index = DependencyIndex(str(tmpdir.join("deps.db")))
+    index.add([(u"test.html", u"1", {u"/b.js"}), (u"support.js", u"1", {u"/c.js"})])
+    assert index.referencing([u"/b.js"]) == {u"test.html"}
+
+    # Tests stored with the current hash aren't read again, and other files
+    # are removed
+    assert index.update(str(tmpdir), [(u"test.html", u"1")]) == 0
+    assert index.referencing([u"/b.js", u"/c.js"]) == {u"test.html"}
+
+    index.add([(u"test.html", u"2", {u"/d.js"})])
+    assert index.referencing([u"/b.js"]) == set()
+    assert index.referencing([u"/d.js"]) == {u"test.html"}
+    index.close()
+
+
+def test_blob_id():
+    # git hash-object of an empty file and of "hello\n"
+    assert blob_id(b"") == u"e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+    assert blob_id(b"hello\n") == u"ce013625030ba8dba906f756967f9e9ca394464a"
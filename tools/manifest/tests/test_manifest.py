@@ -400,3 +400,23 @@ def test_update_from_json_modified():
         'url_base': '/',
         'version': 6
     }
+
+
+def test_update_parallel():
+    sources = []
+    for i in range(manifest.PARALLEL_MIN_FILES + 5):
+        sources.append(sourcefile.SourceFile("/foobar", "test%d.html" % i, "/",
+                                             contents=b"<script src=/resources/testharness.js></script>"))
+    sources.append(sourcefile.SourceFile("/foobar", "ref.html", "/",
+                                         contents=b"<link rel=match href=/ref-ref.html>"))
+    sources.append(sourcefile.SourceFile("/foobar", "ref-ref.html", "/",
+                                         contents=b"<p>ref</p>"))
+
+    serial = manifest.Manifest()
+    assert serial.update([(s, True) for s in sources], jobs=1)
+
+    parallel = manifest.Manifest()
+    assert parallel.update([(s, True) for s in sources], jobs=2)
+
+    assert parallel.to_json() == serial.to_json()
+    assert not parallel.update([(s, True) for s in sources], jobs=2)
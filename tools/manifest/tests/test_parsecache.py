@@ -0,0 +1,92 @@
+import os
+
+import mock
+
+from ...lint import lint as lint_mod
+from ..parsecache import ParseCache, missing
+from ..sourcefile import SourceFile
+
+
+reftest = b"""<!doctype html>
+<meta name=timeout content=long>
+<meta name=fuzzy content="maxDifference=1;totalPixels=0-10">
+<meta name=viewport-size content=300x300>
+<meta name=flags content="ahem">
+<link rel=help href="https://drafts.csswg.org/css-foo/">
+<link rel=match href=ref.html>
+<link rel=mismatch href=notref.html>
+"""
+
+testharness = b"""<!doctype html>
+<meta name=variant content="?a">
+<meta name=variant content="?b">
+<script src=/resources/testharness.js></script>
+<script src=/resources/testharnessreport.js></script>
+<script src=/resources/testdriver.js></script>
+"""
+
+
+def items(source_file):
+    item_type, items = source_file.manifest_items()
+    return item_type, sorted(item.to_json() for item in items)
+
+
+def test_round_trip(tmpdir):
+    cache = ParseCache(str(tmpdir.join("parse.db")))
+    for name, contents in [("foo/test.html", reftest),
+                           ("foo/test.any.html", testharness),
+                           ("foo/test.svg", b"<svg xmlns='http://www.w3.org/2000/svg'/>"),
+                           ("foo/broken.xhtml", b"<html")]:
+        uncached = SourceFile("/", name, "/", contents=contents)
+        first = SourceFile("/", name, "/", contents=contents, parse_cache=cache)
+        assert cache.get(first.parse_cache_key) is missing
+        assert items(first) == items(uncached)
+        assert cache.get(first.parse_cache_key) is not missing
+
+        second = SourceFile("/", name, "/", contents=contents, parse_cache=cache)
+        with mock.patch.object(SourceFile, "parsers", {}):
+            assert items(second) == items(uncached)
+        assert "root" not in second.__dict__
+
+
+def test_key_depends_on_content(tmpdir):
+    cache = ParseCache(str(tmpdir.join("parse.db")))
+    first = SourceFile("/", "foo/test.html", "/", contents=reftest, parse_cache=cache)
+    second = SourceFile("/", "foo/test.html", "/", contents=testharness, parse_cache=cache)
+    assert first.parse_cache_key != second.parse_cache_key
+    assert first.type == "reftest_node"
+    assert second.type == "testharness"
+
+
+def test_prune(tmpdir):
+    cache = ParseCache(str(tmpdir.join("parse.db")), max_size=1000)
+    for i in range(20):
+        cache.set(u"key%d" % i, {u"timeout": [mock.Mock(attrib={u"content": u"x" * 100})]})
+    cache.get(u"key0")
+    cache.prune()
+    total = cache.conn.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+    assert total <= 1000
+    assert cache.get(u"key0") is not missing
+    assert cache.get(u"key1") is missing
+    assert cache.get(u"key19") is not missing
+
+
+def test_lint_populates_cache(tmpdir):
+    root = str(tmpdir)
+    os.makedirs(os.path.join(root, "foo"))
+    with open(os.path.join(root, "foo", "test.html"), "wb") as f:
+        f.write(testharness)
+    with open(os.path.join(root, "lint.whitelist"), "w") as f:
+        f.write("")
+    cache_path = os.path.join(root, ".wptcache", "lint.json")
+
+    with mock.patch.object(lint_mod, "logger"):
+        lint_mod.lint(root, ["foo/test.html"], "normal", cache_path=cache_path)
+    assert lint_mod.parse_cache is None
+
+    cache = ParseCache(os.path.join(root, ".wptcache", "parse.db"))
+    source_file = SourceFile(root, "foo/test.html", "/", parse_cache=cache)
+    assert cache.get(source_file.parse_cache_key) is not missing
+    with mock.patch.object(SourceFile, "parsers", {}):
+        assert source_file.type == "testharness"
+        assert source_file.test_variants == ["?a", "?b"]
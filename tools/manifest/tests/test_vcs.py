@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+
+import mock
+import pytest
+
+from .. import manifest, vcs
+
+
+def git(path, *args):
+    subprocess.check_output(["git",
+                             "-c", "user.name=wpt",
+                             "-c", "user.email=wpt@example.org"] + list(args),
+                            cwd=path)
+
+
+def write(root, rel_path, contents):
+    path = os.path.join(root, rel_path)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+@pytest.fixture
+def repo(tmpdir):
+    root = str(tmpdir.join("repo"))
+    os.makedirs(root)
+    git(root, "init", "-q")
+    write(root, ".gitignore", "MANIFEST.db\n.wptcache/\n")
+    write(root, "a/test.html", "<script src=/resources/testharness.js></script>")
+    write(root, "a/other.html", "<script src=/resources/testharness.js></script>")
+    write(root, "b/support.js", "var a;")
+    git(root, "add", ".")
+    git(root, "commit", "-q", "-m", "initial")
+    return root
+
+
+def normalize(obj):
+    # File hashes are bytes on Python 3 until the manifest is written
+    return json.loads(json.dumps(obj, default=lambda value: value.decode("ascii")))
+
+
+def update(root, rebuild=False):
+    return manifest.load_and_update(root,
+                                    os.path.join(root, "MANIFEST.db"),
+                                    "/",
+                                    rebuild=rebuild,
+                                    cache_root=os.path.join(root, ".wptcache"),
+                                    allow_cached=False)
+
+
+def test_records_revision(repo):
+    m = update(repo)
+    assert m.revision == subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                                 cwd=repo).strip().decode("ascii")
+    assert m.local_changes == []
+
+
+def test_git_delta(repo):
+    m = update(repo)
+
+    write(repo, "a/test.html", "<p>not a test</p>")
+    write(repo, "c/new.html", "<script src=/resources/testharness.js></script>")
+    os.unlink(os.path.join(repo, "a/other.html"))
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "change")
+    write(repo, "b/support.js", "var b;")
+    write(repo, "d/untracked.html", "<p>untracked</p>")
+
+    changed = vcs.GitHasher(repo).changed_since(m.revision)
+    assert changed == {"a/test.html", "a/other.html", "b/support.js",
+                       "c/new.html", "d/untracked.html"}
+
+    tree = vcs.get_tree(repo, m, os.path.join(repo, "MANIFEST.db"), None)
+    assert isinstance(tree, vcs.GitDelta)
+
+    m = update(repo)
+    assert sorted(m.local_changes) == ["b/support.js", "d/untracked.html"]
+    rebuilt = update(repo, rebuild=True)
+    assert normalize(m.to_json()) == normalize(rebuilt.to_json())
+
+    # Reverting a local change is picked up from the recorded local changes
+    git(repo, "checkout", "b/support.js")
+    m = update(repo)
+    assert m.local_changes == ["d/untracked.html"]
+    assert normalize(m.to_json()) == normalize(update(repo, rebuild=True).to_json())
+
+
+def test_unknown_revision(repo):
+    m = update(repo)
+    m.revision = "0" * 40
+    tree = vcs.get_tree(repo, m, os.path.join(repo, "MANIFEST.db"), None)
+    assert isinstance(tree, vcs.FileSystem)
+
+
+def test_new_commit_only(repo):
+    m = update(repo)
+    revision = m.revision
+    manifest_path = os.path.join(repo, "MANIFEST.db")
+
+    git(repo, "commit", "-q", "--allow-empty", "-m", "empty")
+    with mock.patch.object(manifest, "write") as write_manifest:
+        m = update(repo)
+    assert not write_manifest.called
+    assert m.revision == revision
+
+    # The older revision is still used to find changes
+    write(repo, "a/test.html", "<p>not a test</p>")
+    git(repo, "commit", "-q", "-am", "change")
+    tree = vcs.get_tree(repo, m, manifest_path, None)
+    assert isinstance(tree, vcs.GitDelta)
+    m = update(repo)
+    assert m.revision != revision
+    assert normalize(m.to_json()) == normalize(update(repo, rebuild=True).to_json())
@@ -0,0 +1,77 @@
+import os
+import threading
+
+import pytest
+
+from .. import watch
+
+
+def write(root, rel_path, contents):
+    path = os.path.join(root, rel_path)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+@pytest.fixture
+def tests_root(tmpdir):
+    root = str(tmpdir.join("tests"))
+    write(root, "a/test.html", "<script src=/resources/testharness.js></script>")
+    write(root, "b/support.js", "var a;")
+    return root
+
+
+@pytest.fixture
+def watcher(tests_root, tmpdir):
+    rv = watch.ManifestWatcher(tests_root,
+                               str(tmpdir.join("MANIFEST.db")),
+                               "/",
+                               cache_root=str(tmpdir.join("cache")))
+    rv.load()
+    yield rv
+    rv.stop()
+
+
+def test_apply(watcher, tests_root):
+    write(tests_root, "c/test.html", "<script src=/resources/testharness.js></script>")
+    os.unlink(os.path.join(tests_root, "b", "support.js"))
+
+    assert watcher.apply({os.path.join("c", "test.html"), "b"})
+    assert sorted(watcher.manifest._path_hash) == [os.path.join("a", "test.html"),
+                                                   os.path.join("c", "test.html")]
+    assert not watcher.apply({os.path.join("c", "test.html")})
+
+
+@pytest.mark.skipif(not hasattr(watch.socketserver, "UnixStreamServer"),
+                    reason="requires unix sockets")
+def test_fetch(watcher, tests_root):
+    watcher.serve()
+
+    m = watch.fetch(tests_root, watcher.manifest_path, "/", types=["testharness"])
+    assert m is not None
+    assert [(item_type, path) for item_type, path, _ in m] == [
+        ("testharness", os.path.join("a", "test.html"))]
+
+    assert watch.fetch(tests_root, watcher.manifest_path, "/other/") is None
+
+    watcher.stop()
+    assert watch.fetch(tests_root, watcher.manifest_path, "/") is None
+
+
+@pytest.mark.skipif(not watch.InotifyWatcher.is_supported(),
+                    reason="requires inotify")
+def test_inotify(tests_root):
+    inotify = watch.InotifyWatcher(tests_root)
+    try:
+        result = []
+        thread = threading.Thread(target=lambda: result.append(inotify.wait()))
+        thread.start()
+        write(tests_root, "a/new.html", "<p>new</p>")
+        write(tests_root, "d/e/new.html", "<p>new</p>")
+        thread.join(10)
+        changed = result[0]
+        assert os.path.join("a", "new.html") in changed
+        assert os.path.join("d", "e", "new.html") in changed or "d" in changed
+    finally:
+        inotify.close()
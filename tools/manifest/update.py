@@ -4,6 +4,7 @@ import os
 
 from . import manifest
 from . import vcs
+from . import watch
 from .log import get_logger
 from .download import download_from_github
 
@@ -51,7 +52,16 @@ def update_from_cli(**kwargs):
                              kwargs["url_base"],
                              update=True,
                              rebuild=kwargs["rebuild"],
-                             cache_root=kwargs["cache_root"])
+                             cache_root=kwargs["cache_root"],
+                             jobs=kwargs["jobs"])
+
+    if kwargs["watch"]:
+        watch.run(tests_root,
+                  path,
+                  kwargs["url_base"],
+                  cache_root=kwargs["cache_root"],
+                  poll=kwargs["poll"],
+                  interval=kwargs["poll_interval"])
 
 
 def abs_path(path):
@@ -78,6 +88,18 @@ def create_parser():
     parser.add_argument(
         "--cache-root", action="store", default=os.path.join(wpt_root, ".wptcache"),
         help="Path in which to store any caches (default <tests_root>/.wptcache/)")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Number of processes to use when parsing changed files; 0 means one per CPU (default 1)")
+    parser.add_argument(
+        "--watch", action="store_true", default=False,
+        help="Keep running, updating the manifest as files change and serving it to wpt run.")
+    parser.add_argument(
+        "--poll", action="store_true", default=False,
+        help="With --watch, poll for changes even if inotify is available.")
+    parser.add_argument(
+        "--poll-interval", action="store", type=float, default=5.0,
+        help="With --watch, seconds between checks for changes when polling (default 5).")
     return parser
 
 
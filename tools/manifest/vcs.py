@@ -2,11 +2,14 @@ import abc
 import json
 import os
 import stat
+import subprocess
+import sys
 from collections import deque
 from collections import MutableMapping
 
 from six import with_metaclass, PY2
 
+from .parsecache import ParseCache
 from .sourcefile import SourceFile
 from .utils import git
 
@@ -21,6 +24,7 @@ MYPY = False
 if MYPY:
     # MYPY is set to True when run under Mypy.
     from typing import Dict, Optional, List, Set, Text, Iterable, Any, Tuple, Union, Iterator
+    from typing import cast
     from .manifest import Manifest  # cyclic import under MYPY guard
     if PY2:
         stat_result = Any
@@ -28,12 +32,29 @@ if MYPY:
         stat_result = os.stat_result
 
 
+# Maximum number of locally modified or untracked files to record alongside
+# the revision in the manifest; beyond this the next update does a full walk.
+MAX_LOCAL_CHANGES = 1000
+
+
+def _split_paths(data):
+    # type: (bytes) -> Set[Text]
+    """Split the NUL-separated paths output by git into a set of native
+    strings"""
+    if sys.version_info[0] >= 3:
+        paths = set(os.fsdecode(data).split("\0"))
+    else:
+        paths = set(data.split(b"\0"))  # type: Set[Text]
+    paths.discard("")
+    return paths
+
+
 def get_tree(tests_root, manifest, manifest_path, cache_root,
              working_copy=True, rebuild=False):
-    # type: (bytes, Manifest, Optional[bytes], Optional[bytes], bool, bool) -> FileSystem
-    tree = None
+    # type: (bytes, Manifest, Optional[bytes], Optional[bytes], bool, bool) -> Union[FileSystem, GitDelta]
+    tree = None  # type: Optional[Union[FileSystem, GitDelta]]
     if cache_root is None:
-        cache_root = os.path.join(tests_root, b".wptcache")
+        cache_root = os.path.join(tests_root, ".wptcache")
     if not os.path.exists(cache_root):
         try:
             os.makedirs(cache_root)
@@ -43,12 +64,20 @@ def get_tree(tests_root, manifest, manifest_path, cache_root,
     if not working_copy:
         raise ValueError("working_copy=False unsupported")
 
+    parse_cache = None
+    if cache_root is not None:
+        parse_cache = ParseCache(os.path.join(cache_root, "parse.db"))
+
+    if not rebuild and manifest.revision is not None:
+        tree = GitDelta.from_manifest(tests_root, manifest, parse_cache)
+
     if tree is None:
         tree = FileSystem(tests_root,
                           manifest.url_base,
                           manifest_path=manifest_path,
                           cache_path=cache_root,
-                          rebuild=rebuild)
+                          rebuild=rebuild,
+                          parse_cache=parse_cache)
     return tree
 
 
@@ -57,15 +86,58 @@ class GitHasher(object):
         # type: (bytes) -> None
         self.git = git(path)
 
-    def _local_changes(self):
-        # type: () -> Set[bytes]
-        """get a set of files which have changed between HEAD and working copy"""
+    def _diff_index(self):
+        # type: () -> bytes
+        """NUL-separated list of files which have changed between HEAD and working copy"""
         assert self.git is not None
         # note that git runs the command with tests_root as the cwd, which may
         # not be the root of the git repo (e.g., within a browser repo)
         cmd = [b"diff-index", b"--relative", b"--no-renames", b"--name-only", b"-z", b"HEAD"]
-        data = self.git(*cmd)
-        return set(data.split(b"\0"))
+        return self.git(*cmd)
+
+    def _local_changes(self):
+        # type: () -> Set[bytes]
+        """get a set of files which have changed between HEAD and working copy"""
+        return set(self._diff_index().split(b"\0"))
+
+    def _untracked_files(self):
+        # type: () -> Set[Text]
+        """get a set of files which are neither tracked nor ignored"""
+        assert self.git is not None
+        cmd = [b"ls-files", b"--others", b"--exclude-standard", b"-z"]
+        return _split_paths(self.git(*cmd))
+
+    def state(self):
+        # type: () -> Tuple[Optional[Text], List[Text]]
+        """
+        A tuple of (HEAD commit id, sorted list of files that differ from HEAD in
+        the working copy), or (None, []) if the state can't be recorded
+        """
+        if self.git is None:
+            return None, []
+
+        local_changes = _split_paths(self._diff_index()) | self._untracked_files()
+        if len(local_changes) > MAX_LOCAL_CHANGES:
+            return None, []
+        revision = self.git(b"rev-parse", b"HEAD").strip().decode("ascii")
+        return revision, sorted(local_changes)
+
+    def changed_since(self, revision):
+        # type: (Text) -> Optional[Set[Text]]
+        """
+        A set of files which differ between revision and the working copy,
+        or None if revision isn't available in the local history
+        """
+        if self.git is None:
+            return None
+
+        cmd = [b"diff", b"--relative", b"--no-renames", b"--name-only", b"-z",
+               revision.encode("ascii"), b"--"]
+        try:
+            data = self.git(*cmd)
+        except subprocess.CalledProcessError:
+            return None
+        return _split_paths(data) | self._untracked_files()
 
     def hash_cache(self):
         # type: () -> Dict[bytes, Optional[bytes]]
@@ -90,10 +162,12 @@ class GitHasher(object):
 
 
 class FileSystem(object):
-    def __init__(self, root, url_base, cache_path, manifest_path=None, rebuild=False):
-        # type: (bytes, Text, Optional[bytes], Optional[bytes], bool) -> None
+    def __init__(self, root, url_base, cache_path, manifest_path=None, rebuild=False,
+                 parse_cache=None):
+        # type: (bytes, Text, Optional[bytes], Optional[bytes], bool, Optional[ParseCache]) -> None
         self.root = os.path.abspath(root)
         self.url_base = url_base
+        self.parse_cache = parse_cache
         self.ignore_cache = None
         self.mtime_cache = None
         if cache_path is not None:
@@ -107,8 +181,10 @@ class FileSystem(object):
         git = GitHasher(root)
         if git is not None:
             self.hash_cache = git.hash_cache()
+            self.revision, self.local_changes = git.state()
         else:
             self.hash_cache = {}
+            self.revision, self.local_changes = None, []
 
     def __iter__(self):
         # type: () -> Iterator[Tuple[Union[bytes, SourceFile], bool]]
@@ -118,7 +194,8 @@ class FileSystem(object):
                 path = os.path.join(dirpath, filename)
                 if mtime_cache is None or mtime_cache.updated(path, path_stat):
                     hash = self.hash_cache.get(path, None)
-                    yield SourceFile(self.root, path, self.url_base, hash), True
+                    yield SourceFile(self.root, path, self.url_base, hash,
+                                     parse_cache=self.parse_cache), True
                 else:
                     yield path, False
 
@@ -127,6 +204,83 @@ class FileSystem(object):
         for cache in [self.mtime_cache, self.ignore_cache]:
             if cache is not None:
                 cache.dump()
+        if self.parse_cache is not None:
+            self.parse_cache.prune()
+
+
+class GitDelta(object):
+    """Tree containing only the files changed since the revision recorded in
+    a manifest, for use in place of a full FileSystem walk.
+
+    Every other path already in the manifest is yielded as unchanged, so
+    files deleted since that revision are dropped by Manifest.update."""
+
+    def __init__(self, root, url_base, known_paths, changed, parse_cache=None):
+        # type: (bytes, Text, Iterable[Text], Set[Text], Optional[ParseCache]) -> None
+        self.root = os.path.abspath(root)
+        self.url_base = url_base
+        self.parse_cache = parse_cache
+        self.known_paths = known_paths
+        self.changed = changed
+        self.path_filter = gitignore.PathFilter(self.root, extras=[".git/"])
+        self.revision = None  # type: Optional[Text]
+        self.local_changes = []  # type: List[Text]
+
+    @classmethod
+    def from_manifest(cls, root, manifest, parse_cache=None):
+        # type: (bytes, Manifest, Optional[ParseCache]) -> Optional[GitDelta]
+        """Create a GitDelta for a manifest, or return None if the changes
+        can't be determined from the git history, in which case the caller
+        should fall back to a full walk."""
+        git = GitHasher(root)
+        if git.git is None or manifest.revision is None:
+            return None
+        changed = git.changed_since(manifest.revision)
+        if changed is None:
+            return None
+        changed |= set(manifest.local_changes)
+
+        rv = cls(root, manifest.url_base, list(manifest._path_hash), changed, parse_cache)
+        rv.revision, rv.local_changes = git.state()
+        return rv
+
+    def _included(self, rel_path):
+        # type: (Text) -> bool
+        """Whether a path is a regular file not excluded by the path filter"""
+        if MYPY:
+            # The path filter is typed for native strings
+            path = cast(str, rel_path)
+        else:
+            path = rel_path
+        if not os.path.isfile(os.path.join(self.root, path)):
+            return False
+        parts = path.split(os.path.sep)
+        dir_path = ""
+        for name in parts[:-1]:
+            for _, dirnames, _ in self.path_filter([(dir_path, [(name, None)], [])]):
+                if not dirnames:
+                    return False
+            dir_path = os.path.join(dir_path, name)
+        for _, _, filenames in self.path_filter([(dir_path, [], [(parts[-1], None)])]):
+            if not filenames:
+                return False
+        return True
+
+    def __iter__(self):
+        # type: () -> Iterator[Tuple[Union[Text, SourceFile], bool]]
+        changed = {os.path.normpath(path) for path in self.changed}
+        for path in self.known_paths:
+            if path not in changed:
+                yield path, False
+        for path in sorted(changed):
+            if self._included(path):
+                yield SourceFile(self.root, path, self.url_base,
+                                 parse_cache=self.parse_cache), True
+
+    def dump_caches(self):
+        # type: () -> None
+        if self.parse_cache is not None:
+            self.parse_cache.prune()
 
 
 class CacheFile(with_metaclass(abc.ABCMeta)):
@@ -174,7 +328,7 @@ class CacheFile(with_metaclass(abc.ABCMeta)):
 
 
 class MtimeCache(CacheFile):
-    file_name = b"mtime.json"
+    file_name = "mtime.json"
 
     def __init__(self, cache_root, tests_root, manifest_path, rebuild=False):
         # type: (bytes, bytes, bytes, bool) -> None
@@ -222,16 +376,16 @@ class MtimeCache(CacheFile):
 
 
 class GitIgnoreCache(CacheFile, MutableMapping):  # type: ignore
-    file_name = b"gitignore.json"
+    file_name = "gitignore.json"
 
     def check_valid(self, data):
         # type: (Dict[Any, Any]) -> Dict[Any, Any]
-        ignore_path = os.path.join(self.tests_root, b".gitignore")
+        ignore_path = os.path.join(self.tests_root, ".gitignore")
         mtime = os.path.getmtime(ignore_path)
-        if data.get(b"/gitignore_file") != [ignore_path, mtime]:
+        if data.get("/gitignore_file") != [ignore_path, mtime]:
             self.modified = True
             data = {}
-            data[b"/gitignore_file"] = [ignore_path, mtime]
+            data["/gitignore_file"] = [ignore_path, mtime]
         return data
 
     def __contains__(self, key):
@@ -287,7 +441,7 @@ def walk(root):
     relpath = os.path.relpath
 
     root = os.path.abspath(root)
-    stack = deque([(root, b"")])
+    stack = deque([(root, "")])
 
     while stack:
         dir_path, rel_path = stack.popleft()
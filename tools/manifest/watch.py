@@ -0,0 +1,436 @@
+"""Long-running process that keeps a manifest up to date as files change.
+
+The manifest is held in memory and updated incrementally from filesystem
+events (inotify on Linux, otherwise by polling with the usual manifest
+update machinery). Each update is also written back to the manifest file,
+and the current manifest is served over a unix socket next to the manifest
+file, so that clients can use :func:`fetch` instead of loading and updating
+the manifest themselves."""
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+from six import binary_type
+from six.moves import socketserver
+
+from . import manifest, vcs
+from .log import get_logger
+
+try:
+    from ..gitignore import gitignore
+except ValueError:
+    # relative import beyond toplevel throws *ValueError*!
+    from gitignore import gitignore  # type: ignore
+
+MYPY = False
+if MYPY:
+    # MYPY is set to True when run under Mypy.
+    from typing import Any
+    from typing import Dict
+    from typing import Iterable
+    from typing import List
+    from typing import Optional
+    from typing import Set
+    from typing import Text
+    from typing import Tuple
+
+logger = get_logger()
+
+# Time to wait for further events after a change before updating, so that
+# e.g. a git checkout is applied as a single update.
+SETTLE_TIME = 0.2
+
+
+def socket_path(manifest_path):
+    # type: (str) -> str
+    """Path of the socket used to serve the manifest at manifest_path"""
+    return manifest_path + ".sock"
+
+
+class PollingWatcher(object):
+    """Watcher that never reports individual changes, so that the whole tree
+    is rescanned at the end of every polling interval"""
+
+    def __init__(self, root, interval):
+        # type: (str, float) -> None
+        self.root = root
+        self.interval = interval
+
+    def wait(self):
+        # type: () -> Optional[Set[str]]
+        time.sleep(self.interval)
+        return None
+
+    def close(self):
+        # type: () -> None
+        pass
+
+
+class InotifyWatcher(object):
+    """Watcher reporting the paths changed under root using inotify.
+
+    A watch is added for every directory not excluded by the .gitignore
+    file. Paths are reported relative to root; a directory that is removed
+    or created is reported as the directory path itself."""
+
+    IN_CLOEXEC = 0o2000000
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    event_mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, root):
+        # type: (str) -> None
+        self.root = os.path.abspath(root)
+        self.libc = self.load_libc()
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.path_filter = gitignore.PathFilter(self.root, extras=[".git/"])
+        self.watches = {}  # type: Dict[int, str]
+        self.add_tree("")
+
+    @staticmethod
+    def load_libc():
+        # type: () -> Any
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported")
+        return libc
+
+    @classmethod
+    def is_supported(cls):
+        # type: () -> bool
+        try:
+            cls.load_libc()
+        except OSError:
+            return False
+        return True
+
+    def add_tree(self, rel_path):
+        # type: (str) -> List[str]
+        """Add watches for rel_path and all its subdirectories.
+
+        :returns: List of the files found under rel_path"""
+        def walk():
+            # type: () -> Iterable[Tuple[str, List[Tuple[str, Any]], List[Tuple[str, Any]]]]
+            # Make the paths relative to the root so that the path filter
+            # matches them the same way as in a full walk.
+            for dir_path, dir_names, file_names in vcs.walk(os.path.join(self.root, rel_path)):
+                if rel_path:
+                    dir_path = os.path.join(rel_path, dir_path) if dir_path else rel_path
+                yield dir_path, dir_names, file_names
+
+        files = []  # type: List[str]
+        self.add_watch(rel_path)
+        for dir_path, dir_names, file_names in self.path_filter(walk()):
+            for name, _ in dir_names:
+                self.add_watch(os.path.join(dir_path, name))
+            files.extend(os.path.join(dir_path, name) for name, _ in file_names)
+        return files
+
+    def add_watch(self, rel_path):
+        # type: (str) -> None
+        path = os.path.join(self.root, rel_path)
+        if not isinstance(path, bytes):
+            path = path.encode("utf8")
+        wd = self.libc.inotify_add_watch(self.fd, path, self.event_mask | self.IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, "inotify_add_watch failed for %s" % rel_path)
+        self.watches[wd] = os.path.normpath(rel_path) if rel_path else ""
+
+    def read_events(self):
+        # type: () -> Optional[Set[str]]
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.event_header.unpack_from(data, offset)
+            offset += self.event_header.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if sys.version_info[0] >= 3:
+                name = os.fsdecode(name)
+
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & self.IN_DELETE_SELF:
+                changed.add(dir_path)
+                continue
+
+            rel_path = os.path.join(dir_path, name) if dir_path else name
+            changed.add(rel_path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                changed.update(self.add_tree(rel_path))
+        return changed
+
+    def wait(self):
+        # type: () -> Optional[Set[str]]
+        """Block until there are changes and return the changed paths, or None
+        if events were lost and the whole tree needs to be rescanned."""
+        changed = set()  # type: Set[str]
+        timeout = None  # type: Optional[float]
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable:
+                return changed
+            events = self.read_events()
+            if events is None:
+                return None
+            changed |= events
+            timeout = SETTLE_TIME
+
+    def close(self):
+        # type: () -> None
+        os.close(self.fd)
+
+
+class ManifestWatcher(object):
+    def __init__(self,
+                 tests_root,  # type: str
+                 manifest_path,  # type: str
+                 url_base,  # type: Text
+                 cache_root=None,  # type: Optional[str]
+                 interval=5.0,  # type: float
+                 poll=False  # type: bool
+                 ):
+        # type: (...) -> None
+        self.tests_root = os.path.abspath(tests_root)
+        self.manifest_path = manifest_path
+        self.url_base = url_base
+        self.cache_root = cache_root
+        self.interval = interval
+        self.poll = poll
+        self.lock = threading.Lock()
+        self.manifest = None  # type: Optional[manifest.Manifest]
+        self.serialized = {}  # type: Dict[Optional[Tuple[Text, ...]], bytes]
+        self.server = None  # type: Optional[ManifestSocketServer]
+
+    def load(self):
+        # type: () -> None
+        self.manifest = manifest.load_and_update(self.tests_root,
+                                                 self.manifest_path,
+                                                 self.url_base,
+                                                 cache_root=self.cache_root,
+                                                 allow_cached=False)
+
+    def expand(self, changed):
+        # type: (Set[str]) -> Set[Text]
+        """Add all the known files under any changed directory"""
+        assert self.manifest is not None
+        rv = set(changed)  # type: Set[Text]
+        dirs = [path + os.path.sep for path in changed
+                if not os.path.isfile(os.path.join(self.tests_root, path))]
+        if not dirs:
+            return rv
+        for path in self.manifest._path_hash:
+            if any(path.startswith(dir_path) for dir_path in dirs):
+                rv.add(path)
+        return rv
+
+    def apply(self, changed):
+        # type: (Optional[Set[str]]) -> bool
+        """Update the manifest given a set of changed paths, or None to
+        check the whole tree."""
+        assert self.manifest is not None
+        if changed is not None:
+            # Ignore our own writes to the manifest
+            manifest_rel_path = os.path.relpath(self.manifest_path, self.tests_root)
+            changed = {path for path in changed
+                       if not path.startswith(manifest_rel_path)}
+            if not changed:
+                return False
+        with self.lock:
+            if changed is None:
+                tree = vcs.get_tree(self.tests_root, self.manifest, self.manifest_path,
+                                    self.cache_root)
+            else:
+                tree = vcs.GitDelta(self.tests_root, self.url_base,
+                                    list(self.manifest._path_hash), self.expand(changed))
+            updated = self.manifest.update(tree)
+            tree.dump_caches()
+            if not updated:
+                return False
+            self.manifest.revision, self.manifest.local_changes = vcs.GitHasher(
+                self.tests_root).state()
+            self.serialized = {}
+            manifest.write(self.manifest, self.manifest_path)
+        logger.info("Manifest updated")
+        return True
+
+    def serialize(self, types=None):
+        # type: (Optional[List[Text]]) -> bytes
+        """JSON for the current manifest, restricted to types if given"""
+        key = tuple(sorted(types)) if types else None
+        with self.lock:
+            if key not in self.serialized:
+                assert self.manifest is not None
+                obj = self.manifest.to_json()
+                if key is not None:
+                    obj["items"] = {test_type: value for test_type, value in obj["items"].items()
+                                    if test_type in key}
+                # File hashes are bytes on Python 3
+                data = json.dumps(obj, separators=(',', ':'), default=_decode_bytes)
+                if not isinstance(data, bytes):
+                    data = data.encode("utf8")
+                self.serialized[key] = data
+            return self.serialized[key]
+
+    def create_watcher(self):
+        # type: () -> Any
+        if not self.poll and InotifyWatcher.is_supported():
+            try:
+                return InotifyWatcher(self.tests_root)
+            except OSError as e:
+                logger.warning("Failed to set up inotify, falling back to polling: %s" % e)
+        return PollingWatcher(self.tests_root, self.interval)
+
+    def serve(self):
+        # type: () -> None
+        path = socket_path(self.manifest_path)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = ManifestSocketServer(path, self)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info("Serving manifest on %s" % path)
+
+    def run(self):
+        # type: () -> None
+        self.load()
+        watcher = self.create_watcher()
+        self.serve()
+        try:
+            while True:
+                self.apply(watcher.wait())
+        finally:
+            watcher.close()
+            self.stop()
+
+    def stop(self):
+        # type: () -> None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            try:
+                os.unlink(socket_path(self.manifest_path))
+            except OSError:
+                pass
+            self.server = None
+
+
+def _decode_bytes(value):
+    # type: (Any) -> Text
+    if isinstance(value, binary_type):
+        return value.decode("ascii")
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+class ManifestRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # type: () -> None
+        try:
+            request = json.loads(self.rfile.readline().decode("utf8"))
+        except ValueError:
+            return
+        watcher = self.server.watcher  # type: ignore
+        if request.get("url_base") != watcher.url_base:
+            self.wfile.write(b"{}")
+            return
+        self.wfile.write(watcher.serialize(request.get("types")))
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class ManifestSocketServer(socketserver.ThreadingMixIn,
+                               socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, watcher):
+            # type: (str, ManifestWatcher) -> None
+            self.watcher = watcher
+            socketserver.UnixStreamServer.__init__(self, path, ManifestRequestHandler)
+else:
+    ManifestSocketServer = None  # type: ignore
+
+
+def fetch(tests_root, manifest_path, url_base, types=None, timeout=60):
+    # type: (str, str, Text, Optional[Iterable[Text]], float) -> Optional[manifest.Manifest]
+    """Get the current manifest from a ManifestWatcher for manifest_path.
+
+    :returns: The manifest, or None if no watcher is running or it serves a
+              different url_base."""
+    path = socket_path(manifest_path)
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+
+    type_list = list(types) if types else None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        request = {"url_base": url_base, "types": type_list}
+        sock.sendall(json.dumps(request).encode("utf8") + b"\n")
+        chunks = []
+        while True:
+            data = sock.recv(1024 * 1024)
+            if not data:
+                break
+            chunks.append(data)
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+
+    try:
+        obj = json.loads(b"".join(chunks).decode("utf8"))
+    except ValueError:
+        return None
+    if not obj:
+        return None
+    return manifest.Manifest.from_json(tests_root, obj, types=type_list)
+
+
+def run(tests_root, manifest_path, url_base, cache_root=None, poll=False, interval=5.0):
+    # type: (str, str, Text, Optional[str], bool, float) -> None
+    watcher = ManifestWatcher(tests_root, manifest_path, url_base, cache_root,
+                              interval=interval, poll=poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
@@ -28,7 +28,9 @@ from wptserve import server as wptserve, handlers
 from wptserve import stash
 from wptserve import config
 from wptserve.logger import set_logger
+from wptserve.filecache import FileCache, stat_key
 from wptserve.handlers import filesystem_path, wrap_pipeline
+from wptserve.metrics import Metrics
 from wptserve.utils import get_port, HTTPException, http2_compatible
 from mod_pywebsocket import standalone as pywebsocket
 
@@ -57,6 +59,16 @@ def domains_are_distinct(a, b):
     return a_parts[slice_index:] != b_parts[slice_index:]
 
 
+def escape_format(s):
+    """Escape a string so that it's unchanged by %-formatting"""
+    return s.replace("%", "%%")
+
+
+# Parsed // META comments of js files and the wrapper documents generated
+# from them, shared by all the wrapper handlers
+wrapper_cache = FileCache(max_size=8 * 1024 * 1024)
+
+
 class WrapperHandler(object):
 
     __meta__ = abc.ABCMeta
@@ -81,11 +93,41 @@ class WrapperHandler(object):
         query = request.url_parts.query
         if query:
             query = "?" + query
-        meta = "\n".join(self._get_meta(request))
-        script = "\n".join(self._get_script(request))
-        response.content = self.wrapper % {"meta": meta, "script": script, "path": path, "query": query}
+        template = self._get_template(request, path)
+        response.content = template % {"query": query}
         wrap_pipeline(path, request, response)
 
+    def _get_template(self, request, path):
+        """Get the wrapper document with everything except the query string
+        filled in, as a template with a single %(query)s variable. This only
+        depends on the request path and the contents of the underlying js
+        file, so it's cached until that file changes.
+
+        :param request: The Request being processed.
+        :param path: Path of the resource loaded by the wrapper.
+        """
+        file_path, stat = self._stat_file(request)
+
+        def load():
+            meta = "\n".join(self._get_meta(request))
+            script = "\n".join(self._get_script(request))
+            template = self.wrapper % {"meta": escape_format(meta),
+                                       "script": escape_format(script),
+                                       "path": escape_format(path),
+                                       "query": "%(query)s"}
+            return template, len(template)
+
+        return wrapper_cache.get((type(self), path, file_path), stat_key(stat), load)
+
+    def _stat_file(self, request):
+        """Get a tuple of (path, stat result) for the js file on disk
+        associated with a request."""
+        path = self._get_path(filesystem_path(self.base_path, request, self.url_base), False)
+        try:
+            return path, os.stat(path)
+        except OSError:
+            raise HTTPException(404)
+
     def _get_path(self, path, resource_path):
         """Convert the path from an incoming request into a path corresponding to an "unwrapped"
         resource e.g. the file on disk that will be loaded in the wrapper.
@@ -116,13 +158,18 @@ class WrapperHandler(object):
 
         :param request: The Request being processed.
         """
-        path = self._get_path(filesystem_path(self.base_path, request, self.url_base), False)
-        try:
+        path, stat = self._stat_file(request)
+
+        def load():
             with open(path, "rb") as f:
-                for key, value in read_script_metadata(f, js_meta_re):
-                    yield key, value
+                metadata = list(read_script_metadata(f, js_meta_re))
+            return metadata, sum(len(key) + len(value) for key, value in metadata)
+
+        try:
+            metadata = wrapper_cache.get(("metadata", path), stat_key(stat), load)
         except IOError:
             raise HTTPException(404)
+        return iter(metadata)
 
     def _get_meta(self, request):
         """Get an iterator over strings to inject into the wrapper document
@@ -320,7 +367,9 @@ rewrites = [("GET", "/resources/WebIDLParser.js", "/resources/webidl2/lib/webidl
 
 
 class RoutesBuilder(object):
-    def __init__(self):
+    def __init__(self, file_cache=None):
+        self.file_cache = file_cache
+
         self.forbidden_override = [("GET", "/tools/runner/*", handlers.file_handler),
                                    ("POST", "/tools/runner/update_manifest.py",
                                     handlers.python_script_handler)]
@@ -371,19 +420,43 @@ class RoutesBuilder(object):
         ]
 
         for (method, suffix, handler_cls) in routes:
+            kwargs = {}
+            if handler_cls is handlers.FileHandler:
+                kwargs["cache"] = self.file_cache
             self.mountpoint_routes[url_base].append(
                 (method,
                  "%s%s" % (url_base if url_base != "/" else "", suffix),
-                 handler_cls(base_path=path, url_base=url_base)))
+                 handler_cls(base_path=path, url_base=url_base, **kwargs)))
 
     def add_file_mount_point(self, file_url, base_path):
         assert file_url.startswith("/")
         url_base = file_url[0:file_url.rfind("/") + 1]
-        self.mountpoint_routes[file_url] = [("GET", file_url, handlers.FileHandler(base_path=base_path, url_base=url_base))]
+        self.mountpoint_routes[file_url] = [("GET", file_url, handlers.FileHandler(base_path=base_path,
+                                                                                   url_base=url_base,
+                                                                                   cache=self.file_cache))]
+
+
+def get_file_cache(config):
+    """Create the FileCache shared by the file handlers, or return None if
+    it isn't enabled in the config"""
+    cache_config = config["file_cache"]
+    if not cache_config:
+        return None
+    if cache_config is True:
+        cache_config = {}
+    return FileCache(**cache_config)
+
+
+def get_metrics(config):
+    """Create a Metrics object for a server, or return None if collecting
+    metrics isn't enabled in the config"""
+    if not config["server_metrics"]:
+        return None
+    return Metrics()
 
 
-def build_routes(aliases):
-    builder = RoutesBuilder()
+def build_routes(aliases, file_cache=None):
+    builder = RoutesBuilder(file_cache)
     for alias in aliases:
         url = alias["url-path"]
         directory = alias["local-dir"]
@@ -447,6 +520,84 @@ class ServerProc(object):
     def is_alive(self):
         return self.proc.is_alive()
 
+    @property
+    def procs(self):
+        return [self.proc]
+
+    def restart_dead(self):
+        """Single processes aren't restarted; returns whether the process
+        is still alive"""
+        return self.is_alive()
+
+
+class ServerProcPool(object):
+    """Group of server processes listening on the same port with
+    SO_REUSEPORT, so that the kernel balances connections between them.
+
+    This has the same interface as ServerProc, plus restart_dead to
+    replace processes that have exited.
+
+    :param scheme: Scheme of the servers
+    :param processes: Number of processes to start
+    """
+    # Maximum number of times processes are restarted, so that a server
+    # that fails to start doesn't restart forever
+    max_restarts = 10
+
+    def __init__(self, scheme=None, processes=2):
+        self.scheme = scheme
+        self.processes = processes
+        self.workers = []
+        self.restarts = 0
+        self._start_args = None
+
+    def start(self, init_func, host, port, paths, routes, bind_address, config, **kwargs):
+        kwargs["reuse_port"] = True
+        self._start_args = (init_func, host, port, paths, routes, bind_address, config, kwargs)
+        self.workers = [self._start_worker() for _ in range(self.processes)]
+
+    def _start_worker(self):
+        init_func, host, port, paths, routes, bind_address, config, kwargs = self._start_args
+        worker = ServerProc(scheme=self.scheme)
+        worker.start(init_func, host, port, paths, routes, bind_address, config, **kwargs)
+        return worker
+
+    def wait(self):
+        for worker in self.workers:
+            # Skip processes that have exited, since a process that's killed
+            # while waiting on its stop event can leave the event unusable
+            if worker.is_alive():
+                worker.wait()
+
+    def kill(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.kill()
+
+    def is_alive(self):
+        return all(worker.is_alive() for worker in self.workers)
+
+    @property
+    def procs(self):
+        return [worker.proc for worker in self.workers]
+
+    def restart_dead(self):
+        """Replace any processes that have exited.
+
+        :returns: False if a process has exited and can't be restarted
+                  because max_restarts has been reached.
+        """
+        for i, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            if self.restarts >= self.max_restarts:
+                return False
+            logger.warning("%s exited with code %s, restarting" %
+                           (worker.proc.name, worker.proc.exitcode))
+            self.restarts += 1
+            self.workers[i] = self._start_worker()
+        return True
+
 
 def check_subdomains(config):
     paths = config.paths
@@ -511,6 +662,12 @@ def make_hosts_file(config, host):
 
 def start_servers(host, ports, paths, routes, bind_address, config, **kwargs):
     servers = defaultdict(list)
+    processes = config["server_processes"]
+    if processes > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("SO_REUSEPORT isn't supported on this platform, "
+                       "starting one process per port")
+        processes = 1
+
     for scheme, ports in ports.items():
         assert len(ports) == {"http": 2}.get(scheme, 1)
 
@@ -529,7 +686,10 @@ def start_servers(host, ports, paths, routes, bind_address, config, **kwargs):
                          "ws": start_ws_server,
                          "wss": start_wss_server}[scheme]
 
-            server_proc = ServerProc(scheme=scheme)
+            if processes > 1 and scheme in ("http", "https", "http2"):
+                server_proc = ServerProcPool(scheme=scheme, processes=processes)
+            else:
+                server_proc = ServerProc(scheme=scheme)
             server_proc.start(init_func, host, port, paths, routes, bind_address,
                               config, **kwargs)
             servers[scheme].append((port, server_proc))
@@ -537,9 +697,24 @@ def start_servers(host, ports, paths, routes, bind_address, config, **kwargs):
     return servers
 
 
+def get_server_cls(config, scheme):
+    """Get the server class to use for servers of a given scheme, based on
+    the server_engine config, or None to use the default"""
+    engine = config["server_engine"].get(scheme, "threading")
+    if engine == "threading":
+        return None
+    if engine == "asyncio":
+        if sys.version_info < (3, 5):
+            raise ValueError("The asyncio server engine requires Python 3")
+        from wptserve.aioserver import AsyncioWebTestServer
+        return AsyncioWebTestServer
+    raise ValueError("Unknown server engine %s" % engine)
+
+
 def start_http_server(host, port, paths, routes, bind_address, config, **kwargs):
     return wptserve.WebTestHttpd(host=host,
                                  port=port,
+                                 server_cls=get_server_cls(config, "http"),
                                  doc_root=paths["doc_root"],
                                  routes=routes,
                                  rewrites=rewrites,
@@ -548,12 +723,15 @@ def start_http_server(host, port, paths, routes, bind_address, config, **kwargs)
                                  use_ssl=False,
                                  key_file=None,
                                  certificate=None,
-                                 latency=kwargs.get("latency"))
+                                 latency=kwargs.get("latency"),
+                                 reuse_port=kwargs.get("reuse_port", False),
+                                 metrics=get_metrics(config))
 
 
 def start_https_server(host, port, paths, routes, bind_address, config, **kwargs):
     return wptserve.WebTestHttpd(host=host,
                                  port=port,
+                                 server_cls=get_server_cls(config, "https"),
                                  doc_root=paths["doc_root"],
                                  routes=routes,
                                  rewrites=rewrites,
@@ -563,7 +741,9 @@ def start_https_server(host, port, paths, routes, bind_address, config, **kwargs
                                  key_file=config.ssl_config["key_path"],
                                  certificate=config.ssl_config["cert_path"],
                                  encrypt_after_connect=config.ssl_config["encrypt_after_connect"],
-                                 latency=kwargs.get("latency"))
+                                 latency=kwargs.get("latency"),
+                                 reuse_port=kwargs.get("reuse_port", False),
+                                 metrics=get_metrics(config))
 
 
 def start_http2_server(host, port, paths, routes, bind_address, config, **kwargs):
@@ -580,7 +760,9 @@ def start_http2_server(host, port, paths, routes, bind_address, config, **kwargs
                                  certificate=config.ssl_config["cert_path"],
                                  encrypt_after_connect=config.ssl_config["encrypt_after_connect"],
                                  latency=kwargs.get("latency"),
-                                 http2=True)
+                                 http2=True,
+                                 reuse_port=kwargs.get("reuse_port", False),
+                                 metrics=get_metrics(config))
 
 
 class WebSocketDaemon(object):
@@ -696,10 +878,16 @@ def start(config, routes, **kwargs):
     return servers
 
 
-def iter_procs(servers):
+def iter_servers(servers):
     for servers in servers.values():
         for port, server in servers:
-            yield server.proc
+            yield server
+
+
+def iter_procs(servers):
+    for server in iter_servers(servers):
+        for proc in server.procs:
+            yield proc
 
 
 def build_config(override_path=None, **kwargs):
@@ -793,7 +981,33 @@ class ConfigBuilder(config.ConfigBuilder):
             },
             "none": {}
         },
-        "aliases": []
+        "aliases": [],
+        # Either false, true, or an object with max_size and max_file_size
+        # properties, in bytes, setting the limits of the cache used when
+        # serving static files
+        "file_cache": False,
+        # Engine used by the http and https servers; either "threading",
+        # with a thread for each connection, or "asyncio", with an event
+        # loop and a pool of threads for handling requests
+        "server_engine": {
+            "http": "threading",
+            "https": "threading"
+        },
+        # Number of processes sharing each http, https and http2 port, using
+        # SO_REUSEPORT. Processes that exit are restarted when this is more
+        # than 1.
+        "server_processes": 1,
+        # Collect timings of the stages of handling each request in each
+        # http, https and http2 server, served as JSON from
+        # /.well-known/wptserve-metrics
+        "server_metrics": False,
+        # Backend holding the data of the stash; either "manager", using a
+        # multiprocessing manager, or "socket", using a server with its own
+        # simpler protocol
+        "stash_backend": "manager",
+        # Number of seconds after which values that haven't been taken are
+        # removed from the stash, or null to keep them until they're taken
+        "stash_ttl": None
     }
 
     computed_properties = ["ws_doc_root"] + config.ConfigBuilder.computed_properties
@@ -885,14 +1099,20 @@ def run(**kwargs):
             stash_address = (config.server_host, get_port(""))
             logger.debug("Going to use port %d for stash" % stash_address[1])
 
-        with stash.StashServer(stash_address, authkey=str(uuid.uuid4())):
-            servers = start(config, build_routes(config["aliases"]), **kwargs)
+        with stash.StashServer(stash_address, authkey=str(uuid.uuid4()),
+                               ttl=config["stash_ttl"],
+                               backend=config["stash_backend"]):
+            servers = start(config,
+                            build_routes(config["aliases"], get_file_cache(config)),
+                            **kwargs)
             signal.signal(signal.SIGTERM, handle_signal)
             signal.signal(signal.SIGINT, handle_signal)
 
-            while all(item.is_alive() for item in iter_procs(servers)) and not received_signal.is_set():
-                for item in iter_procs(servers):
-                    item.join(1)
+            # Restart dead processes of ServerProcPools, and stop once
+            # any other process has exited
+            while (all([server.restart_dead() for server in iter_servers(servers)]) and
+                   not received_signal.is_set()):
+                time.sleep(1)
             exited = [item for item in iter_procs(servers) if not item.is_alive()]
             subject = "subprocess" if len(exited) == 1 else "subprocesses"
 
@@ -3,19 +3,24 @@ try:
 except ImportError:
     pass
 import json
+import logging
 import os
 try:
     # import Queue under its Python 3 name
     import Queue as queue  # noqa: N813
 except ImportError:
     import queue
+import socket
 import tempfile
 import threading
+import time
 
 import pytest
+from six.moves import urllib
 
 from . import serve
 from wptserve import logger
+from wptserve.utils import get_port
 
 
 class ServerProcSpy(serve.ServerProc):
@@ -77,3 +82,42 @@ def test_subprocess_exit(server_subprocesses, tempfile_name):
     thread.join(timeout)
 
     assert not thread.is_alive()
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"),
+                    reason="SO_REUSEPORT isn't supported")
+def test_server_proc_pool(monkeypatch):
+    monkeypatch.setattr(serve, "logger", logging.getLogger(), raising=False)
+    port = get_port()
+    with serve.ConfigBuilder(check_subdomains=False) as config:
+        pool = serve.ServerProcPool(scheme="http", processes=2)
+        pool.max_restarts = 1
+        pool.start(serve.start_http_server, "localhost", port, config.paths,
+                   serve.build_routes([]), True, config)
+        try:
+            assert len(pool.procs) == 2
+            url = "http://localhost:%d/" % port
+            for _ in range(50):
+                try:
+                    urllib.request.urlopen(url)
+                    break
+                except urllib.error.URLError:
+                    time.sleep(0.1)
+            assert pool.is_alive()
+            assert pool.restart_dead()
+
+            dead = pool.procs[0]
+            dead.terminate()
+            dead.join()
+            assert not pool.is_alive()
+            assert pool.restart_dead()
+            assert dead not in pool.procs
+            assert pool.is_alive()
+            assert pool.restarts == 1
+            assert urllib.request.urlopen(url).getcode() == 200
+
+            pool.procs[1].terminate()
+            pool.procs[1].join()
+            assert not pool.restart_dead()
+        finally:
+            pool.kill()
@@ -2,6 +2,7 @@ import json
 import os
 import pickle
 import platform
+import sys
 
 import pytest
 
@@ -105,3 +106,29 @@ def test_alternate_host_invalid(primary, alternate):
 ])
 def test_alternate_host_valid(primary, alternate):
     ConfigBuilder(browser_host=primary, alternate_hosts={"alt": alternate})
+
+
+def test_get_server_cls():
+    with ConfigBuilder() as c:
+        assert serve.get_server_cls(c, "http") is None
+        assert serve.get_server_cls(c, "https") is None
+
+    with ConfigBuilder(server_engine={"http": "asyncio"}) as c:
+        if sys.version_info < (3, 5):
+            with pytest.raises(ValueError):
+                serve.get_server_cls(c, "http")
+        else:
+            from wptserve.aioserver import AsyncioWebTestServer
+            assert serve.get_server_cls(c, "http") is AsyncioWebTestServer
+        assert serve.get_server_cls(c, "https") is None
+
+    with ConfigBuilder(server_engine={"http": "unknown"}) as c:
+        with pytest.raises(ValueError):
+            serve.get_server_cls(c, "http")
+
+
+def test_stash_ttl_default():
+    # Values are kept until they're taken unless stash_ttl is set
+    with ConfigBuilder() as c:
+        assert c["stash_ttl"] is None
+    assert serve.stash.StashServer().ttl is None
@@ -2,15 +2,17 @@ import argparse
 import logging
 import os
 import re
+import sqlite3
 import subprocess
 import sys
 
 import six
 from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
 from six import iteritems
 
 try:
-    from ..manifest import manifest
+    from ..manifest import deps, manifest
 except ValueError:
     # if we're not within the tools package, the above is an import from above
     # the top-level which raises ValueError, so reimport it with an absolute
@@ -19,7 +21,7 @@ except ValueError:
     # note we need both because depending on caller we may/may not have the
     # paths set up correctly to handle both and MYPY has no knowledge of our
     # sys.path magic
-    from manifest import manifest  # type: ignore
+    from manifest import deps, manifest  # type: ignore
 
 MYPY = False
 if MYPY:
@@ -42,6 +44,9 @@ wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
 
 logger = logging.getLogger()
 
+# Matcher used by scan_test; set on each worker process
+reference_matcher = None  # type: Optional[ReferenceMatcher]
+
 
 def get_git_cmd(repo_path):
     # type: (bytes) -> Callable[..., Text]
@@ -231,16 +236,124 @@ def load_manifest(manifest_path=None, manifest_update=True):
                                     update=manifest_update)
 
 
+def compile_literals(literals):
+    # type: (Iterable[Text]) -> Pattern[Text]
+    """Compile a regexp matching any of a set of literal strings, so that a
+    text can be searched for all of them in a single pass"""
+    literals = sorted(set(literals), key=len, reverse=True)
+    assert literals
+    return re.compile("|".join(re.escape(item) for item in literals))
+
+
+class ReferenceMatcher(object):
+    def __init__(self, changed_paths, interface_names):
+        # type: (Iterable[Tuple[Text, Text]], Iterable[Text]) -> None
+        """Matcher for the tests that reference a set of changed files.
+
+        A test matches if it contains the path of a changed file, either
+        relative to the directory of the test or from the root of the
+        repository, or if it uses idlharness.js and names a changed
+        interface. The paths are combined into a single regexp for each
+        directory containing tests.
+
+        :param changed_paths: Iterable of (full path, path from the root of
+                              the repository starting with /) for each
+                              changed file
+        :param interface_names: Names of the changed files in /interfaces,
+                                without the .idl extension"""
+        self.changed_paths = sorted(changed_paths)
+        interface_names = sorted(interface_names)
+        self.interfaces_re = None  # type: Optional[Pattern[Text]]
+        if interface_names:
+            self.interfaces_re = re.compile("['\"](?:%s)(?:\\.idl)?['\"]" %
+                                            "|".join(re.escape(name) for name in interface_names))
+        self._by_dir = {}  # type: Dict[Text, Pattern[Text]]
+
+    def _dir_matcher(self, dir_path):
+        # type: (Text) -> Pattern[Text]
+        rv = self._by_dir.get(dir_path)
+        if rv is None:
+            literals = set()
+            for full_path, repo_path in self.changed_paths:
+                literals.add(os.path.relpath(full_path, dir_path).replace(os.path.sep, "/"))
+                literals.add(repo_path)
+            rv = self._by_dir[dir_path] = compile_literals(literals)
+        return rv
+
+    def matches(self, test_full_path, file_contents):
+        # type: (Text, Text) -> bool
+        if (self.changed_paths and
+            self._dir_matcher(os.path.dirname(test_full_path)).search(file_contents)):
+            return True
+        return (self.interfaces_re is not None and
+                "idlharness.js" in file_contents and
+                self.interfaces_re.search(file_contents) is not None)
+
+
+def set_reference_matcher(matcher):
+    # type: (Optional[ReferenceMatcher]) -> None
+    global reference_matcher
+    reference_matcher = matcher
+
+
+def scan_test(test_full_path):
+    # type: (Text) -> bool
+    """Check whether a test references any of the changed files known to
+    the current reference matcher. This is a module-level function so that
+    it can be run on a worker process."""
+    assert reference_matcher is not None
+    with open(test_full_path, "rb") as fh:
+        file_contents = deps.decode(fh.read())
+    return reference_matcher.matches(test_full_path, file_contents)
+
+
+def tests_referencing(wpt_manifest,  # type: manifest.Manifest
+                      test_types,  # type: Sequence[str]
+                      repo_paths,  # type: Iterable[Text]
+                      index_path=None,  # type: Optional[str]
+                      jobs=1  # type: Optional[int]
+                      ):
+    # type: (...) -> Set[Text]
+    """Get the tests that reference any of a set of files, using the
+    dependency index stored at index_path. The index is first brought up to
+    date with the tests in the manifest.
+
+    :param repo_paths: Paths of the referenced files, starting with /
+    :returns: Set of test paths relative to the root of the repository,
+              using / as the separator"""
+    if index_path is None:
+        index_path = os.path.join(wpt_root, ".wptcache", "deps.db")
+    index = deps.DependencyIndex(index_path)
+    try:
+        updated = index.update(wpt_root, wpt_manifest.iterhashes(*test_types), jobs=jobs)
+        logger.debug("Read %i tests to update the dependency index" % updated)
+        return index.referencing(repo_paths)
+    finally:
+        index.close()
+
+
 def affected_testfiles(files_changed,  # type: Iterable[Text]
                        skip_dirs=None,  # type: Optional[Set[str]]
                        manifest_path=None,  # type: Optional[str]
-                       manifest_update=True  # type: bool
+                       manifest_update=True,  # type: bool
+                       use_index=True,  # type: bool
+                       index_path=None,  # type: Optional[str]
+                       jobs=1  # type: Optional[int]
                        ):
-    # type: (...) -> Tuple[Set[Text], Set[str]]
-    """Determine and return list of test files that reference changed files."""
+    # type: (...) -> Tuple[Set[Text], Set[Text]]
+    """Determine and return list of test files that reference changed files.
+
+    By default the tests are found by looking the changed files up in the
+    dependency index (see manifest.deps). If use_index is False, or the
+    index can't be used, every test is read and searched for the paths of
+    the changed files instead.
+
+    :param jobs: Number of processes used to read tests, either to update
+                 the index or to search them; ``None`` or 0 means one per
+                 CPU"""
     if skip_dirs is None:
         skip_dirs = {"conformance-checkers", "docs", "tools"}
-    affected_testfiles = set()
+    affected_testfiles = set()  # type: Set[Text]
     # Exclude files that are in the repo root, because
     # they are not part of any test.
     files_changed = [f for f in files_changed if not _in_repo_root(f)]
@@ -278,11 +391,11 @@ def affected_testfiles(files_changed,  # type: Iterable[Text]
             full_path = os.path.join(wpt_root, repo_path[1:].replace("/", os.path.sep))
         nontest_changed_paths.add((full_path, repo_path))
 
-    interface_name = lambda x: os.path.splitext(os.path.basename(x))[0]
-    interfaces_changed_names = map(interface_name, interfaces_changed)
+    interfaces_changed_names = [os.path.splitext(os.path.basename(item))[0]
+                                for item in interfaces_changed]
 
     def affected_by_wdspec(test):
-        # type: (str) -> bool
+        # type: (Text) -> bool
         affected = False
         if test in wdspec_test_files:
             for support_full_path, _ in nontest_changed_paths:
@@ -297,16 +410,29 @@ def affected_testfiles(files_changed,  # type: Iterable[Text]
                     break
         return affected
 
-    def affected_by_interfaces(file_contents):
-        # type: (Union[bytes, Text]) -> bool
-        if len(interfaces_changed_names) > 0:
-            if 'idlharness.js' in file_contents:
-                for interface in interfaces_changed_names:
-                    regex = '[\'"]' + interface + '(\\.idl)?[\'"]'
-                    if re.search(regex, file_contents):
-                        return True
-        return False
-
+    if use_index:
+        repo_paths = {repo_path for _, repo_path in nontest_changed_paths}
+        repo_paths |= {"/interfaces/%s.idl" % name for name in interfaces_changed_names}
+        try:
+            referencing = tests_referencing(wpt_manifest, test_types, repo_paths, index_path,
+                                            jobs=jobs)
+        except (OSError, sqlite3.DatabaseError) as e:
+            logger.warning("Failed to use the dependency index, searching every test "
+                           "instead: %s" % e)
+        else:
+            for rel_path in referencing:
+                if rel_path.split("/", 1)[0] in skip_dirs:
+                    continue
+                affected_testfiles.add(os.path.join(wpt_root, rel_path.replace("/", os.path.sep)))
+            for test_full_path in wdspec_test_files:
+                rel_path = os.path.relpath(test_full_path, wpt_root)
+                if rel_path.split(os.path.sep, 1)[0] in skip_dirs:
+                    continue
+                if affected_by_wdspec(test_full_path):
+                    affected_testfiles.add(test_full_path)
+            return tests_changed, affected_testfiles
+
+    to_scan = []  # type: List[Text]
     for root, dirs, fnames in os.walk(wpt_root):
         # Walk top_level_subdir looking for test files containing either the
         # relative filepath or absolute filepath to the changed files.
@@ -321,20 +447,34 @@ def affected_testfiles(files_changed,  # type: Iterable[Text]
             if affected_by_wdspec(test_full_path):
                 affected_testfiles.add(test_full_path)
                 continue
+            to_scan.append(test_full_path)
 
-            with open(test_full_path, "rb") as fh:
-                raw_file_contents = fh.read()  # type: bytes
-                if raw_file_contents.startswith("\xfe\xff"):
-                    file_contents = raw_file_contents.decode("utf-16be", "replace")  # type: Text
-                elif raw_file_contents.startswith("\xff\xfe"):
-                    file_contents = raw_file_contents.decode("utf-16le", "replace")
-                else:
-                    file_contents = raw_file_contents.decode("utf8", "replace")
-                for full_path, repo_path in nontest_changed_paths:
-                    rel_path = os.path.relpath(full_path, root).replace(os.path.sep, "/")
-                    if rel_path in file_contents or repo_path in file_contents or affected_by_interfaces(file_contents):
-                        affected_testfiles.add(test_full_path)
-                        continue
+    if not nontest_changed_paths and not interfaces_changed_names:
+        return tests_changed, affected_testfiles
+
+    matcher = ReferenceMatcher(nontest_changed_paths, interfaces_changed_names)
+
+    if jobs is None or jobs < 1:
+        jobs = cpu_count()
+
+    pool = None
+    if jobs > 1 and len(to_scan) > 1:
+        pool = Pool(jobs, initializer=set_reference_matcher, initargs=(matcher,))
+        results = pool.imap(scan_test, to_scan,
+                            chunksize=max(1, len(to_scan) // (jobs * 16)))  # type: Iterable[bool]
+    else:
+        set_reference_matcher(matcher)
+        results = (scan_test(item) for item in to_scan)
+
+    try:
+        for test_full_path, affected in zip(to_scan, results):
+            if affected:
+                affected_testfiles.add(test_full_path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        set_reference_matcher(None)
 
     return tests_changed, affected_testfiles
 
@@ -372,6 +512,12 @@ def get_parser_affected():
                         action="store",
                         default=wpt_root,
                         help="Directory that will contain MANIFEST.json")
+    parser.add_argument("--no-index", dest="use_index", action="store_false",
+                        help="Search every test for references to the changed files "
+                        "instead of using the dependency index in .wptcache/")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes used to read tests; 0 means one per CPU "
+                        "(default 1)")
     return parser
 
 
@@ -409,7 +555,9 @@ def run_tests_affected(**kwargs):
     tests_changed, dependents = affected_testfiles(
         changed,
         {"conformance-checkers", "docs", "tools"},
-        manifest_path=manifest_path
+        manifest_path=manifest_path,
+        use_index=kwargs.get("use_index", True),
+        jobs=kwargs.get("jobs", 1)
     )
 
     message = "{path}"
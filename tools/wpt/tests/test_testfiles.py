@@ -1,5 +1,9 @@
+import os
+
+import pytest
 from mock import patch
 
+from tools.manifest import deps
 from tools.wpt import testfiles
 
 
@@ -11,3 +15,55 @@ def test_getrevish_kwarg():
 def test_getrevish_implicit():
     with patch("tools.wpt.testfiles.branch_point", return_value=u"base"):
         assert testfiles.get_revish() == b"base..HEAD"
+
+
+def test_compile_literals():
+    matcher = testfiles.compile_literals([u"a.js", u"../a.js", u"a.js?x"])
+    assert matcher.search(u"src='../a.js'").group(0) == u"../a.js"
+    assert matcher.search(u"src='ab.js'") is None
+
+
+def test_reference_matcher():
+    root = os.path.join(os.sep, "wpt")
+    changed = [(os.path.join(root, "common", "utils.js"), u"/common/utils.js")]
+    matcher = testfiles.ReferenceMatcher(changed, [u"dom"])
+    test_path = os.path.join(root, "dom", "test.html")
+    assert matcher.matches(test_path, u"<script src=../common/utils.js>")
+    assert matcher.matches(test_path, u"<script src=/common/utils.js>")
+    assert not matcher.matches(test_path, u"<script src=common/utils.js>")
+    assert matcher.matches(test_path, u"idlharness.js; idl_test(['dom'])")
+    assert not matcher.matches(test_path, u"idl_test(['dom'])")
+    assert not matcher.matches(test_path, u"idlharness.js; idl_test(['html'])")
+
+
+reference_samples = [
+    u"<script src=/resources/testharness.js></script><script src=resources/a.js></script>",
+    u"<link rel=stylesheet href='../common/style.css'>",
+    u"var url = location.pathname.replace(/[^\\/]+$/, '')+'resources/a.js';",
+    u"fetch(\"http://{{host}}:{{ports[http][0]}}/common/style.css?pipe=sub\");",
+    u"let url = 'dom/resources/a.js?x=' + x;",
+    u"fetch(`../resources/stash.py%3fkey=${key}`);",
+    u"// META: script=/common/utils.js\n// META: script=resources/a.js",
+    u"<p>Don't</p><img src=\"resources/b.png\">",
+    u"<script src=/resources/idlharness.js></script>idl_test(['dom', \"html.idl\"])",
+]
+
+
+@pytest.mark.parametrize("contents", reference_samples)
+def test_dependency_index_superset_of_scan(contents):
+    # Every test that the scan finds for a changed file is found by the
+    # dependency index
+    root = os.path.join(os.sep, "wpt")
+    test_path = os.path.join(root, "dom", "test.html")
+    refs = deps.extract_references(u"dom/test.html", contents)
+    for repo_path in [u"/dom/resources/a.js", u"/dom/resources/b.png", u"/resources/a.js",
+                      u"/resources/stash.py", u"/common/style.css", u"/common/utils.js",
+                      u"/resources/testharness.js"]:
+        full_path = os.path.join(root, *repo_path.split(u"/"))
+        matcher = testfiles.ReferenceMatcher([(full_path, repo_path)], [])
+        if matcher.matches(test_path, contents):
+            assert repo_path in refs
+    for name in [u"dom", u"html"]:
+        matcher = testfiles.ReferenceMatcher([], [name])
+        if matcher.matches(test_path, contents):
+            assert u"/interfaces/%s.idl" % name in refs
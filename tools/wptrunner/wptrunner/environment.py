@@ -64,7 +64,7 @@ class TestEnvironment(object):
         self.options = options if options is not None else {}
 
         self.cache_manager = multiprocessing.Manager()
-        self.stash = serve.stash.StashServer()
+        self.stash = None
         self.env_extras = env_extras
         self.env_extras_cms = None
         self.ssl_config = ssl_config
@@ -74,6 +74,8 @@ class TestEnvironment(object):
 
         self.config = self.config_ctx.__enter__()
 
+        self.stash = serve.stash.StashServer(ttl=self.config["stash_ttl"],
+                                             backend=self.config["stash_backend"])
         self.stash.__enter__()
         self.cache_manager.__enter__()
 
@@ -169,7 +171,7 @@ class TestEnvironment(object):
             pass
 
     def get_routes(self):
-        route_builder = serve.RoutesBuilder()
+        route_builder = serve.RoutesBuilder(serve.get_file_cache(self.config))
 
         for path, format_args, content_type, route in [
                 ("testharness_runner.html", {}, "text/html", "/testharness_runner.html"),
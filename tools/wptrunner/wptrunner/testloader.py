@@ -1,4 +1,6 @@
 import hashlib
+import heapq
+import json
 import os
 from six.moves.urllib.parse import urlsplit
 from abc import ABCMeta, abstractmethod
@@ -13,20 +15,96 @@ from mozlog import structured
 
 manifest = None
 manifest_update = None
+manifest_watch = None
 download_from_github = None
 
 def do_delayed_imports():
     # This relies on an already loaded module having set the sys.path correctly :(
-    global manifest, manifest_update, download_from_github
+    global manifest, manifest_update, manifest_watch, download_from_github
     from manifest import manifest
     from manifest import update as manifest_update
+    from manifest import watch as manifest_watch
     from manifest.download import download_from_github
 
 
+class TestDurations(object):
+    """Expected duration of each test, in milliseconds, based on previous runs.
+
+    Tests without a recorded duration are assumed to take the mean duration
+    of the recorded tests in the closest enclosing directory, or of all the
+    recorded tests if there are none in any enclosing directory.
+
+    :param durations: dict of test id to duration in milliseconds
+    """
+    default_duration = 1000
+
+    def __init__(self, durations=None):
+        self.durations = durations if durations is not None else {}
+        self._dir_means = None
+
+    @classmethod
+    def load(cls, paths):
+        """Load durations from JSON files. Each file is either a wptreport,
+        as written by --log-wptreport, or an object mapping test ids to
+        durations in milliseconds. Tests that appear in several files get
+        the mean of their durations.
+
+        :param paths: List of paths to the files to load
+        """
+        totals = defaultdict(lambda: [0, 0])
+        for path in paths:
+            with open(path) as f:
+                data = json.load(f)
+            if "results" in data:
+                items = ((result["test"], result["duration"]) for result in data["results"]
+                         if result.get("duration") is not None)
+            else:
+                items = data.iteritems()
+            for test_id, duration in items:
+                total = totals[test_id]
+                total[0] += duration
+                total[1] += 1
+        return cls({test_id: float(total) / count
+                    for test_id, (total, count) in totals.iteritems()})
+
+    def __len__(self):
+        return len(self.durations)
+
+    def __contains__(self, test_id):
+        return test_id in self.durations
+
+    def _get_dir_means(self):
+        if self._dir_means is None:
+            totals = defaultdict(lambda: [0, 0])
+            for test_id, duration in self.durations.iteritems():
+                parts = urlsplit(test_id).path.split("/")[:-1]
+                for i in xrange(len(parts) + 1):
+                    total = totals["/".join(parts[:i])]
+                    total[0] += duration
+                    total[1] += 1
+            self._dir_means = {dir_path: float(total) / count
+                               for dir_path, (total, count) in totals.iteritems()}
+        return self._dir_means
+
+    def get(self, test_id):
+        """Get the expected duration of a test in milliseconds"""
+        duration = self.durations.get(test_id)
+        if duration is not None:
+            return duration
+        dir_means = self._get_dir_means()
+        parts = urlsplit(test_id).path.split("/")[:-1]
+        for i in xrange(len(parts), -1, -1):
+            duration = dir_means.get("/".join(parts[:i]))
+            if duration is not None:
+                return duration
+        return self.default_duration
+
+
 class TestChunker(object):
-    def __init__(self, total_chunks, chunk_number):
+    def __init__(self, total_chunks, chunk_number, durations=None):
         self.total_chunks = total_chunks
         self.chunk_number = chunk_number
+        self.durations = durations
         assert self.chunk_number <= self.total_chunks
         self.logger = structured.get_default_logger()
         assert self.logger
@@ -68,6 +146,71 @@ class DirectoryHashChunker(TestChunker):
                 yield test_type, test_path, tests
 
 
+class DurationChunker(TestChunker):
+    """Split the test files into chunks with close to the same total expected
+    duration, according to a TestDurations object.
+
+    Files containing no test with a recorded duration are assigned to chunks
+    by hash, as in HashChunker. The other files are then assigned, longest
+    expected duration first, to the chunk with the smallest expected
+    duration so far. The result only depends on the tests and the durations,
+    so every chunk computes the same split.
+    """
+    def __init__(self, *args, **kwargs):
+        TestChunker.__init__(self, *args, **kwargs)
+        assert self.durations is not None
+
+    def key(self, test_path):
+        return test_path
+
+    def __call__(self, manifest):
+        chunk_index = self.chunk_number - 1
+        manifest = list(manifest)
+
+        expected = defaultdict(float)
+        recorded = set()
+        for test_type, test_path, tests in manifest:
+            key = self.key(test_path)
+            for test in tests:
+                if test.id in self.durations:
+                    recorded.add(key)
+                expected[key] += self.durations.get(test.id)
+
+        assignments = {}
+        totals = [0.] * self.total_chunks
+        for key in sorted(expected):
+            if key not in recorded:
+                index = int(hashlib.md5(key).hexdigest(), 16) % self.total_chunks
+                assignments[key] = index
+                totals[index] += expected[key]
+
+        heap = [(total, index) for index, total in enumerate(totals)]
+        heapq.heapify(heap)
+        for key in sorted(recorded, key=lambda item: (-expected[item], item)):
+            total, index = heapq.heappop(heap)
+            assignments[key] = index
+            heapq.heappush(heap, (total + expected[key], index))
+
+        totals = sorted(heap, key=lambda item: item[1])
+        self.logger.info("Expected duration of chunk %i is %.0fs (shortest %.0fs, longest %.0fs)" %
+                         (self.chunk_number, totals[chunk_index][0] / 1000,
+                          min(totals)[0] / 1000, max(totals)[0] / 1000))
+
+        for test_type, test_path, tests in manifest:
+            if assignments[self.key(test_path)] == chunk_index:
+                yield test_type, test_path, tests
+
+
+class DirectoryDurationChunker(DurationChunker):
+    """Like DurationChunker except whole directories are assigned to chunks.
+
+    This ensures that all tests in the same directory end up in the same
+    chunk.
+    """
+    def key(self, test_path):
+        return os.path.dirname(test_path)
+
+
 class TestFilter(object):
     """Callable that restricts the set of tests in a given manifest according
     to initial criteria"""
@@ -133,6 +276,12 @@ class ManifestLoader(object):
         return rv
 
     def load_manifest(self, tests_path, manifest_path, metadata_path, url_base="/", **kwargs):
+        # If `wpt manifest --watch` is running it already has an up to date manifest
+        rv = manifest_watch.fetch(tests_path, manifest_path, url_base, types=self.types)
+        if rv is not None:
+            self.logger.info("Using manifest from watcher for %s" % manifest_path)
+            return rv
+
         cache_root = os.path.join(metadata_path, ".cache")
         if self.manifest_download:
             download_from_github(manifest_path, tests_path)
@@ -159,7 +308,8 @@ class TestLoader(object):
                  total_chunks=1,
                  chunk_number=1,
                  include_https=True,
-                 skip_timeout=False):
+                 skip_timeout=False,
+                 durations=None):
 
         self.test_types = test_types
         self.run_info = run_info
@@ -175,11 +325,15 @@ class TestLoader(object):
         self.chunk_type = chunk_type
         self.total_chunks = total_chunks
         self.chunk_number = chunk_number
+        self.durations = durations
 
         self.chunker = {"none": Unchunked,
                         "hash": HashChunker,
-                        "dir_hash": DirectoryHashChunker}[chunk_type](total_chunks,
-                                                                      chunk_number)
+                        "dir_hash": DirectoryHashChunker,
+                        "duration": DurationChunker,
+                        "dir_duration": DirectoryDurationChunker}[chunk_type](total_chunks,
+                                                                              chunk_number,
+                                                                              durations=durations)
 
         self._test_ids = None
 
@@ -303,7 +457,11 @@ class GroupedSource(TestSource):
         raise NotImplementedError
 
     @classmethod
-    def make_queue(cls, tests, **kwargs):
+    def make_queue(cls, tests, durations=None, **kwargs):
+        """Put the groups of tests on a queue. With durations, a TestDurations
+        object, the groups with the longest expected duration are queued
+        first, so that processes taking groups from the queue finish at
+        close to the same time."""
         test_queue = Queue()
         groups = []
 
@@ -318,6 +476,9 @@ class GroupedSource(TestSource):
             group.append(test)
             test.update_metadata(metadata)
 
+        if durations is not None:
+            groups.sort(key=lambda item: -sum(durations.get(test.id) for test in item[0]))
+
         for item in groups:
             test_queue.put(item)
         return test_queue
@@ -325,8 +486,28 @@ class GroupedSource(TestSource):
 
 class SingleTestSource(TestSource):
     @classmethod
-    def make_queue(cls, tests, **kwargs):
+    def make_queue(cls, tests, durations=None, **kwargs):
+        """Put the tests on a queue. By default the tests are split into one
+        group for each process by the hash of their id. With durations, a
+        TestDurations object, each test is queued on its own, longest
+        expected duration first, so processes take tests as they become
+        free. All the groups have the same scope, so moving to the next
+        test doesn't restart the browser. With durations, tests of each
+        type are kept together, in the order the types first appear, so
+        that processes only switch executor once the tests of one type run
+        out; without, each group can mix tests of several types."""
         test_queue = Queue()
+        if durations is not None:
+            type_order = {}
+            for test in tests:
+                type_order.setdefault(test.test_type, len(type_order))
+            for test in sorted(tests, key=lambda test: (type_order[test.test_type],
+                                                        -durations.get(test.id))):
+                metadata = cls.group_metadata(None)
+                test.update_metadata(metadata)
+                test_queue.put((deque([test]), metadata))
+            return test_queue
+
         processes = kwargs["processes"]
         queues = [deque([]) for _ in xrange(processes)]
         metadatas = [cls.group_metadata(None) for _ in xrange(processes)]
@@ -350,8 +531,9 @@ class PathGroupedSource(GroupedSource):
         if depth is True or depth == 0:
             depth = None
         path = urlsplit(test.url).path.split("/")[1:-1][:depth]
-        rv = path != state.get("prev_path")
+        rv = path != state.get("prev_path") or test.test_type != state.get("prev_type")
         state["prev_path"] = path
+        state["prev_type"] = test.test_type
         return rv
 
     @classmethod
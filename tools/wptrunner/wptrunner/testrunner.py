@@ -12,6 +12,11 @@ from mozlog import structuredlog, capture
 # Special value used as a sentinal in various commands
 Stop = object()
 
+# The browser and executor used to run the tests of one type
+TestImplementation = namedtuple("TestImplementation",
+                                ["executor_cls", "executor_kwargs",
+                                 "browser_cls", "browser_kwargs"])
+
 
 def release_mozlog_lock():
     try:
@@ -202,8 +207,9 @@ class BrowserManager(object):
         return restart_required
 
     def init(self, group_metadata):
-        """Launch the browser that is being tested,
-        and the TestRunner process that will run the tests."""
+        """Launch the browser that is being tested, unless it is still
+        running from the previous TestRunner, and the TestRunner process
+        that will run the tests."""
         # It seems that this lock is helpful to prevent some race that otherwise
         # sometimes stops the spawned processes initialising correctly, and
         # leaves this thread hung
@@ -218,9 +224,12 @@ class BrowserManager(object):
         try:
             if self.init_timer is not None:
                 self.init_timer.start()
-            self.logger.debug("Starting browser with settings %r" % self.browser_settings)
-            self.browser.start(group_metadata=group_metadata, **self.browser_settings)
-            self.browser_pid = self.browser.pid()
+            if self.started:
+                self.logger.debug("Reusing running browser")
+            else:
+                self.logger.debug("Starting browser with settings %r" % self.browser_settings)
+                self.browser.start(group_metadata=group_metadata, **self.browser_settings)
+                self.browser_pid = self.browser.pid()
         except Exception:
             self.logger.warning("Failure during init %s" % traceback.format_exc())
             if self.init_timer is not None:
@@ -269,6 +278,8 @@ class _RunnerManagerState(object):
                               ["test", "test_group", "group_metadata", "failure_count"])
     running = namedtuple("running", ["test", "test_group", "group_metadata"])
     restarting = namedtuple("restarting", ["test", "test_group", "group_metadata"])
+    switching_executor = namedtuple("switching_executor",
+                                    ["test", "test_group", "group_metadata"])
     error = namedtuple("error", [])
     stop = namedtuple("stop", [])
 
@@ -277,10 +288,9 @@ RunnerManagerState = _RunnerManagerState()
 
 
 class TestRunnerManager(threading.Thread):
-    def __init__(self, suite_name, test_queue, test_source_cls, browser_cls, browser_kwargs,
-                 executor_cls, executor_kwargs, stop_flag, rerun=1, pause_after_test=False,
-                 pause_on_unexpected=False, restart_on_unexpected=True, debug_info=None,
-                 capture_stdio=True):
+    def __init__(self, suite_name, test_queue, test_source_cls, test_implementations,
+                 stop_flag, rerun=1, pause_after_test=False, pause_on_unexpected=False,
+                 restart_on_unexpected=True, debug_info=None, capture_stdio=True):
         """Thread that owns a single TestRunner process and any processes required
         by the TestRunner (e.g. the Firefox binary).
 
@@ -295,16 +305,25 @@ class TestRunnerManager(threading.Thread):
         * Log the test results
         * Take any remedial action required e.g. restart crashed or hung
           processes
+
+        The queue may hold tests of several types, with test_implementations
+        mapping each type to the TestImplementation used to run it. When the
+        next test is of a different type, the TestRunner is restarted with the
+        executor for that type. The browser is kept running if it is
+        configured in the same way for both types, and restarted otherwise.
         """
         self.suite_name = suite_name
 
         self.test_source = test_source_cls(test_queue)
 
-        self.browser_cls = browser_cls
-        self.browser_kwargs = browser_kwargs
+        self.test_implementations = test_implementations
 
-        self.executor_cls = executor_cls
-        self.executor_kwargs = executor_kwargs
+        # These are set from the implementation of the test type being run
+        self.test_type = None
+        self.browser_cls = None
+        self.browser_kwargs = None
+        self.executor_cls = None
+        self.executor_kwargs = None
 
         # Flags used to shut down this thread if we get a sigint
         self.parent_stop_flag = stop_flag
@@ -349,53 +368,49 @@ class TestRunnerManager(threading.Thread):
         that the manager should shut down the next time the event loop
         spins."""
         self.logger = structuredlog.StructuredLogger(self.suite_name)
-        with self.browser_cls(self.logger, **self.browser_kwargs) as browser:
-            self.browser = BrowserManager(self.logger,
-                                          browser,
-                                          self.command_queue,
-                                          no_timeout=self.debug_info is not None)
-            dispatch = {
-                RunnerManagerState.before_init: self.start_init,
-                RunnerManagerState.initializing: self.init,
-                RunnerManagerState.running: self.run_test,
-                RunnerManagerState.restarting: self.restart_runner
-            }
+        dispatch = {
+            RunnerManagerState.before_init: self.start_init,
+            RunnerManagerState.initializing: self.init,
+            RunnerManagerState.running: self.run_test,
+            RunnerManagerState.restarting: self.restart_runner,
+            RunnerManagerState.switching_executor: self.switch_executor
+        }
 
-            self.state = RunnerManagerState.before_init()
-            end_states = (RunnerManagerState.stop,
-                          RunnerManagerState.error)
+        self.state = RunnerManagerState.before_init()
+        end_states = (RunnerManagerState.stop,
+                      RunnerManagerState.error)
 
-            try:
-                while not isinstance(self.state, end_states):
-                    f = dispatch.get(self.state.__class__)
-                    while f:
-                        self.logger.debug("Dispatch %s" % f.__name__)
-                        if self.should_stop():
-                            return
-                        new_state = f()
-                        if new_state is None:
-                            break
-                        self.state = new_state
-                        self.logger.debug("new state: %s" % self.state.__class__.__name__)
-                        if isinstance(self.state, end_states):
-                            return
-                        f = dispatch.get(self.state.__class__)
-
-                    new_state = None
-                    while new_state is None:
-                        new_state = self.wait_event()
-                        if self.should_stop():
-                            return
+        try:
+            while not isinstance(self.state, end_states):
+                f = dispatch.get(self.state.__class__)
+                while f:
+                    self.logger.debug("Dispatch %s" % f.__name__)
+                    if self.should_stop():
+                        return
+                    new_state = f()
+                    if new_state is None:
+                        break
                     self.state = new_state
                     self.logger.debug("new state: %s" % self.state.__class__.__name__)
-            except Exception as e:
-                self.logger.error(traceback.format_exc(e))
-                raise
-            finally:
-                self.logger.debug("TestRunnerManager main loop terminating, starting cleanup")
-                clean = isinstance(self.state, RunnerManagerState.stop)
-                self.stop_runner(force=not clean)
-                self.teardown()
+                    if isinstance(self.state, end_states):
+                        return
+                    f = dispatch.get(self.state.__class__)
+
+                new_state = None
+                while new_state is None:
+                    new_state = self.wait_event()
+                    if self.should_stop():
+                        return
+                self.state = new_state
+                self.logger.debug("new state: %s" % self.state.__class__.__name__)
+        except Exception as e:
+            self.logger.error(traceback.format_exc(e))
+            raise
+        finally:
+            self.logger.debug("TestRunnerManager main loop terminating, starting cleanup")
+            clean = isinstance(self.state, RunnerManagerState.stop)
+            self.stop_runner(force=not clean)
+            self.teardown()
         self.logger.debug("TestRunnerManager main loop terminated")
 
     def wait_event(self):
@@ -412,6 +427,7 @@ class TestRunnerManager(threading.Thread):
                 "wait_finished": self.wait_finished,
             },
             RunnerManagerState.restarting: {},
+            RunnerManagerState.switching_executor: {},
             RunnerManagerState.error: {},
             RunnerManagerState.stop: {},
             None: {
@@ -476,7 +492,15 @@ class TestRunnerManager(threading.Thread):
             self.logger.critical("Max restarts exceeded")
             return RunnerManagerState.error()
 
-        self.browser.update_settings(self.state.test)
+        if self.state.test.test_type != self.test_type:
+            self.set_test_type(self.state.test.test_type)
+
+        restart_required = self.browser.update_settings(self.state.test)
+        if self.browser.started and (restart_required or not self.browser.is_alive()):
+            # The browser was kept running for the previous executor, but it
+            # can't be used for this test
+            self.logger.info("Restarting browser")
+            self.browser.stop(force=True)
 
         result = self.browser.init(self.state.group_metadata)
         if result is Stop:
@@ -490,6 +514,34 @@ class TestRunnerManager(threading.Thread):
             self.executor_kwargs["group_metadata"] = self.state.group_metadata
             self.start_test_runner()
 
+    def set_test_type(self, test_type):
+        """Use the executor for a test type, and replace the browser if the
+        test type needs one that is configured differently"""
+        implementation = self.test_implementations[test_type]
+        if (self.browser is None or
+            implementation.browser_cls != self.browser_cls or
+            implementation.browser_kwargs != self.browser_kwargs):
+            if self.browser is not None:
+                assert not self.browser.started
+                self.browser.browser.cleanup()
+            self.browser_cls = implementation.browser_cls
+            self.browser_kwargs = implementation.browser_kwargs
+            browser = self.browser_cls(self.logger, **self.browser_kwargs)
+            browser.setup()
+            self.browser = BrowserManager(self.logger,
+                                          browser,
+                                          self.command_queue,
+                                          no_timeout=self.debug_info is not None)
+        self.executor_cls = implementation.executor_cls
+        self.executor_kwargs = implementation.executor_kwargs
+        self.test_type = test_type
+
+    def can_keep_browser(self, test_type):
+        """Check if tests of a type can run in the current browser"""
+        implementation = self.test_implementations[test_type]
+        return (implementation.browser_cls == self.browser_cls and
+                implementation.browser_kwargs == self.browser_kwargs)
+
     def start_test_runner(self):
         # Note that we need to be careful to start the browser before the
         # test runner to ensure that any state set when the browser is started
@@ -657,12 +709,17 @@ class TestRunnerManager(threading.Thread):
             test, test_group, group_metadata = self.get_next_test()
             if test is None:
                 return RunnerManagerState.stop()
-            if test_group != self.state.test_group:
-                # We are starting a new group of tests, so force a restart
+            if group_metadata.get("scope") != self.state.group_metadata.get("scope"):
+                # We are starting a group of tests with a different scope,
+                # so force a restart
                 restart = True
         else:
             test_group = self.state.test_group
             group_metadata = self.state.group_metadata
+        if test.test_type != self.test_type and not restart:
+            if self.can_keep_browser(test.test_type):
+                return RunnerManagerState.switching_executor(test, test_group, group_metadata)
+            restart = True
         if restart:
             return RunnerManagerState.restarting(test, test_group, group_metadata)
         else:
@@ -674,6 +731,14 @@ class TestRunnerManager(threading.Thread):
         self.stop_runner()
         return RunnerManagerState.initializing(self.state.test, self.state.test_group, self.state.group_metadata, 0)
 
+    def switch_executor(self):
+        """Stop the TestRunner and start one with the executor for the next
+        test, keeping the browser running"""
+        assert isinstance(self.state, RunnerManagerState.switching_executor)
+        self.logger.info("Switching to the %s executor" % self.state.test.test_type)
+        self.stop_runner(stop_browser=False)
+        return RunnerManagerState.initializing(self.state.test, self.state.test_group, self.state.group_metadata, 0)
+
     def log(self, action, kwargs):
         getattr(self.logger, action)(**kwargs)
 
@@ -681,21 +746,25 @@ class TestRunnerManager(threading.Thread):
         self.logger.error(message)
         self.restart_runner()
 
-    def stop_runner(self, force=False):
-        """Stop the TestRunner and the browser binary."""
+    def stop_runner(self, force=False, stop_browser=True):
+        """Stop the TestRunner and, unless stop_browser is False, the
+        browser binary."""
         if self.test_runner_proc is None:
             return
 
         if self.test_runner_proc.is_alive():
             self.send_message("stop")
         try:
-            self.browser.stop(force=force)
+            if stop_browser:
+                self.browser.stop(force=force)
             self.ensure_runner_stopped()
         finally:
             self.cleanup()
 
     def teardown(self):
         self.logger.debug("TestRunnerManager teardown")
+        if self.browser is not None:
+            self.browser.browser.cleanup()
         self.test_runner_proc = None
         self.command_queue.close()
         self.remote_queue.close()
@@ -775,8 +844,7 @@ def make_test_queue(tests, test_source_cls, **test_source_kwargs):
 class ManagerGroup(object):
     """Main thread object that owns all the TestRunnerManager threads."""
     def __init__(self, suite_name, size, test_source_cls, test_source_kwargs,
-                 browser_cls, browser_kwargs,
-                 executor_cls, executor_kwargs,
+                 test_implementations,
                  rerun=1,
                  pause_after_test=False,
                  pause_on_unexpected=False,
@@ -787,10 +855,7 @@ class ManagerGroup(object):
         self.size = size
         self.test_source_cls = test_source_cls
         self.test_source_kwargs = test_source_kwargs
-        self.browser_cls = browser_cls
-        self.browser_kwargs = browser_kwargs
-        self.executor_cls = executor_cls
-        self.executor_kwargs = executor_kwargs
+        self.test_implementations = test_implementations
         self.pause_after_test = pause_after_test
         self.pause_on_unexpected = pause_on_unexpected
         self.restart_on_unexpected = restart_on_unexpected
@@ -810,12 +875,13 @@ class ManagerGroup(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop()
 
-    def run(self, test_type, tests):
-        """Start all managers in the group"""
+    def run(self, test_types, tests):
+        """Start all managers in the group, running the tests of the given
+        types from a single queue"""
         self.logger.debug("Using %i processes" % self.size)
-        type_tests = tests[test_type]
+        type_tests = [test for test_type in test_types for test in tests[test_type]]
         if not type_tests:
-            self.logger.info("No %s tests to run" % test_type)
+            self.logger.info("No %s tests to run" % ", ".join(test_types))
             return
 
         test_queue = make_test_queue(type_tests, self.test_source_cls, **self.test_source_kwargs)
@@ -824,10 +890,7 @@ class ManagerGroup(object):
             manager = TestRunnerManager(self.suite_name,
                                         test_queue,
                                         self.test_source_cls,
-                                        self.browser_cls,
-                                        self.browser_kwargs,
-                                        self.executor_cls,
-                                        self.executor_kwargs,
+                                        self.test_implementations,
                                         self.stop_flag,
                                         self.rerun,
                                         self.pause_after_test,
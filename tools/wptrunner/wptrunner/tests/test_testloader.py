@@ -1,11 +1,16 @@
 from __future__ import unicode_literals
 
+import json
 import sys
 import tempfile
 
 import pytest
+from six.moves.queue import Empty
 
 from mozlog import structured
+from ..testloader import (DirectoryDurationChunker, DurationChunker, HashChunker,
+                          PathGroupedSource, SingleTestSource)
+from ..testloader import TestDurations as Durations
 from ..testloader import TestFilter as Filter
 from .test_wpttest import make_mock_manifest
 
@@ -31,3 +36,134 @@ def test_filter_unicode():
         f.flush()
 
         Filter(manifest_path=f.name, test_manifests=tests)
+
+
+class MockTest(object):
+    def __init__(self, test_id, test_type="testharness"):
+        self.id = test_id
+        self.url = test_id
+        self.test_type = test_type
+
+    def update_metadata(self, metadata):
+        pass
+
+
+def drain(queue):
+    rv = []
+    while True:
+        try:
+            group, metadata = queue.get(timeout=1)
+        except Empty:
+            return rv
+        rv.append(([test.id for test in group], metadata))
+
+
+def write_json(tmpdir, name, data):
+    path = tmpdir.join(name)
+    path.write(json.dumps(data))
+    return str(path)
+
+
+def test_durations_load(tmpdir):
+    report = write_json(tmpdir, "report.json", {"results": [
+        {"test": "/a/1.html", "duration": 100, "status": "OK", "subtests": []},
+        {"test": "/a/2.html", "status": "OK", "subtests": []},
+    ]})
+    mapping = write_json(tmpdir, "durations.json", {"/a/1.html": 300, "/b/1.html": 50})
+    durations = Durations.load([report, mapping])
+    assert len(durations) == 2
+    assert durations.get("/a/1.html") == 200
+    assert durations.get("/b/1.html") == 50
+
+
+def test_durations_unknown():
+    durations = Durations({"/a/b/1.html": 100,
+                               "/a/b/2.html": 300,
+                               "/a/c/1.html": 1000,
+                               "/d/1.html?x": 2000})
+    assert durations.get("/a/b/3.html") == 200
+    assert durations.get("/a/e/1.html") == 1400. / 3
+    assert durations.get("/f/1.html") == 3400. / 4
+    assert Durations().get("/a/1.html") == Durations.default_duration
+
+
+def test_single_source_durations():
+    tests = [MockTest("/a/%i.html" % i) for i in range(4)]
+    durations = Durations({"/a/1.html": 40, "/a/2.html": 50, "/a/3.html": 10})
+    queued = drain(SingleTestSource.make_queue(tests, processes=2, durations=durations))
+    assert [ids for ids, _ in queued] == [["/a/2.html"], ["/a/1.html"], ["/a/0.html"],
+                                          ["/a/3.html"]]
+    assert all(metadata == {"scope": "/"} for _, metadata in queued)
+
+
+def test_single_source_durations_test_types():
+    tests = [MockTest("/a/1.html", "reftest"), MockTest("/a/2.html"),
+             MockTest("/a/3.html", "reftest"), MockTest("/a/4.html")]
+    durations = Durations({"/a/1.html": 10, "/a/2.html": 20, "/a/3.html": 30,
+                           "/a/4.html": 40})
+    queued = drain(SingleTestSource.make_queue(tests, processes=2, durations=durations))
+    assert [ids for ids, _ in queued] == [["/a/3.html"], ["/a/1.html"], ["/a/4.html"],
+                                          ["/a/2.html"]]
+
+
+def test_path_grouped_source_durations():
+    tests = [MockTest(test_id) for test_id in
+             ["/a/1.html", "/b/1.html", "/b/2.html", "/c/1.html"]]
+    durations = Durations({"/a/1.html": 30, "/b/1.html": 20, "/b/2.html": 20,
+                               "/c/1.html": 100})
+    queued = drain(PathGroupedSource.make_queue(tests, depth=None, durations=durations))
+    assert [metadata["scope"] for _, metadata in queued] == ["/c", "/b", "/a"]
+
+    queued = drain(PathGroupedSource.make_queue(tests, depth=None))
+    assert [metadata["scope"] for _, metadata in queued] == ["/a", "/b", "/c"]
+
+
+def test_path_grouped_source_test_types():
+    tests = [MockTest("/a/1.html"), MockTest("/a/2.html"), MockTest("/a/1-ref.html", "reftest"),
+             MockTest("/b/1.html", "reftest")]
+    queued = drain(PathGroupedSource.make_queue(tests, depth=None))
+    assert [ids for ids, _ in queued] == [["/a/1.html", "/a/2.html"], ["/a/1-ref.html"],
+                                          ["/b/1.html"]]
+
+
+def chunk_manifest(chunker_cls, items, durations, total_chunks):
+    manifest = [("testharness", path, {MockTest(test_id) for test_id in test_ids})
+                for path, test_ids in items]
+    return [sorted(path for _, path, _ in chunker_cls(total_chunks, i, durations=durations)(manifest))
+            for i in range(1, total_chunks + 1)]
+
+
+def test_duration_chunker():
+    items = [("a/%i.html" % i, ["/a/%i.html" % i]) for i in range(6)]
+    durations = Durations({"/a/0.html": 600, "/a/1.html": 500, "/a/2.html": 400,
+                           "/a/3.html": 300, "/a/4.html": 200, "/a/5.html": 100})
+    chunks = chunk_manifest(DurationChunker, items, durations, 3)
+    assert chunks == [["a/0.html", "a/5.html"], ["a/1.html", "a/4.html"],
+                      ["a/2.html", "a/3.html"]]
+    # Every chunk computes the same split, whatever the order of the manifest
+    assert chunk_manifest(DurationChunker, list(reversed(items)), durations, 3) == chunks
+
+
+def test_duration_chunker_unknown():
+    items = [("a/1.html", ["/a/1.html"]), ("b/1.html", ["/b/1.html"]),
+             ("c/1.html", ["/c/1.html"]), ("c/2.html", ["/c/2.html"])]
+    durations = Durations({"/a/1.html": 100, "/b/1.html": 100})
+    chunks = chunk_manifest(DurationChunker, items, durations, 2)
+    assert sorted(sum(chunks, [])) == [path for path, _ in items]
+    # Files without durations are split by hash, as by HashChunker
+    for chunk_number, chunk in enumerate(chunks, 1):
+        hashed = list(HashChunker(2, chunk_number)(
+            [("testharness", path, set()) for path in ["c/1.html", "c/2.html"]]))
+        assert {path for _, path, _ in hashed} == {path for path in chunk if path.startswith("c/")}
+    # The files with durations balance them
+    assert ["a/1.html"] in [[path for path in chunk if not path.startswith("c/")]
+                            for chunk in chunks]
+
+
+def test_directory_duration_chunker():
+    items = [("a/1.html", ["/a/1.html"]), ("a/2.html", ["/a/2.html"]),
+             ("b/1.html", ["/b/1.html"]), ("c/1.html", ["/c/1.html"])]
+    durations = Durations({"/a/1.html": 100, "/a/2.html": 100, "/b/1.html": 150,
+                           "/c/1.html": 50})
+    assert chunk_manifest(DirectoryDurationChunker, items, durations, 2) == [
+        ["a/1.html", "a/2.html"], ["b/1.html", "c/1.html"]]
@@ -0,0 +1,131 @@
+from __future__ import unicode_literals
+
+import threading
+from collections import deque
+
+import mock
+from six.moves.queue import Queue
+
+from .. import testrunner
+from ..browsers.base import Browser
+from ..testloader import SingleTestSource
+from ..testrunner import RunnerManagerState
+
+
+class MockBrowser(Browser):
+    def __init__(self, logger, **kwargs):
+        Browser.__init__(self, logger)
+        self.kwargs = kwargs
+        self.running = False
+        self.start_count = 0
+        self.cleanup_count = 0
+
+    def start(self, group_metadata=None, **kwargs):
+        self.start_count += 1
+        self.running = True
+
+    def stop(self, force=False):
+        self.running = False
+
+    def pid(self):
+        return None
+
+    def is_alive(self):
+        return self.running
+
+    def cleanup(self):
+        self.cleanup_count += 1
+
+
+class MockTest(object):
+    def __init__(self, test_id, test_type):
+        self.id = test_id
+        self.url = test_id
+        self.test_type = test_type
+
+    def expected(self, subtest=None):
+        return "OK"
+
+
+def make_manager(browser_kwargs):
+    """Get a manager for a testharness test followed by a reftest, where
+    browser_kwargs maps each type to the kwargs of its browser"""
+    implementations = {test_type: testrunner.TestImplementation(getattr(mock.sentinel, test_type),
+                                                                {"timeout_multiplier": 1},
+                                                                MockBrowser,
+                                                                kwargs)
+                       for test_type, kwargs in browser_kwargs.items()}
+    # A queue local to this process, so that the group can be taken from it
+    # as soon as it's put on
+    test_queue = Queue()
+    test_queue.put((deque([MockTest("/a/1.html", "testharness"),
+                           MockTest("/a/2.html", "reftest")]),
+                    SingleTestSource.group_metadata(None)))
+    manager = testrunner.TestRunnerManager("web-platform-tests", test_queue, SingleTestSource,
+                                           implementations, threading.Event(),
+                                           capture_stdio=False)
+    manager.logger = mock.Mock()
+    return manager
+
+
+def init(manager):
+    """Move an initializing manager to the running state, without starting
+    a TestRunner process"""
+    with mock.patch.object(testrunner, "Process") as process:
+        assert manager.init() is None
+    assert process.call_args[1]["args"][2] is manager.executor_cls
+    manager.test_runner_proc.is_alive.return_value = False
+    manager.test_runner_proc.exitcode = 0
+    manager.state = manager.init_succeeded()
+
+
+def run_first_test(manager):
+    """Run the first test, returning the state after it ends"""
+    manager.state = manager.start_init()
+    init(manager)
+    assert manager.executor_cls is mock.sentinel.testharness
+    manager.run_count = manager.rerun
+    return manager.after_test_end(manager.state.test, False)
+
+
+def test_switch_executor_same_browser():
+    manager = make_manager({"testharness": {"name": "a"}, "reftest": {"name": "a"}})
+    try:
+        state = run_first_test(manager)
+        assert isinstance(state, RunnerManagerState.switching_executor)
+        assert state.test.test_type == "reftest"
+        browser = manager.browser.browser
+
+        manager.state = state
+        manager.state = manager.switch_executor()
+        assert browser.running
+        init(manager)
+
+        assert manager.executor_cls is mock.sentinel.reftest
+        assert manager.browser.browser is browser
+        assert browser.start_count == 1
+        assert browser.cleanup_count == 0
+    finally:
+        manager.teardown()
+
+
+def test_switch_executor_different_browser():
+    manager = make_manager({"testharness": {"name": "a"}, "reftest": {"name": "b"}})
+    try:
+        state = run_first_test(manager)
+        assert isinstance(state, RunnerManagerState.restarting)
+        browser = manager.browser.browser
+
+        manager.state = state
+        manager.state = manager.restart_runner()
+        assert not browser.running
+        init(manager)
+
+        assert manager.executor_cls is mock.sentinel.reftest
+        new_browser = manager.browser.browser
+        assert new_browser is not browser
+        assert new_browser.kwargs == {"name": "b"}
+        assert new_browser.start_count == 1
+        assert browser.cleanup_count == 1
+    finally:
+        manager.teardown()
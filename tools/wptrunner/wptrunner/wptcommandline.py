@@ -65,6 +65,17 @@ scheme host and port.""")
                         "directory")
     parser.add_argument("--processes", action="store", type=int, default=None,
                         help="Number of simultaneous processes to use")
+    parser.add_argument("--test-durations", action="append", default=None,
+                        help="Path to a wptreport JSON file, or a JSON object mapping test ids "
+                        "to durations in milliseconds, from a previous run. When given, the "
+                        "tests expected to take longest are started first and processes take "
+                        "new tests as they become free. May be given more than once")
+    parser.add_argument("--mix-test-types", action="store_true", default=False,
+                        help="Run the tests of all types from a single queue, so that "
+                        "processes move on to the next type as soon as the tests of one type "
+                        "run out, rather than waiting for every process to finish. The "
+                        "browser is kept running when switching between types that use the "
+                        "same browser configuration")
 
     parser.add_argument("--no-capture-stdio", action="store_true", default=False,
                         help="Don't capture stdio and write to logging")
@@ -232,8 +243,13 @@ scheme host and port.""")
                                 help="Total number of chunks to use")
     chunking_group.add_argument("--this-chunk", action="store", type=int, default=1,
                                 help="Chunk number to run")
-    chunking_group.add_argument("--chunk-type", action="store", choices=["none", "hash", "dir_hash"],
-                                default=None, help="Chunking type to use")
+    chunking_group.add_argument("--chunk-type", action="store",
+                                choices=["none", "hash", "dir_hash", "duration", "dir_duration"],
+                                default=None,
+                                help="Chunking type to use. duration and dir_duration split "
+                                "files or directories into chunks of close to the same expected "
+                                "duration according to --test-durations (the default with more "
+                                "than one chunk when --test-durations is given)")
 
     ssl_group = parser.add_argument_group("SSL/TLS")
     ssl_group.add_argument("--ssl-type", action="store", default=None,
@@ -482,10 +498,13 @@ def check_args(kwargs):
 
     if kwargs["chunk_type"] is None:
         if kwargs["total_chunks"] > 1:
-            kwargs["chunk_type"] = "dir_hash"
+            kwargs["chunk_type"] = "dir_duration" if kwargs.get("test_durations") else "dir_hash"
         else:
             kwargs["chunk_type"] = "none"
 
+    if kwargs["chunk_type"] in ("duration", "dir_duration"):
+        require_arg(kwargs, "test_durations")
+
     if kwargs["processes"] is None:
         kwargs["processes"] = 1
 
@@ -14,7 +14,7 @@ import wptlogging
 import wpttest
 from mozlog import capture, handlers
 from font import FontInstaller
-from testrunner import ManagerGroup
+from testrunner import ManagerGroup, TestImplementation
 from browsers.base import NullBrowser
 
 here = os.path.split(__file__)[0]
@@ -67,6 +67,11 @@ def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
                                                       test_manifests=test_manifests,
                                                       explicit=kwargs["default_exclude"]))
 
+    durations = None
+    if kwargs.get("test_durations"):
+        durations = testloader.TestDurations.load(kwargs["test_durations"])
+        logger.info("Loaded durations of %i tests" % len(durations))
+
     ssl_enabled = sslutils.get_cls(kwargs["ssl_type"]).ssl_enabled
     test_loader = testloader.TestLoader(test_manifests,
                                         kwargs["test_types"],
@@ -76,7 +81,8 @@ def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
                                         total_chunks=kwargs["total_chunks"],
                                         chunk_number=kwargs["this_chunk"],
                                         include_https=ssl_enabled,
-                                        skip_timeout=kwargs["skip_timeout"])
+                                        skip_timeout=kwargs["skip_timeout"],
+                                        durations=durations)
     return run_info, test_loader
 
 
@@ -157,6 +163,8 @@ def run_tests(config, test_paths, product, **kwargs):
                                            **kwargs)
 
         test_source_kwargs = {"processes": kwargs["processes"]}
+        if test_loader.durations is not None:
+            test_source_kwargs["durations"] = test_loader.durations
         if kwargs["run_by_dir"] is False:
             test_source_cls = testloader.SingleTestSource
         else:
@@ -216,9 +224,9 @@ def run_tests(config, test_paths, product, **kwargs):
                                    name='web-platform-test',
                                    run_info=run_info,
                                    extra={"run_by_dir": kwargs["run_by_dir"]})
+                test_implementations = {}
+                run_tests = {}
                 for test_type in kwargs["test_types"]:
-                    logger.info("Running %s tests" % test_type)
-
                     # WebDriver tests may create and destroy multiple browser
                     # processes as part of their expected behavior. These
                     # processes are managed by a WebDriver server binary. This
@@ -252,7 +260,7 @@ def run_tests(config, test_paths, product, **kwargs):
                         skipped_tests += 1
 
                     if test_type == "testharness":
-                        run_tests = {"testharness": []}
+                        run_tests["testharness"] = []
                         for test in test_loader.tests["testharness"]:
                             if ((test.testdriver and not executor_cls.supports_testdriver) or
                                 (test.jsshell and not executor_cls.supports_jsshell)):
@@ -262,16 +270,31 @@ def run_tests(config, test_paths, product, **kwargs):
                             else:
                                 run_tests["testharness"].append(test)
                     else:
-                        run_tests = test_loader.tests
+                        run_tests[test_type] = test_loader.tests[test_type]
+
+                    test_implementations[test_type] = TestImplementation(executor_cls,
+                                                                         executor_kwargs,
+                                                                         browser_cls,
+                                                                         browser_kwargs)
+
+                test_types = [test_type for test_type in kwargs["test_types"]
+                              if test_type in test_implementations]
+                if kwargs["mix_test_types"]:
+                    # Processes move on to the next type as soon as the
+                    # tests of one type run out
+                    type_groups = [test_types]
+                else:
+                    type_groups = [[test_type] for test_type in test_types]
+
+                for group_types in type_groups:
+                    logger.info("Running %s tests" % ", ".join(group_types))
 
                     with ManagerGroup("web-platform-tests",
                                       kwargs["processes"],
                                       test_source_cls,
                                       test_source_kwargs,
-                                      browser_cls,
-                                      browser_kwargs,
-                                      executor_cls,
-                                      executor_kwargs,
+                                      {test_type: test_implementations[test_type]
+                                       for test_type in group_types},
                                       kwargs["rerun"],
                                       kwargs["pause_after_test"],
                                       kwargs["pause_on_unexpected"],
@@ -279,7 +302,7 @@ def run_tests(config, test_paths, product, **kwargs):
                                       kwargs["debug_info"],
                                       not kwargs["no_capture_stdio"]) as manager_group:
                         try:
-                            manager_group.run(test_type, run_tests)
+                            manager_group.run(group_types, run_tests)
                         except KeyboardInterrupt:
                             logger.critical("Main thread got signal")
                             manager_group.stop()
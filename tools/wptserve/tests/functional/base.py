@@ -48,12 +48,16 @@ class Request(BaseRequest):
 
 
 class TestUsingServer(unittest.TestCase):
+    # Class to use for the server, or None for the default
+    server_cls = None
+
     def setUp(self):
         self.server = wptserve.server.WebTestHttpd(host="localhost",
                                                    port=0,
                                                    use_ssl=False,
                                                    certificate=None,
-                                                   doc_root=doc_root)
+                                                   doc_root=doc_root,
+                                                   server_cls=self.server_cls)
         self.server.start(False)
 
     def tearDown(self):
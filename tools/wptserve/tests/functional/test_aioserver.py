@@ -0,0 +1,176 @@
+import functools
+import os
+import socket
+import threading
+
+import pytest
+from six import PY3
+from six.moves import http_client
+
+wptserve = pytest.importorskip("wptserve")
+from .base import TestUsingServer, doc_root
+from . import test_handlers, test_pipes, test_request, test_response, test_server
+
+if PY3:
+    from wptserve.aioserver import AsyncioWebTestServer
+else:
+    AsyncioWebTestServer = None
+
+pytestmark = pytest.mark.skipif(not PY3, reason="asyncio requires Python 3")
+
+
+class AsyncioServerMixin(object):
+    server_cls = AsyncioWebTestServer
+
+
+# Run the existing functional tests against the asyncio server
+
+class TestFileHandler(AsyncioServerMixin, test_handlers.TestFileHandler):
+    pass
+
+
+class TestFunctionHandler(AsyncioServerMixin, test_handlers.TestFunctionHandler):
+    pass
+
+
+class TestPythonHandler(AsyncioServerMixin, test_handlers.TestPythonHandler):
+    pass
+
+
+class TestAsIsHandler(AsyncioServerMixin, test_handlers.TestAsIsHandler):
+    pass
+
+
+class TestTrickle(AsyncioServerMixin, test_pipes.TestTrickle):
+    pass
+
+
+class TestPipesWithVariousHandlers(AsyncioServerMixin, test_pipes.TestPipesWithVariousHandlers):
+    pass
+
+
+class TestInputFile(AsyncioServerMixin, test_request.TestInputFile):
+    pass
+
+
+class TestRequest(AsyncioServerMixin, test_request.TestRequest):
+    pass
+
+
+class TestResponse(AsyncioServerMixin, test_response.TestResponse):
+    pass
+
+
+class TestRewriter(AsyncioServerMixin, test_server.TestRewriter):
+    pass
+
+
+class TestRequestHandler(AsyncioServerMixin, test_server.TestRequestHandler):
+    pass
+
+
+class TestAsyncioServer(TestUsingServer):
+    server_cls = functools.partial(AsyncioWebTestServer, max_workers=2) if PY3 else None
+
+    def test_keep_alive(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            return request.body
+
+        self.server.router.register("POST", "/test/echo", handler)
+        conn = http_client.HTTPConnection("localhost", self.server.port)
+        try:
+            for i in range(5):
+                conn.request("POST", "/test/echo", body=b"x" * i)
+                resp = conn.getresponse()
+                self.assertEqual(200, resp.status)
+                self.assertEqual(b"x" * i, resp.read())
+                self.assertFalse(resp.will_close)
+        finally:
+            conn.close()
+
+    def test_idle_connections(self):
+        # Idle connections don't use a worker, so there can be many more of
+        # them than workers
+        sockets = [socket.create_connection(("localhost", self.server.port))
+                   for _ in range(20)]
+        try:
+            resp = self.request("/document.txt")
+            self.assertEqual(200, resp.getcode())
+        finally:
+            for sock in sockets:
+                sock.close()
+
+    def test_concurrent_requests(self):
+        event = threading.Event()
+
+        @wptserve.handlers.handler
+        def handler(request, response):
+            if request.GET.first(b"wait", None):
+                event.wait(10)
+            else:
+                event.set()
+            return b"done"
+
+        self.server.router.register("GET", "/test/wait", handler)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.request("/test/wait", query="wait=1").read()))
+        thread.start()
+        self.assertEqual(b"done", self.request("/test/wait").read())
+        thread.join()
+        self.assertEqual([b"done"], results)
+
+    def test_stop_with_open_connection(self):
+        sock = socket.create_connection(("localhost", self.server.port))
+        try:
+            sock.sendall(b"GET /document.txt HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 200"))
+            sock.settimeout(10)
+            self.server.stop()
+            # The rest of the response may still be on its way, but then the
+            # connection is closed rather than left open
+            while sock.recv(1024):
+                pass
+        finally:
+            sock.close()
+
+    def test_bare_lf(self):
+        sock = socket.create_connection(("localhost", self.server.port))
+        try:
+            sock.settimeout(10)
+            sock.sendall(b"\nGET /document.txt HTTP/1.1\nHost: localhost\n\n")
+            resp = http_client.HTTPResponse(sock)
+            resp.begin()
+            self.assertEqual(200, resp.status)
+            with open(os.path.join(doc_root, "document.txt"), "rb") as f:
+                self.assertEqual(f.read(), resp.read())
+        finally:
+            sock.close()
+
+    def test_chunked_body(self):
+        sock = socket.create_connection(("localhost", self.server.port))
+        try:
+            sock.settimeout(10)
+            sock.sendall(b"POST /document.txt HTTP/1.1\r\nHost: localhost\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n"
+                         b"4\r\nabcd\r\n0\r\n\r\n")
+            resp = http_client.HTTPResponse(sock)
+            resp.begin()
+            self.assertEqual(411, resp.status)
+            resp.read()
+            # The rest of the body isn't read as another request
+            self.assertEqual(b"", sock.recv(1024))
+        finally:
+            sock.close()
+
+    def test_invalid_content_length(self):
+        sock = socket.create_connection(("localhost", self.server.port))
+        try:
+            sock.settimeout(10)
+            sock.sendall(b"POST /document.txt HTTP/1.1\r\nHost: localhost\r\n"
+                         b"Content-Length: -4\r\n\r\nabcd")
+            resp = http_client.HTTPResponse(sock)
+            resp.begin()
+            self.assertEqual(400, resp.status)
+        finally:
+            sock.close()
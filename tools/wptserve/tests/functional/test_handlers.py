@@ -12,6 +12,7 @@ from .base import TestUsingServer, TestUsingH2Server, doc_root
 from .base import TestWrapperHandlerUsingServer
 
 from serve import serve
+from wptserve.filecache import FileCache
 
 class TestFileHandler(TestUsingServer):
     def test_GET(self):
@@ -60,6 +61,13 @@ class TestFileHandler(TestUsingServer):
                          resp.info()['Content-Range'])
         self.assertEqual(expected[-10:], data)
 
+    def test_range_slice(self):
+        resp = self.request("/document.txt", query="pipe=slice(2,8)", headers={"Range":"bytes=10-29"})
+        self.assertEqual(206, resp.getcode())
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        self.assertEqual("6", resp.info()['Content-Length'])
+        self.assertEqual(expected[12:18], resp.read())
+
     def test_multiple_ranges(self):
         resp = self.request("/document.txt", headers={"Range":"bytes=1-2,5-7,6-10"})
         self.assertEqual(206, resp.getcode())
@@ -104,6 +112,70 @@ class TestFileHandler(TestUsingServer):
         assert resp.read().rstrip() == expected
 
 
+class TestCachedFileHandler(TestUsingServer):
+    def setUp(self):
+        super(TestCachedFileHandler, self).setUp()
+        self.cache = FileCache()
+        self.server.router.register("GET", "/cached/*",
+                                    wptserve.handlers.FileHandler(url_base="/cached/",
+                                                                  cache=self.cache))
+
+    def test_GET(self):
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        for _ in range(2):
+            resp = self.request("/cached/document.txt")
+            self.assertEqual(200, resp.getcode())
+            self.assertEqual("text/plain", resp.info()["Content-Type"])
+            self.assertEqual(str(len(expected)), resp.info()["Content-Length"])
+            self.assertEqual(expected, resp.read())
+        self.assertIn(("read", os.path.join(doc_root, "document.txt")), self.cache._entries)
+
+    def test_headers(self):
+        for _ in range(2):
+            resp = self.request("/cached/with_headers.txt")
+            self.assertEqual(200, resp.getcode())
+            self.assertEqual("text/html", resp.info()["Content-Type"])
+            self.assertEqual("PASS", resp.info()["Custom-Header"])
+            uuid.UUID(resp.info()["Another-Header"])
+            self.assertEqual(resp.info()["Same-Value-Header"], resp.info()["Another-Header"])
+            self.assert_multiple_headers(resp, "Double-Header", ["PA", "SS"])
+
+    def test_range(self):
+        resp = self.request("/cached/document.txt", headers={"Range":"bytes=10-19"})
+        self.assertEqual(206, resp.getcode())
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        self.assertEqual(expected[10:20], resp.read())
+
+    def test_sub_headers(self):
+        resp = self.request("/cached/sub_headers.sub.txt", headers={"X-Test": "PASS"})
+        assert resp.read().rstrip() == b"PASS"
+
+    def test_modified(self):
+        name = "cached-%s.txt" % uuid.uuid4()
+        path = os.path.join(doc_root, name)
+        try:
+            with open(path, "wb") as f:
+                f.write(b"first")
+            self.assertEqual(b"first", self.request("/cached/" + name).read())
+
+            with open(path, "wb") as f:
+                f.write(b"second")
+            with open(path + ".headers", "wb") as f:
+                f.write(b"Custom-Header: PASS\n")
+            # Make sure the change is detected even with coarse mtimes
+            st = os.stat(doc_root)
+            os.utime(doc_root, (st.st_atime, st.st_mtime + 10))
+            os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+            resp = self.request("/cached/" + name)
+            self.assertEqual(b"second", resp.read())
+            self.assertEqual("PASS", resp.info()["Custom-Header"])
+        finally:
+            for item in [path, path + ".headers"]:
+                if os.path.exists(item):
+                    os.unlink(item)
+
+
 class TestFunctionHandler(TestUsingServer):
     def test_string_rv(self):
         @wptserve.handlers.handler
@@ -266,6 +338,24 @@ class TestPythonHandler(TestUsingServer):
         self.assertEqual("text/plain", resp.info()["Content-Type"])
         self.assertEqual(b"PASS", resp.read())
 
+    def test_modified(self):
+        name = "modified-%s.py" % uuid.uuid4().hex
+        path = os.path.join(doc_root, name)
+        try:
+            with open(path, "w") as f:
+                f.write("def main(request, response):\n    return 'first'\n")
+            self.assertEqual(b"first", self.request("/" + name).read())
+            self.assertIn(path, wptserve.handlers.script_cache._entries)
+
+            with open(path, "w") as f:
+                f.write("def main(request, response):\n    return 'second'\n")
+            # Make sure the change is detected even with coarse mtimes
+            st = os.stat(path)
+            os.utime(path, (st.st_atime, st.st_mtime + 10))
+            self.assertEqual(b"second", self.request("/" + name).read())
+        finally:
+            os.unlink(path)
+
     def test_no_main(self):
         with pytest.raises(HTTPError) as cm:
             self.request("/no_main.py")
@@ -416,6 +506,40 @@ class TestAnyHtmlHandler(TestWrapperHandlerUsingServer):
                               'text/html', serve.AnyHtmlHandler)
 
 
+class TestCachedWrapperHandler(TestWrapperHandlerUsingServer):
+    dummy_js_files = {'cached.any.js': b'// META: title=100% first\n'}
+
+    def test_modified(self):
+        self.server.router.register('GET', 'cached.any.html', serve.AnyHtmlHandler())
+        resp = self.request('cached.any.html')
+        self.assertIn(b'<title>100% first</title>', resp.read())
+
+        path = os.path.join(doc_root, 'cached.any.js')
+        with open(path, 'wb') as f:
+            f.write(b'// META: title=second\n// META: script=helper.js\n')
+        # Make sure the change is detected even with a coarse mtime granularity
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+        resp = self.request('cached.any.html')
+        data = resp.read()
+        self.assertIn(b'<title>second</title>', data)
+        self.assertIn(b'<script src="helper.js"></script>', data)
+
+    def test_query(self):
+        self.server.router.register('GET', 'cached.any.worker.html', serve.WorkersHandler())
+        for query in ['a=1', 'b=%25']:
+            resp = self.request('cached.any.worker.html', query=query)
+            self.assertIn(b'new Worker("/cached.any.worker.js?%s")' % query.encode('ascii'),
+                          resp.read())
+
+    def test_missing(self):
+        self.server.router.register('GET', 'missing.any.html', serve.AnyHtmlHandler())
+        with self.assertRaises(HTTPError) as cm:
+            self.request('missing.any.html')
+        self.assertEqual(404, cm.exception.code)
+
+
 class TestSharedWorkersHandler(TestWrapperHandlerUsingServer):
     dummy_js_files = {'foo.any.js': b'// META: global=sharedworker\n'}
 
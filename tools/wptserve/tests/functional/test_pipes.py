@@ -1,3 +1,5 @@
+import gzip
+import io
 import os
 import unittest
 import time
@@ -146,6 +148,15 @@ class TestTrickle(TestUsingServer):
         self.assertEqual(resp.info()["Pragma"], "no-cache")
         self.assertEqual(resp.info()["Expires"], "0")
 
+class TestGzip(TestUsingServer):
+    def test_file_content_length(self):
+        resp = self.request("/document.txt", query="pipe=gzip|trickle(d0.01)")
+        self.assertEqual(resp.info()["Content-Encoding"], "gzip")
+        body = resp.read()
+        self.assertEqual(int(resp.info()["Content-Length"]), len(body))
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(), expected)
+
 class TestPipesWithVariousHandlers(TestUsingServer):
     def test_with_python_file_handler(self):
         resp = self.request("/test_string.py", query="pipe=slice(null,2)")
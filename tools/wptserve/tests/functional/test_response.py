@@ -205,6 +205,20 @@ class TestH2Response(TestUsingH2Server):
         assert [x for x in resp.headers.items()] == [('server', 'test-h2'), ('test', 'PASS')]
         assert resp.read() == data
 
+    def test_content_larger_than_window(self):
+        # Needs the server to wait for the client to open the flow control window
+        @wptserve.handlers.handler
+        def handler(request, response):
+            return b"a" * 200000
+
+        route = ("GET", "/h2test/test_large", handler)
+        self.server.router.register(*route)
+        self.conn.request(route[0], route[1])
+        resp = self.conn.get_response()
+
+        assert resp.status == 200
+        assert resp.read() == b"a" * 200000
+
     def test_push(self):
         data = b"TEST"
         push_data = b"PUSH TEST"
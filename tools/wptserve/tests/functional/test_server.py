@@ -1,10 +1,14 @@
+import json
+import threading
+import time
 import unittest
 
 import pytest
 from six.moves.urllib.error import HTTPError
 
 wptserve = pytest.importorskip("wptserve")
-from .base import TestUsingServer, TestUsingH2Server
+from wptserve.metrics import Metrics
+from .base import TestUsingServer, TestUsingH2Server, doc_root
 
 
 class TestFileHandler(TestUsingServer):
@@ -27,6 +31,45 @@ class TestRewriter(TestUsingServer):
         self.assertEqual(200, resp.getcode())
         self.assertEqual(b"/test/rewritten", resp.read())
 
+class TestMetrics(TestUsingServer):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.server = wptserve.server.WebTestHttpd(host="localhost",
+                                                   port=0,
+                                                   use_ssl=False,
+                                                   certificate=None,
+                                                   doc_root=doc_root,
+                                                   server_cls=self.server_cls,
+                                                   metrics=self.metrics)
+        self.server.start(False)
+
+    def wait_for_requests(self, count):
+        # A request is recorded once its response has been written, which
+        # can be after the client has read the whole response
+        deadline = time.time() + 10
+        while self.metrics.requests < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_metrics(self):
+        resp = self.request("/document.txt", query="pipe=slice(2)")
+        length = len(resp.read())
+
+        self.wait_for_requests(1)
+        resp = self.request("/.well-known/wptserve-metrics")
+        self.assertEqual("application/json", resp.info()["Content-Type"])
+        data = json.loads(resp.read().decode("utf8"))
+        self.assertEqual(1, data["requests"])
+        self.assertGreater(data["bytes_out"], length)
+        self.assertGreaterEqual(data["active_connections"], 1)
+        for stage in ["route", "handler", "pipeline", "write"]:
+            self.assertEqual(1, data["stages"][stage]["count"])
+        self.assertEqual(["/document.txt"], [item["path"] for item in data["paths"]])
+
+        self.wait_for_requests(2)
+        resp = self.request("/.well-known/wptserve-metrics", query="reset=1")
+        self.assertEqual(2, json.loads(resp.read().decode("utf8"))["requests"])
+        self.assertLess(self.metrics.requests, 2)
+
 class TestRequestHandler(TestUsingServer):
     def test_exception(self):
         @wptserve.handlers.handler
@@ -86,5 +129,68 @@ class TestRequestHandlerH2(TestUsingH2Server):
 
         assert resp.status == 500
 
+    def test_concurrent_streams(self):
+        count = 10
+        arrived = []
+        all_arrived = threading.Event()
+
+        @wptserve.handlers.handler
+        def handler(request, response):
+            arrived.append(request)
+            if len(arrived) == count:
+                all_arrived.set()
+            # Only returns if all the requests are handled at the same time
+            assert all_arrived.wait(10)
+            return b"done"
+
+        route = ("GET", "/test/concurrent", handler)
+        self.server.router.register(*route)
+        stream_ids = [self.conn.request("GET", route[1]) for _ in range(count)]
+        for stream_id in stream_ids:
+            resp = self.conn.get_response(stream_id)
+            assert resp.status == 200
+            assert resp.read() == b"done"
+        assert self.server.httpd.h2_worker_pool.threads <= count
+
+    def test_more_blocked_streams_than_workers(self):
+        pool = self.server.httpd.h2_worker_pool
+        pool.max_workers = 2
+        pool.grow_after = 0.01
+        count = 5
+        arrived = []
+        all_arrived = threading.Event()
+
+        @wptserve.handlers.handler
+        def handler(request, response):
+            arrived.append(request)
+            if len(arrived) == count:
+                all_arrived.set()
+            # Blocks the worker until every stream has been handled
+            assert all_arrived.wait(10)
+            return b"done"
+
+        route = ("GET", "/test/blocked", handler)
+        self.server.router.register(*route)
+        stream_ids = [self.conn.request("GET", route[1]) for _ in range(count)]
+        for stream_id in stream_ids:
+            resp = self.conn.get_response(stream_id)
+            assert resp.status == 200
+            assert resp.read() == b"done"
+
+    def test_body_larger_than_window(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            return str(len(request.body))
+
+        route = ("POST", "/test/body", handler)
+        self.server.router.register(*route)
+        # Needs the server to send WINDOW_UPDATE frames as it processes the data
+        self.conn.request("POST", route[1], body=b"a" * 200000,
+                          headers={"Content-Length": "200000"})
+        resp = self.conn.get_response()
+
+        assert resp.status == 200
+        assert resp.read() == b"200000"
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import threading
 import unittest
 import uuid
 
@@ -10,8 +11,10 @@ from .base import TestUsingServer
 
 
 class TestResponseSetCookie(TestUsingServer):
+    backend = "manager"
+
     def run(self, result=None):
-        with StashServer(None, authkey=str(uuid.uuid4())):
+        with StashServer(None, authkey=str(uuid.uuid4()), backend=self.backend):
             super(TestResponseSetCookie, self).run(result)
 
     def test_put_take(self):
@@ -39,6 +42,38 @@ class TestResponseSetCookie(TestUsingServer):
         resp = self.request(route[1], query="id=" + id)
         self.assertEqual(resp.read(), b"NOT FOUND")
 
+    def test_take_timeout(self):
+        @wptserve.handlers.handler
+        def handler(request, response):
+            if request.method == "POST":
+                request.server.stash.put(request.POST.first("id"), request.POST.first("data"))
+                data = "OK"
+            elif request.method == "GET":
+                data = request.server.stash.take(request.GET.first("id"), timeout=10)
+                if data is None:
+                    return "NOT FOUND"
+            return data
+
+        id = str(uuid.uuid4())
+        route = (any_method, "/test/take_timeout", handler)
+        self.server.router.register(*route)
+
+        def put():
+            resp = self.request(route[1], method="POST", body={"id": id, "data": "Sample data"})
+            self.assertEqual(resp.read(), b"OK")
+
+        thread = threading.Timer(0.1, put)
+        thread.start()
+        try:
+            resp = self.request(route[1], query="id=" + id)
+            self.assertEqual(resp.read(), b"Sample data")
+        finally:
+            thread.join()
+
+
+class TestSocketStash(TestResponseSetCookie):
+    backend = "socket"
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+import os
+import pickle
+
+from wptserve.filecache import FileCache
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_read(tmpdir):
+    path = str(tmpdir.join("a.txt"))
+    write(path, b"first")
+    cache = FileCache()
+    assert cache.read(path) == b"first"
+    assert len(cache) == 1
+
+    # Served from the cache while the file is unchanged
+    cache._entries[("read", path)] = cache._entries[("read", path)][:1] + (b"cached", 5)
+    assert cache.read(path) == b"cached"
+
+    write(path, b"second!")
+    assert cache.read(path) == b"second!"
+    assert cache.size == 7
+
+
+def test_read_too_large(tmpdir):
+    path = str(tmpdir.join("a.txt"))
+    write(path, b"x" * 11)
+    cache = FileCache(max_file_size=10)
+    assert cache.read(path) is None
+    assert len(cache) == 0
+
+
+def test_listdir(tmpdir):
+    cache = FileCache()
+    write(str(tmpdir.join("a")), b"")
+    assert cache.listdir(str(tmpdir)) == {"a"}
+    write(str(tmpdir.join("b.headers")), b"")
+    # Only detected once the directory's mtime changes, which may have
+    # a coarse granularity
+    st = os.stat(str(tmpdir))
+    os.utime(str(tmpdir), (st.st_atime, st.st_mtime + 10))
+    assert cache.listdir(str(tmpdir)) == {"a", "b.headers"}
+
+
+def test_eviction(tmpdir):
+    cache = FileCache(max_size=25)
+    paths = []
+    for i in range(4):
+        path = str(tmpdir.join("%d.txt" % i))
+        write(path, str(i).encode("ascii") * 10)
+        paths.append(path)
+
+    cache.read(paths[0])
+    cache.read(paths[1])
+    # Use 0 so that 1 is the least recently used
+    cache.read(paths[0])
+    cache.read(paths[2])
+    assert cache.size == 20
+    assert set(cache._entries) == {("read", paths[0]), ("read", paths[2])}
+
+
+def test_pickle():
+    cache = FileCache(max_size=100, max_file_size=10)
+    cache.get("key", 1, lambda: ("value", 5))
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.max_size == 100
+    assert copy.max_file_size == 10
+    assert len(copy) == 0
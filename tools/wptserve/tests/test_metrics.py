@@ -0,0 +1,43 @@
+from wptserve.metrics import Metrics
+
+
+def test_record_request():
+    metrics = Metrics()
+    metrics.record_request("/a", {"route": 0.5, "handler": 2}, 10)
+    metrics.record_request("/a", {"route": 1, "handler": 1, "write": 1}, 20)
+    metrics.record_request("/b", {"handler": 4}, 5)
+
+    data = metrics.to_dict()
+    assert data["requests"] == 3
+    assert data["bytes_out"] == 35
+    assert data["stages"]["route"] == {"count": 2, "total": 1.5, "max": 1}
+    assert data["stages"]["handler"] == {"count": 3, "total": 7, "max": 4}
+    assert data["stages"]["pipeline"] == {"count": 0, "total": 0, "max": 0}
+    assert data["paths"] == [
+        {"path": "/a", "count": 2, "total": 5.5, "max": 3, "bytes_out": 30},
+        {"path": "/b", "count": 1, "total": 4, "max": 4, "bytes_out": 5}]
+    assert [item["path"] for item in metrics.to_dict(slowest=1)["paths"]] == ["/a"]
+
+    metrics.reset()
+    data = metrics.to_dict()
+    assert data["requests"] == 0
+    assert data["paths"] == []
+
+
+def test_max_paths():
+    metrics = Metrics(max_paths=2)
+    for path in ["/a", "/b", "/c", "/d", "/a"]:
+        metrics.record_request(path, {"handler": 1}, 0)
+    paths = {item["path"]: item["count"] for item in metrics.to_dict()["paths"]}
+    assert paths == {"/a": 2, "/b": 1, "(other)": 2}
+
+
+def test_connections():
+    metrics = Metrics()
+    metrics.connection_opened()
+    metrics.connection_opened()
+    metrics.connection_closed()
+    metrics.reset()
+    data = metrics.to_dict()
+    assert data["active_connections"] == 1
+    assert data["max_active_connections"] == 2
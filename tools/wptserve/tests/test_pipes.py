@@ -0,0 +1,121 @@
+import gzip as gzip_module
+import io
+import os
+
+import pytest
+
+pipes = pytest.importorskip("wptserve.pipes")
+
+
+class Request(object):
+    def __init__(self, doc_root):
+        self.doc_root = doc_root
+
+
+def test_compile_template():
+    compiled = pipes.compile_template(b"a {{host}} b {{$id:uuid()}}{{domains[www]}}")
+    assert compiled == [b"a ",
+                        (None, u"host", []),
+                        b" b ",
+                        (u"$id", u"uuid", [("arguments", [])]),
+                        (None, u"domains", [("index", u"www")])]
+
+
+def test_compile_template_invalid():
+    with pytest.raises(Exception):
+        pipes.compile_template(b"{{[0]}}")
+    with pytest.raises(Exception):
+        pipes.compile_template(b"{{host$id:}}")
+
+
+def test_template_cache():
+    content = b"cached {{uuid()}}"
+    # Each use of the template is evaluated again
+    assert pipes.template(None, content) != pipes.template(None, content)
+    compiled = pipes.template_cache.get(content, None, lambda: (None, 0))
+    assert compiled == [b"cached ", (None, u"uuid", [("arguments", [])])]
+
+
+def test_file_hash_modified(tmpdir):
+    path = tmpdir.join("subject.txt")
+    path.write_binary(b"first")
+    request = Request(str(tmpdir))
+
+    first = pipes.SubFunctions.file_hash(request, u"md5", "subject.txt")
+    assert first == pipes.SubFunctions.file_hash(request, u"md5", "subject.txt")
+    assert first != pipes.SubFunctions.file_hash(request, u"sha1", "subject.txt")
+
+    path.write_binary(b"second")
+    mtime = os.stat(str(path)).st_mtime + 1
+    os.utime(str(path), (mtime, mtime))
+    assert first != pipes.SubFunctions.file_hash(request, u"md5", "subject.txt")
+
+    path.remove()
+    with pytest.raises(Exception) as excinfo:
+        pipes.SubFunctions.file_hash(request, u"md5", "subject.txt")
+    assert "Cannot open file" in str(excinfo.value)
+
+
+class Response(object):
+    def __init__(self, content):
+        from wptserve.response import ResponseHeaders
+        self.content = content
+        self.encoding = "utf8"
+        self.headers = ResponseHeaders()
+
+
+def test_iter_chunks(tmpdir):
+    path = tmpdir.join("body.txt")
+    path.write_binary(b"0123456789")
+    f = open(str(path), "rb")
+    response = Response([b"a", u"b", lambda: b"c", f])
+    chunks = pipes.iter_chunks(response, chunk_size=4)
+    # The body is read lazily, from the content at the time of the call
+    response.content = b"replaced"
+    assert list(chunks) == [b"a", b"b", b"c", b"0123", b"4567", b"89"]
+    assert f.closed
+
+    assert list(pipes.iter_chunks(Response(u"text"))) == [b"text"]
+
+
+def test_chunk_reader():
+    reader = pipes.ChunkReader(iter([b"012", b"3", b"456789"]))
+    assert reader.read(2) == b"01"
+    assert reader.read(3) == b"234"
+    assert not reader.at_end()
+    assert list(reader.iter_rest()) == [b"56789"]
+    assert reader.at_end()
+    assert reader.read(5) == b""
+
+
+def test_trickle():
+    response = Response(iter([b"012", b"3456789"]))
+    response = pipes.trickle(None, response, "3:d0:r2")
+    assert [item for item in response.content if item] == [b"012", b"345", b"678", b"9"]
+
+    response = Response(iter([b"012", b"3456789"]))
+    response = pipes.trickle(None, response, "2:d0")
+    assert [item for item in response.content if item] == [b"01", b"2", b"3456789"]
+
+
+def test_gzip(tmpdir):
+    body = b"x" * 100000 + b"y" * 100000
+
+    response = pipes.gzip(None, Response(body))
+    assert response.headers.get("Content-Encoding") == [b"gzip"]
+    assert response.headers.get("Content-Length") == [str(len(response.content)).encode("ascii")]
+    assert gzip_module.GzipFile(fileobj=io.BytesIO(response.content)).read() == body
+
+    path = tmpdir.join("body.txt")
+    path.write_binary(body)
+    response = Response(open(str(path), "rb"))
+    response = pipes.gzip(None, response)
+    assert response.headers.get("Content-Length") == [str(len(response.content)).encode("ascii")]
+    assert gzip_module.GzipFile(fileobj=io.BytesIO(response.content)).read() == body
+
+    response = Response(iter([body[:150000], body[150000:]]))
+    response.headers.set("Content-Length", len(body))
+    response = pipes.gzip(None, response)
+    assert "Content-Length" not in response.headers
+    compressed = b"".join(response.content)
+    assert gzip_module.GzipFile(fileobj=io.BytesIO(compressed)).read() == body
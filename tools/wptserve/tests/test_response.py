@@ -0,0 +1,44 @@
+import io
+
+from wptserve.response import FileSlice
+
+
+def open_file(tmpdir, data):
+    path = tmpdir.join("a.txt")
+    path.write_binary(data)
+    return open(str(path), "rb")
+
+
+def test_file_slice_read(tmpdir):
+    file_slice = FileSlice(open_file(tmpdir, b"0123456789"), 2, 5)
+    assert file_slice.read(2) == b"23"
+    assert file_slice.tell() == 2
+    assert file_slice.read() == b"456"
+    assert file_slice.read() == b""
+
+    assert file_slice.seek(0, 2) == 5
+    file_slice.seek(1)
+    assert file_slice.read(100) == b"3456"
+    file_slice.close()
+    assert file_slice.file.closed
+
+
+def test_file_slice_from_file(tmpdir):
+    f = open_file(tmpdir, b"0123456789")
+    f.read(3)
+    file_slice = FileSlice.from_file(f)
+    assert (file_slice.start, file_slice.length) == (3, 7)
+    assert FileSlice.from_file(file_slice) is file_slice
+    assert FileSlice.from_file(io.BytesIO(b"0123")) is None
+    f.close()
+
+
+def test_file_slice_slice(tmpdir):
+    file_slice = FileSlice.from_file(open_file(tmpdir, b"0123456789"))
+    for start, end in [(1, 4), (None, 2), (-3, None), (2, -2), (8, 100), (20, None), (5, 2)]:
+        part = file_slice.slice(start, end)
+        assert part.read() == b"0123456789"[start:end]
+        assert part.length == len(b"0123456789"[start:end])
+
+    assert file_slice.slice(2, 8).slice(1, -1).read() == b"3456"
+    file_slice.close()
@@ -0,0 +1,104 @@
+import pytest
+
+from six.moves.urllib.parse import urlsplit
+
+from wptserve.router import Router, any_method, path_match_literals
+
+
+class Request(object):
+    def __init__(self, method, path):
+        self.method = method
+        self.url_parts = urlsplit(path)
+        self.route_match = None
+
+
+def linear_get_handler(router, request):
+    """Reference implementation trying every route in turn"""
+    for method, regexp, handler in reversed(router.routes):
+        if (request.method == method or
+            method in (any_method, "*") or
+            (request.method == "HEAD" and method == "GET")):
+            m = regexp.match(request.url_parts.path)
+            if m:
+                return handler
+    return None
+
+
+@pytest.mark.parametrize(
+    "pattern,expected",
+    [
+        ["/", ("/", "")],
+        ["foo/bar.html", ("/foo/bar.html", "")],
+        ["*", ("/", "")],
+        ["*.any.worker.js", ("/", ".any.worker.js")],
+        ["/foo/*.py", ("/foo/", ".py")],
+        ["{spec}/tools/*", ("/", "")],
+        ["api/{resource}/*.json", ("/api/", ".json")],
+        ["/a/{b}/c", ("/a/", "/c")],
+    ]
+)
+def test_path_match_literals(pattern, expected):
+    assert path_match_literals(pattern) == expected
+
+
+routes = [
+    ("GET", "/tools/runner/*", "runner"),
+    ("POST", "/tools/runner/update_manifest.py", "update"),
+    ("*", "/_certs/*", "certs"),
+    ("*", "/tools/*", "tools"),
+    ("*", "{spec}/tools/*", "spec-tools"),
+    ("GET", "/exact.html", "exact"),
+    ("GET", "/foo/*.worker.html", "foo-worker"),
+    ("GET", "/foo/*.py", "foo-py"),
+    ("GET", "/foo/*", "foo-file"),
+    ("GET", "*.worker.html", "worker"),
+    ("GET", "*.any.html", "any"),
+    ("GET", "*.any.worker.js", "any-worker"),
+    (any_method, "*.py", "py"),
+    ("GET", "api/{resource}/*.json", "api"),
+    ("GET", "*", "file"),
+]
+
+
+@pytest.mark.parametrize("method", ["GET", "HEAD", "POST", "PUT"])
+@pytest.mark.parametrize("path", [
+    "/",
+    "/exact.html",
+    "/exact.htm",
+    "/tools/runner/index.html",
+    "/tools/runner/update_manifest.py",
+    "/tools/other.py",
+    "/css/tools/x.html",
+    "/_certs/cacert.pem",
+    "/foo/a.worker.html",
+    "/foo/a.py",
+    "/foo/a.html",
+    "/bar/a.worker.html",
+    "/bar/a.any.html",
+    "/bar/a.any.worker.js",
+    "/bar/a.py",
+    "/api/test/data.json",
+    "/api/test/more/data.json",
+    "/api/data.json",
+    "/bar.html",
+])
+def test_get_handler(method, path):
+    router = Router("/", routes)
+    request = Request(method, path)
+    assert router.get_handler(request) == linear_get_handler(router, request)
+
+
+def test_get_handler_route_match():
+    router = Router("/", routes)
+    request = Request("GET", "/api/test/more/data.json")
+    assert router.get_handler(request) == "api"
+    assert request.route_match == {"resource": "test", "*": "more/data.json"}
+
+
+def test_register_invalidates_index():
+    router = Router("/", routes)
+    request = Request("GET", "/exact.html")
+    assert router.get_handler(request) == "exact"
+    router.register("GET", "*.html", "html")
+    assert router.get_handler(request) == "html"
+    assert router.get_handler(Request("POST", "/exact.html")) is None
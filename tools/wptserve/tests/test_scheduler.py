@@ -0,0 +1,120 @@
+import threading
+import time
+
+from wptserve.scheduler import StreamScheduler, WorkerPool
+
+
+def test_worker_pool_bounded():
+    pool = WorkerPool(max_workers=2, grow_after=10)
+    release = threading.Event()
+    done = []
+    lock = threading.Lock()
+
+    def task(i):
+        release.wait(10)
+        with lock:
+            done.append(i)
+
+    for i in range(5):
+        pool.submit(task, i)
+    assert pool.threads == 2
+
+    release.set()
+    deadline = time.time() + 10
+    while len(done) < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(done) == list(range(5))
+    assert pool.threads == 2
+    pool.shutdown()
+
+
+def test_worker_pool_grows_when_blocked():
+    # Each task blocks until all of them are running, so they can only
+    # complete if the pool starts more than max_workers threads
+    pool = WorkerPool(max_workers=2, grow_after=0.01)
+    count = 5
+    started = []
+    all_started = threading.Event()
+    done = []
+    lock = threading.Lock()
+
+    def task(i):
+        with lock:
+            started.append(i)
+            if len(started) == count:
+                all_started.set()
+        if all_started.wait(10):
+            with lock:
+                done.append(i)
+
+    for i in range(count):
+        pool.submit(task, i)
+
+    deadline = time.time() + 10
+    while len(done) < count and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(done) == list(range(count))
+
+    # The extra threads exit once they're idle
+    while pool.threads > 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert pool.threads == 2
+    pool.shutdown()
+
+
+def test_worker_pool_reuses_idle_threads():
+    pool = WorkerPool(max_workers=10)
+    for _ in range(5):
+        event = threading.Event()
+        pool.submit(event.set)
+        assert event.wait(10)
+        # Give the thread time to become idle again
+        time.sleep(0.05)
+    assert pool.threads == 1
+    pool.shutdown()
+
+
+def test_stream_scheduler_order():
+    pool = WorkerPool(max_workers=4, grow_after=10)
+    processed = {}
+    active = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def process(stream_id, frame):
+        with lock:
+            if stream_id in active:
+                overlaps.append(stream_id)
+            active.add(stream_id)
+        time.sleep(0.001)
+        with lock:
+            active.discard(stream_id)
+            processed.setdefault(stream_id, []).append(frame)
+
+    scheduler = StreamScheduler(pool, process)
+    for frame in range(20):
+        for stream_id in [1, 3, 5, 7, 9, 11]:
+            scheduler.dispatch(stream_id, frame)
+    scheduler.join()
+
+    assert overlaps == []
+    assert processed == {stream_id: list(range(20)) for stream_id in [1, 3, 5, 7, 9, 11]}
+    assert pool.threads <= 4
+    pool.shutdown()
+
+
+def test_stream_scheduler_error():
+    pool = WorkerPool(max_workers=1)
+    processed = []
+
+    def process(stream_id, frame):
+        if frame == "bad":
+            raise ValueError
+        processed.append(frame)
+
+    scheduler = StreamScheduler(pool, process)
+    for frame in ["a", "bad", "b"]:
+        scheduler.dispatch(1, frame)
+    scheduler.join()
+    assert processed == ["a", "b"]
+    pool.shutdown()
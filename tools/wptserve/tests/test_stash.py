@@ -1,11 +1,14 @@
 import multiprocessing
 import sys
 import threading
+import time
+import uuid
 from multiprocessing.managers import BaseManager
 
 import pytest
 
-Stash = pytest.importorskip("wptserve.stash").Stash
+stash = pytest.importorskip("wptserve.stash")
+Stash = stash.Stash
 
 @pytest.fixture()
 def add_cleanup():
@@ -134,3 +137,105 @@ def test_delayed_dict(add_cleanup):
 
     assert [queue.get(), queue.get()] == [False, False], (
         "both instances had valid locks")
+
+
+def test_stash_dict_put_take():
+    data = stash.StashDict()
+    assert data.put("a", 1) is None
+    assert data.put("a", 2) == 1
+    assert data.take("a") == 1
+    assert data.take("a") is None
+    assert data.put("a", 2) is None
+    assert data.take("a") == 2
+
+
+def test_stash_dict_take_timeout():
+    data = stash.StashDict()
+    thread = threading.Timer(0.1, data.put, args=("a", 1))
+    thread.start()
+    try:
+        assert data.take("a", timeout=10) == 1
+    finally:
+        thread.join()
+
+    start = time.time()
+    assert data.take("a", timeout=0.1) is None
+    assert time.time() - start >= 0.1
+
+
+def test_stash_dict_ttl():
+    data = stash.StashDict(ttl=0.05)
+    data.put("a", 1)
+    data.put("b", 2, ttl=10)
+    time.sleep(0.1)
+    data.put("c", 3)
+    assert "a" not in data
+    assert data.take("b") == 2
+    assert data.take("c") == 3
+
+    # Values that are taken and put again get a new expiry time
+    data.put("a", 1)
+    data.take("a")
+    data.put("a", 2, ttl=10)
+    time.sleep(0.1)
+    assert data.take("a") == 2
+
+
+@pytest.mark.xfail(sys.platform == "win32",
+                   reason="https://github.com/web-platform-tests/wpt/issues/16938")
+@pytest.mark.parametrize("backend", ["manager", "socket"])
+def test_stash_server_take_timeout(add_cleanup, backend):
+    manager, address, authkey = stash.backends[backend](None, str(uuid.uuid4()), ttl=10)
+    add_cleanup(lambda: manager.shutdown())
+
+    def reset_stash():
+        # Stash instances share their connection to the server
+        Stash._proxy = None
+        Stash.lock = None
+    add_cleanup(reset_stash)
+
+    key = str(uuid.uuid4())
+    putter = Stash("/", address, authkey, backend)
+    taker = Stash("/", address, authkey, backend)
+    thread = threading.Timer(0.1, putter.put, args=(key, "value"))
+    thread.start()
+    try:
+        assert taker.take(key, timeout=10) == "value"
+    finally:
+        thread.join()
+    assert taker.take(key) is None
+
+    putter.put(key, "value")
+    with pytest.raises(stash.StashError):
+        putter.put(key, "other value")
+
+
+@pytest.mark.xfail(sys.platform == "win32",
+                   reason="https://github.com/web-platform-tests/wpt/issues/16938")
+def test_socket_server_lock(add_cleanup):
+    server, address, authkey = stash.start_socket_server(None, str(uuid.uuid4()))
+    add_cleanup(lambda: server.shutdown())
+
+    clients = [stash.SocketStashClient(address, authkey) for _ in range(2)]
+    clients[0].acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        clients[1].acquire()
+        acquired.set()
+        clients[1].release()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    try:
+        assert not acquired.wait(0.1)
+        clients[0].release()
+        assert acquired.wait(10)
+    finally:
+        thread.join()
+
+    # Errors are raised in the client
+    with pytest.raises(Exception):
+        clients[0].release()
+    with pytest.raises(TypeError):
+        clients[0].put({}, "value")
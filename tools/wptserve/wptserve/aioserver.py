@@ -0,0 +1,370 @@
+"""
+HTTP/1.1 server using an asyncio event loop for network IO.
+
+This is an alternative to WebTestServer for use as the server_cls of a
+WebTestHttpd. Rather than using a thread for each connection, all the
+connections are handled on a single event loop thread, which accepts them,
+reads the head and body of each request and writes out responses. Once a
+request has been read it is passed to a bounded pool of worker threads,
+where it's routed and handled by the usual synchronous handlers, exactly
+as for WebTestServer. Idle keep-alive connections therefore don't use a
+thread, and the number of threads doesn't grow with the number of
+connections.
+
+Handlers write to the connection through a file-like object that hands
+the data to the event loop, so responses are streamed to the client as
+they're written. A handler that sleeps between writes, e.g. because of
+the trickle pipe, still occupies a worker thread while it does so.
+
+This module requires Python 3.
+"""
+
+import asyncio
+import errno
+import io
+import socket
+import ssl
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import get_logger
+from .server import BaseWebTestRequestHandler, WebTestServer, set_server_config
+
+
+class TransportFile(object):
+    """File-like object used as the wfile of request handlers, that writes
+    to an asyncio StreamWriter.
+
+    It may be written to from the event loop thread or from any other
+    thread. Writes from other threads are passed to the event loop, and
+    consecutive writes are combined until the loop gets to send them.
+    Once more than high_water bytes are waiting to be sent, writes from
+    other threads block until the connection has caught up.
+
+    :param loop: Event loop of the connection
+    :param writer: StreamWriter of the connection
+    """
+    high_water = 256 * 1024
+
+    def __init__(self, loop, writer):
+        self._loop = loop
+        self._writer = writer
+        self._transport = writer.transport
+        self._loop_thread = threading.current_thread()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, data):
+        if self._transport.is_closing():
+            raise ConnectionResetError(errno.EPIPE, "Connection closed")
+        if not data:
+            return
+
+        with self._lock:
+            scheduled = bool(self._pending)
+            self._pending.append(data)
+            self._pending_size += len(data)
+            pending_size = self._pending_size
+
+        if threading.current_thread() is self._loop_thread:
+            self._send()
+            return
+
+        if not scheduled:
+            self._loop.call_soon_threadsafe(self._send)
+        if pending_size + self._transport.get_write_buffer_size() > self.high_water:
+            asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result()
+
+    def flush(self):
+        # Data is passed to the event loop as soon as it's written
+        if self._transport.is_closing():
+            raise ConnectionResetError(errno.EPIPE, "Connection closed")
+
+    def _send(self):
+        with self._lock:
+            data = b"".join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+        if data and not self._transport.is_closing():
+            self._writer.write(data)
+
+    async def _drain(self):
+        self._send()
+        await self._writer.drain()
+
+
+class AsyncioRequestHandler(BaseWebTestRequestHandler):
+    """Handler for a single HTTP/1.1 request received by an
+    AsyncioWebTestServer.
+
+    Unlike the handlers of WebTestServer this doesn't read from the
+    connection itself; the server parses the request head with
+    parse_head, reads the body, and then calls handle_request on a
+    worker thread.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, server, client_address, wfile):
+        self.logger = get_logger()
+        self.server = server
+        self.client_address = client_address
+        self.request = None
+        # No socket, so ResponseWriter doesn't try to use sendfile
+        self.connection = None
+        self.wfile = wfile
+        self.rfile = None
+        self.close_connection = True
+
+    def parse_head(self, head):
+        """Parse the request line and headers of a request.
+
+        :param head: Bytes of the request up to and including the empty
+                     line at the end of the headers.
+        :returns: False if the request is invalid, in which case an error
+                  response has already been written.
+        """
+        line_end = head.find(b"\n") + 1
+        self.raw_requestline = head[:line_end]
+        self.rfile = io.BytesIO(head[line_end:])
+        return self.parse_request()
+
+    def content_length(self):
+        """Length of the request body, or None if the Content-Length header
+        isn't a valid length"""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return None
+        return length if length >= 0 else None
+
+    def handle_request(self):
+        """Route and handle the request, once its body has been read"""
+        try:
+            self.finish_handling_h1(True)
+        except Exception:
+            self.close_connection = True
+            self.logger.error(traceback.format_exc())
+
+
+class AsyncioWebTestServer(object):
+    """HTTP/1.1 server for WebTestHttpd using an asyncio event loop.
+
+    Takes the same arguments as WebTestServer, apart from
+    request_handler_cls which is ignored in favour of
+    AsyncioRequestHandler. HTTP/2 and encrypt_after_connect aren't
+    supported.
+
+    :param max_workers: Maximum number of requests that are handled at
+                        the same time
+    """
+    max_workers = 32
+    request_queue_size = WebTestServer.request_queue_size
+    # Maximum size of the request line and headers of a request
+    max_head_size = 128 * 1024
+
+    def __init__(self, server_address, request_handler_cls,
+                 router, rewriter, bind_address,
+                 config=None, use_ssl=False, key_file=None, certificate=None,
+                 encrypt_after_connect=False, latency=None, http2=False,
+                 reuse_port=False, max_workers=None, metrics=None):
+        if http2:
+            raise ValueError("The asyncio server doesn't support HTTP/2")
+        if use_ssl and encrypt_after_connect:
+            raise ValueError("The asyncio server doesn't support encrypt_after_connect")
+
+        self.router = router
+        self.rewriter = rewriter
+        self.metrics = metrics
+
+        self.scheme = "https" if use_ssl else "http"
+        self.logger = get_logger()
+
+        self.latency = latency
+        if max_workers is not None:
+            self.max_workers = max_workers
+
+        if bind_address:
+            hostname_port = server_address
+        else:
+            hostname_port = ("", server_address[1])
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socket.bind(hostname_port)
+            self.socket.listen(self.request_queue_size)
+        except Exception:
+            self.socket.close()
+            raise
+        self.server_address = self.socket.getsockname()
+
+        set_server_config(config, server_address[0], self.server_address[1])
+
+        self.key_file = key_file
+        self.certificate = certificate
+        self.encrypt_after_connect = False
+
+        self.ssl_context = None
+        if use_ssl:
+            self.ssl_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
+            self.ssl_context.load_cert_chain(keyfile=key_file, certfile=certificate)
+
+        self._loop = None
+        self._stop_future = None
+        self._lock = threading.Lock()
+        self._shutdown_requested = threading.Event()
+        self._is_shut_down = threading.Event()
+        self._connections = set()
+
+    def serve_forever(self):
+        """Run the event loop on the current thread until shutdown is called"""
+        self._is_shut_down.clear()
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        self._executor = ThreadPoolExecutor(self.max_workers)
+        try:
+            loop.run_until_complete(self._serve())
+        finally:
+            # Don't wait for handlers that are still running
+            self._executor.shutdown(wait=False)
+            loop.close()
+            self._loop = None
+            self._shutdown_requested.clear()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stop serve_forever and wait for it to return"""
+        self._shutdown_requested.set()
+        with self._lock:
+            if self._stop_future is not None:
+                self._loop.call_soon_threadsafe(self._stop)
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        self.socket.close()
+
+    def _stop(self):
+        if not self._stop_future.done():
+            self._stop_future.set_result(None)
+
+    async def _serve(self):
+        loop = self._loop
+        server = await asyncio.start_server(self._accept,
+                                            sock=self.socket,
+                                            ssl=self.ssl_context,
+                                            limit=self.max_head_size)
+        with self._lock:
+            self._stop_future = loop.create_future()
+            stop_requested = self._shutdown_requested.is_set()
+        try:
+            if not stop_requested:
+                await self._stop_future
+        finally:
+            with self._lock:
+                self._stop_future = None
+            server.close()
+            await server.wait_closed()
+            connections = list(self._connections)
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+
+    def _accept(self, reader, writer):
+        task = self._loop.create_task(self._handle_connection(reader, writer))
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+
+    async def _handle_connection(self, reader, writer):
+        if self.metrics is not None:
+            self.metrics.connection_opened()
+        try:
+            await self._handle_requests(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Remote hang up, or the server is shutting down
+            pass
+        except Exception:
+            self.logger.error(traceback.format_exc())
+        finally:
+            writer.close()
+            if self.metrics is not None:
+                self.metrics.connection_closed()
+
+    async def _handle_requests(self, reader, writer):
+        loop = self._loop
+        client_address = writer.get_extra_info("peername")
+        wfile = TransportFile(loop, writer)
+
+        while True:
+            handler = AsyncioRequestHandler(self, client_address, wfile)
+            try:
+                head = await self._read_head(reader)
+                if head is None:
+                    return
+            except asyncio.LimitOverrunError:
+                handler.requestline = ""
+                handler.request_version = ""
+                handler.command = ""
+                handler.send_error(431)
+                await writer.drain()
+                return
+
+            if not handler.parse_head(head):
+                # parse_request() sends its own error responses
+                await writer.drain()
+                if handler.close_connection:
+                    return
+                continue
+
+            if "Transfer-Encoding" in handler.headers:
+                # Like WebTestServer, only bodies delimited by Content-Length
+                # are supported
+                handler.send_error(411)
+                await writer.drain()
+                return
+
+            length = handler.content_length()
+            if length is None:
+                handler.send_error(400, "Invalid Content-Length")
+                await writer.drain()
+                return
+            body = await reader.readexactly(length) if length else b""
+            handler.rfile = io.BytesIO(body)
+
+            await loop.run_in_executor(self._executor, handler.handle_request)
+            await writer.drain()
+
+            if handler.close_connection:
+                return
+
+    async def _read_head(self, reader):
+        """Read the request line and headers of a request. Lines may end
+        with either CRLF or a bare LF, and empty lines before the request
+        line are skipped.
+
+        :returns: Bytes of the head, or None if the connection was closed
+                  before the end of the head.
+        :raises asyncio.LimitOverrunError: if the head is longer than
+                                           max_head_size.
+        """
+        lines = []
+        size = 0
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                if lines or e.partial.strip():
+                    self.logger.debug("Connection closed in the middle of a request")
+                return None
+            size += len(line)
+            if size > self.max_head_size:
+                raise asyncio.LimitOverrunError("Request head is too long", size)
+            if line in (b"\r\n", b"\n"):
+                if lines:
+                    lines.append(line)
+                    return b"".join(lines)
+            else:
+                lines.append(line)
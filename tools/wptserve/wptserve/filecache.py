@@ -0,0 +1,106 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def stat_key(stat):
+    """Tuple of the fields of a stat result that change whenever the
+    file does"""
+    return (stat.st_mtime, stat.st_ctime, stat.st_size, stat.st_ino, stat.st_dev)
+
+
+class FileCache(object):
+    """In-memory cache of small files and of directory listings.
+
+    Each entry is validated against a fresh os.stat of the file or
+    directory whenever it is used, so changes on disk are picked up
+    immediately. The total size of the cached data is bounded; once it
+    exceeds max_size the least recently used entries are evicted.
+
+    The cache is shared between the threads of a server, but each process
+    gets its own empty cache.
+
+    :param max_size: Maximum total size of cached data in bytes
+    :param max_file_size: Maximum size of a file for its contents
+                          to be cached, in bytes
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024, max_file_size=256 * 1024):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def __getstate__(self):
+        return {"max_size": self.max_size,
+                "max_file_size": self.max_file_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key, validator, load):
+        """Get a cached value.
+
+        :param key: Key of the cache entry
+        :param validator: Value that is compared with the one stored with
+                          the entry; if they differ the entry is reloaded
+        :param load: Function returning a tuple of (value, size) that is
+                     called when there's no valid entry
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0] == validator:
+                    # Reinsert to mark this entry as the most recently used
+                    self._entries[key] = entry
+                    return entry[1]
+                self._size -= entry[2]
+
+        value, size = load()
+        if size > self.max_size:
+            return value
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[2]
+            self._entries[key] = (validator, value, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+        return value
+
+    def listdir(self, path):
+        """Set of names in a directory, as returned by os.listdir"""
+        def load():
+            names = frozenset(os.listdir(path))
+            return names, sum(len(name) for name in names)
+
+        return self.get(("listdir", path), stat_key(os.stat(path)), load)
+
+    def read(self, path, stat=None):
+        """Contents of a file, or None if the file is larger than
+        max_file_size.
+
+        :param stat: Result of os.stat for path, if the caller already has it
+        """
+        if stat is None:
+            stat = os.stat(path)
+        if stat.st_size > self.max_file_size:
+            return None
+
+        def load():
+            with open(path, "rb") as f:
+                data = f.read()
+            return data, len(data)
+
+        return self.get(("read", path), stat_key(stat), load)
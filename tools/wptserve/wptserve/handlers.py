@@ -2,16 +2,18 @@ import cgi
 import json
 import os
 import sys
+import time
 import traceback
 
 from six.moves.urllib.parse import parse_qs, quote, unquote, urljoin
 from six import iteritems
 
 from .constants import content_types
+from .filecache import FileCache, stat_key
 from .pipes import Pipeline, template
 from .ranges import RangeParser
 from .request import Authentication
-from .response import MultipartContent
+from .response import FileSlice, MultipartContent
 from .utils import HTTPException
 
 __all__ = ["file_handler", "python_script_handler",
@@ -119,15 +121,28 @@ def wrap_pipeline(path, request, response):
         pipe_string += query["pipe"][-1]
 
     if pipe_string:
+        start = time.time()
         response = Pipeline(pipe_string)(request, response)
+        if request.timings is not None:
+            request.timings["pipeline"] = (request.timings.get("pipeline", 0) +
+                                           time.time() - start)
 
     return response
 
 
 class FileHandler(object):
-    def __init__(self, base_path=None, url_base="/"):
+    """Handler serving static files.
+
+    :param base_path: Filesystem path from which files are served, or None
+                      to use the request's doc_root
+    :param url_base: URL prefix corresponding to base_path
+    :param cache: Optional FileCache used to avoid rereading small files
+                  and looking for .headers files on each request
+    """
+    def __init__(self, base_path=None, url_base="/", cache=None):
         self.base_path = base_path
         self.url_base = url_base
+        self.cache = cache
         self.directory_handler = DirectoryHandler(self.base_path, self.url_base)
 
     def __repr__(self):
@@ -140,7 +155,8 @@ class FileHandler(object):
             return self.directory_handler(request, response)
         try:
             #This is probably racy with some other process trying to change the file
-            file_size = os.stat(path).st_size
+            stat = os.stat(path)
+            file_size = stat.st_size
             response.headers.update(self.get_headers(request, path))
             if "Range" in request.headers:
                 try:
@@ -151,7 +167,11 @@ class FileHandler(object):
                         raise
             else:
                 byte_ranges = None
-            data = self.get_data(response, path, byte_ranges)
+            data = None
+            if self.cache is not None and byte_ranges is None:
+                data = self.cache.read(path, stat)
+            if data is None:
+                data = self.get_data(response, path, byte_ranges)
             response.content = data
             response = wrap_pipeline(path, request, response)
             return response
@@ -169,6 +189,9 @@ class FileHandler(object):
         return rv
 
     def load_headers(self, request, path):
+        if self.cache is not None:
+            return self.load_headers_cached(request, path)
+
         headers_path = path + ".sub.headers"
         if os.path.exists(headers_path):
             use_sub = True
@@ -187,26 +210,59 @@ class FileHandler(object):
             return [tuple(item.strip() for item in line.split(b":", 1))
                     for line in data.splitlines() if line]
 
+    def load_headers_cached(self, request, path):
+        """Equivalent of load_headers that uses the cached listing of the
+        containing directory to find out if there is a headers file, so
+        that files without one don't need any extra filesystem access"""
+        dir_path, name = os.path.split(path)
+        try:
+            names = self.cache.listdir(dir_path)
+        except OSError:
+            return []
+        if name + ".sub.headers" in names:
+            headers_path = path + ".sub.headers"
+            use_sub = True
+        elif name + ".headers" in names:
+            headers_path = path + ".headers"
+            use_sub = False
+        else:
+            return []
+
+        try:
+            data = self.cache.read(headers_path)
+            if data is None:
+                with open(headers_path, "rb") as headers_file:
+                    data = headers_file.read()
+        except (OSError, IOError):
+            return []
+        if use_sub:
+            data = template(request, data, escape_type="none")
+        return [tuple(item.strip() for item in line.split(b":", 1))
+                for line in data.splitlines() if line]
+
     def get_data(self, response, path, byte_ranges):
-        """Return either the handle to a file, or a string containing
-        the content of a chunk of the file, if we have a range request."""
+        """Return either the handle to a file, a FileSlice for the requested
+        part of the file if we have a single range request, or the multipart
+        content if we have several ranges."""
         if byte_ranges is None:
             return open(path, 'rb')
-        else:
-            with open(path, 'rb') as f:
-                response.status = 206
-                if len(byte_ranges) > 1:
-                    parts_content_type, content = self.set_response_multipart(response,
-                                                                              byte_ranges,
-                                                                              f)
-                    for byte_range in byte_ranges:
-                        content.append_part(self.get_range_data(f, byte_range),
-                                            parts_content_type,
-                                            [("Content-Range", byte_range.header_value())])
-                    return content
-                else:
-                    response.headers.set("Content-Range", byte_ranges[0].header_value())
-                    return self.get_range_data(f, byte_ranges[0])
+
+        response.status = 206
+        if len(byte_ranges) == 1:
+            byte_range = byte_ranges[0]
+            response.headers.set("Content-Range", byte_range.header_value())
+            return FileSlice(open(path, 'rb'), byte_range.lower,
+                             byte_range.upper - byte_range.lower)
+
+        with open(path, 'rb') as f:
+            parts_content_type, content = self.set_response_multipart(response,
+                                                                      byte_ranges,
+                                                                      f)
+            for byte_range in byte_ranges:
+                content.append_part(self.get_range_data(f, byte_range),
+                                    parts_content_type,
+                                    [("Content-Range", byte_range.header_value())])
+            return content
 
     def set_response_multipart(self, response, ranges, f):
         parts_content_type = response.headers.get("Content-Type")
@@ -226,6 +282,38 @@ class FileHandler(object):
 file_handler = FileHandler()
 
 
+# Compiled code of .py handler scripts, shared between all PythonScriptHandlers
+script_cache = FileCache(max_size=16 * 1024 * 1024)
+
+
+def load_script(path):
+    """Get the compiled code object for a Python script. The code is cached
+    until the file changes."""
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise IOError(e.errno, e.strerror, path)
+
+    def load():
+        with open(path, 'rb') as f:
+            source = f.read()
+        return compile(source, path, 'exec'), len(source)
+
+    return script_cache.get(path, stat_key(stat), load)
+
+
+def is_local_module(module, root):
+    """Whether a module was loaded from a file under root, rather than e.g.
+    from the standard library"""
+    if module is None:
+        # Python 2 placeholder for failed relative imports
+        return True
+    module_path = getattr(module, "__file__", None)
+    if module_path is None:
+        return False
+    return os.path.abspath(module_path).startswith(root)
+
+
 class PythonScriptHandler(object):
     def __init__(self, base_path=None, url_base="/"):
         self.base_path = base_path
@@ -246,14 +334,15 @@ class PythonScriptHandler(object):
         :return: The return of func
         """
         path = filesystem_path(self.base_path, request, self.url_base)
+        root = os.path.join(os.path.abspath(self.base_path if self.base_path is not None
+                                            else request.doc_root), "")
 
         sys_path = sys.path[:]
-        sys_modules = sys.modules.copy()
+        sys_modules = set(sys.modules)
         try:
             environ = {"__file__": path}
             sys.path.insert(0, os.path.dirname(path))
-            with open(path, 'rb') as f:
-                exec(compile(f.read(), path, 'exec'), environ, environ)
+            exec(load_script(path), environ, environ)
 
             if func is not None:
                 return func(request, response, environ, path)
@@ -262,7 +351,13 @@ class PythonScriptHandler(object):
             raise HTTPException(404)
         finally:
             sys.path = sys_path
-            sys.modules = sys_modules
+            # Unload modules the script imported from the document root, so
+            # that helper modules with the same name in different directories
+            # don't clash. Anything else it imported, e.g. from the standard
+            # library, stays loaded for later requests.
+            for name in set(sys.modules) - sys_modules:
+                if is_local_module(sys.modules.get(name), root):
+                    sys.modules.pop(name, None)
 
     def __call__(self, request, response):
         def func(request, response, environ, path):
@@ -0,0 +1,115 @@
+import json
+import threading
+
+
+class Metrics(object):
+    """Aggregated timings of the requests handled by a server.
+
+    When a server is given a Metrics object it times each stage of
+    handling a request: finding the handler (route), running the handler
+    (handler, not counting the time spent in pipes), applying pipes
+    (pipeline), and writing the response if the handler didn't write it
+    itself (write). Totals are kept for each stage, and for each request
+    path, along with the number of bytes written and the number of open
+    connections. The data is served as JSON from the path attribute.
+
+    Data is only kept in memory, so each server process has its own
+    metrics.
+
+    :param max_paths: Maximum number of request paths with their own
+                      totals. Requests for other paths are counted
+                      under "(other)".
+    """
+    stages = ("route", "handler", "pipeline", "write")
+    path = "/.well-known/wptserve-metrics"
+
+    def __init__(self, max_paths=10000):
+        self.max_paths = max_paths
+        self._lock = threading.Lock()
+        self.active_connections = 0
+        self.max_active_connections = 0
+        self.reset()
+
+    def reset(self):
+        """Discard the totals collected so far"""
+        with self._lock:
+            self.requests = 0
+            self.bytes_out = 0
+            # Lists of [count, total time, max time]
+            self._stages = {name: [0, 0., 0.] for name in self.stages}
+            # Lists of [count, total time, max time, bytes out]
+            self._paths = {}
+
+    def connection_opened(self):
+        with self._lock:
+            self.active_connections += 1
+            self.max_active_connections = max(self.max_active_connections,
+                                              self.active_connections)
+
+    def connection_closed(self):
+        with self._lock:
+            self.active_connections -= 1
+
+    def record_request(self, path, timings, bytes_out):
+        """Add the data of a request to the totals
+
+        :param path: Path of the request, without the query
+        :param timings: dict of stage name to the time spent in it, in seconds
+        :param bytes_out: Number of bytes written in response to the request
+        """
+        duration = sum(timings.values())
+        with self._lock:
+            self.requests += 1
+            self.bytes_out += bytes_out
+            for name, value in timings.items():
+                stats = self._stages[name]
+                stats[0] += 1
+                stats[1] += value
+                stats[2] = max(stats[2], value)
+
+            stats = self._paths.get(path)
+            if stats is None:
+                if len(self._paths) >= self.max_paths:
+                    path = "(other)"
+                stats = self._paths.setdefault(path, [0, 0., 0., 0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            stats[3] += bytes_out
+
+    def to_dict(self, slowest=50):
+        """Get the current totals as a JSON-serializable dict
+
+        :param slowest: Number of paths to include, starting with the
+                        one with the largest total time
+        """
+        with self._lock:
+            stages = {name: {"count": count, "total": total, "max": max_time}
+                      for name, (count, total, max_time) in self._stages.items()}
+            paths = sorted(self._paths.items(), key=lambda item: -item[1][1])[:slowest]
+            return {"requests": self.requests,
+                    "bytes_out": self.bytes_out,
+                    "active_connections": self.active_connections,
+                    "max_active_connections": self.max_active_connections,
+                    "stages": stages,
+                    "paths": [{"path": path,
+                               "count": count,
+                               "total": total,
+                               "max": max_time,
+                               "bytes_out": bytes_out}
+                              for path, (count, total, max_time, bytes_out) in paths]}
+
+    def handler(self, request, response):
+        """Handler serving the metrics as JSON. The slowest query parameter
+        sets the number of paths included, and reset=1 discards the totals
+        after they are read."""
+        try:
+            slowest = int(request.GET.first("slowest", "50"))
+        except ValueError:
+            slowest = 50
+        data = self.to_dict(slowest)
+        if request.GET.first("reset", None) == "1":
+            self.reset()
+        response.headers.set("Content-Type", "application/json")
+        response.headers.set("Cache-Control", "no-cache")
+        response.content = json.dumps(data, indent=2, sort_keys=True)
@@ -1,20 +1,92 @@
 from cgi import escape
 from collections import deque
 import base64
-import gzip as gzip_module
 import hashlib
 import os
 import re
 import time
 import uuid
-from six.moves import StringIO
+import zlib
 
 from six import text_type, binary_type
 
+from .filecache import FileCache, stat_key
+from .response import FileSlice
+
 def resolve_content(response):
     return b"".join(item for item in response.iter_content(read_file=True))
 
 
+def iter_chunks(response, chunk_size=64 * 1024):
+    """Get an iterator over the body that the response has when this is
+    called, as byte strings. Unlike resolve_content this doesn't hold the
+    whole body in memory; files are read chunk_size bytes at a time.
+    """
+    content = response.content
+    encoding = response.encoding
+    if isinstance(content, (binary_type, text_type)) or hasattr(content, "read"):
+        content = [content]
+
+    def chunks():
+        for item in content:
+            if hasattr(item, "__call__"):
+                item = item()
+            if hasattr(item, "read"):
+                try:
+                    while True:
+                        data = item.read(chunk_size)
+                        if not data:
+                            break
+                        yield data
+                finally:
+                    item.close()
+            elif isinstance(item, text_type):
+                yield item.encode(encoding)
+            elif item:
+                yield item
+
+    return chunks()
+
+
+class ChunkReader(object):
+    """Reader for an iterator of byte strings that allows reading them
+    in parts of a given size"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+
+    def read(self, size):
+        """Read up to size bytes, returning fewer only at the end of the data"""
+        parts = [self._buf]
+        length = len(self._buf)
+        while length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = b"".join(parts)
+        self._buf = data[size:]
+        return data[:size]
+
+    def at_end(self):
+        while not self._buf:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return True
+            self._buf = chunk
+        return False
+
+    def iter_rest(self):
+        """Iterator over all the remaining data"""
+        if self._buf:
+            yield self._buf
+            self._buf = b""
+        for chunk in self._chunks:
+            yield chunk
+
+
 class Pipeline(object):
     pipes = {}
 
@@ -232,8 +304,7 @@ def trickle(request, response, delays):
     delays = parse_delays()
     if not delays:
         return response
-    content = resolve_content(response)
-    offset = [0]
+    content = ChunkReader(iter_chunks(response))
 
     if not ("Cache-Control" in response.headers or
             "Pragma" in response.headers or
@@ -245,19 +316,19 @@ def trickle(request, response, delays):
     def add_content(delays, repeat=False):
         for i, (item_type, value) in enumerate(delays):
             if item_type == "bytes":
-                yield content[offset[0]:offset[0] + value]
-                offset[0] += value
+                yield content.read(value)
             elif item_type == "delay":
                 time.sleep(value)
             elif item_type == "repeat":
                 if i != len(delays) - 1:
                     continue
-                while offset[0] < len(content):
+                while not content.at_end():
                     for item in add_content(delays[-(value + 1):-1], True):
                         yield item
 
-        if not repeat and offset[0] < len(content):
-            yield content[offset[0]:]
+        if not repeat:
+            for item in content.iter_rest():
+                yield item
 
     response.content = add_content(delays)
     return response
@@ -274,9 +345,19 @@ def slice(request, response, start, end=None):
                 (spelled "null" in a query string) to indicate the end of
                 the file.
     """
-    content = resolve_content(response)[start:end]
+    file_slice = None
+    if hasattr(response.content, "read"):
+        file_slice = FileSlice.from_file(response.content)
+
+    if file_slice is not None:
+        # Send only the requested part of the file, without reading it
+        content = file_slice.slice(start, end)
+        length = content.length
+    else:
+        content = resolve_content(response)[start:end]
+        length = len(content)
     response.content = content
-    response.headers.set("Content-Length", len(content))
+    response.headers.set("Content-Length", length)
     return response
 
 
@@ -388,6 +469,10 @@ def sub(request, response, escape_type="html"):
     response.content = new_content
     return response
 
+# Hashes computed by SubFunctions.file_hash, keyed by algorithm and path
+file_hash_cache = FileCache(max_size=1024 * 1024)
+
+
 class SubFunctions(object):
     @staticmethod
     def uuid(request):
@@ -406,13 +491,20 @@ class SubFunctions(object):
         if algorithm not in SubFunctions.supported_algorithms:
             raise ValueError("Unsupported encryption algorithm: '%s'" % algorithm)
 
-        hash_obj = getattr(hashlib, algorithm)()
         absolute_path = os.path.join(request.doc_root, path)
 
-        try:
+        def load():
+            hash_obj = getattr(hashlib, algorithm)()
             with open(absolute_path, "rb") as f:
                 hash_obj.update(f.read())
-        except IOError:
+            digest = base64.b64encode(hash_obj.digest()).strip()
+            return digest, len(digest)
+
+        try:
+            return file_hash_cache.get((algorithm, absolute_path),
+                                       stat_key(os.stat(absolute_path)),
+                                       load)
+        except (OSError, IOError):
             # In this context, an unhandled IOError will be interpreted by the
             # server as an indication that the template file is non-existent.
             # Although the generic "Exception" is less precise, it avoids
@@ -420,8 +512,6 @@ class SubFunctions(object):
             # the path to the file to be hashed is invalid.
             raise Exception('Cannot open file for hash computation: "%s"' % absolute_path)
 
-        return base64.b64encode(hash_obj.digest()).strip()
-
     @staticmethod
     def fs_path(request, path):
         if not path.startswith("/"):
@@ -441,17 +531,30 @@ class SubFunctions(object):
     def header_or_default(request, name, default):
         return request.headers.get(name, default)
 
-def template(request, content, escape_type="html"):
-    #TODO: There basically isn't any error handling here
-    tokenizer = ReplacementTokenizer()
+# Compiled templates, keyed by their content
+template_cache = FileCache(max_size=16 * 1024 * 1024)
 
-    variables = {}
+template_regexp = re.compile(br"{{([^}]*)}}")
 
-    def config_replacement(match):
-        content, = match.groups()
 
-        tokens = tokenizer.tokenize(content)
-        tokens = deque(tokens)
+def compile_template(content):
+    """Split a template into a list of literal byte strings, and
+    substitutions. Each substitution is a tuple of (variable, field,
+    tokens), where variable is the name of the variable that the value
+    is assigned to, or None, field is the name of the initial value and
+    tokens is a list of the index and argument tokens applied to it."""
+    tokenizer = ReplacementTokenizer()
+    # The regexp has a single group, so the parts alternate between literal
+    # content and the content of substitutions
+    parts = template_regexp.split(content)
+    compiled = []
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            if part:
+                compiled.append(part)
+            continue
+
+        tokens = deque(tokenizer.tokenize(part))
 
         token_type, field = tokens.popleft()
         assert isinstance(field, text_type)
@@ -466,71 +569,91 @@ def template(request, content, escape_type="html"):
         if token_type != "ident":
             raise Exception("unexpected token type %s (token '%r'), expected ident" % (token_type, field))
 
-        if field in variables:
-            value = variables[field]
-        elif hasattr(SubFunctions, field):
-            value = getattr(SubFunctions, field)
-        elif field == "headers":
-            value = request.headers
-        elif field == "GET":
-            value = FirstWrapper(request.GET)
-        elif field == "hosts":
-            value = request.server.config.all_domains
-        elif field == "domains":
-            value = request.server.config.all_domains[""]
-        elif field == "host":
-            value = request.server.config["browser_host"]
-        elif field in request.server.config:
-            value = request.server.config[field]
-        elif field == "location":
-            value = {"server": "%s://%s:%s" % (request.url_parts.scheme,
-                                               request.url_parts.hostname,
-                                               request.url_parts.port),
-                     "scheme": request.url_parts.scheme,
-                     "host": "%s:%s" % (request.url_parts.hostname,
-                                        request.url_parts.port),
-                     "hostname": request.url_parts.hostname,
-                     "port": request.url_parts.port,
-                     "path": request.url_parts.path,
-                     "pathname": request.url_parts.path,
-                     "query": "?%s" % request.url_parts.query}
-        elif field == "url_base":
-            value = request.url_base
-        else:
-            raise Exception("Undefined template variable %s" % field)
-
-        while tokens:
-            ttype, field = tokens.popleft()
-            if ttype == "index":
-                value = value[field]
-            elif ttype == "arguments":
-                value = value(request, *field)
-            else:
+        for ttype, value in tokens:
+            if ttype not in ("index", "arguments"):
                 raise Exception(
-                    "unexpected token type %s (token '%r'), expected ident or arguments" % (ttype, field)
+                    "unexpected token type %s (token '%r'), expected ident or arguments" % (ttype, value)
                 )
 
-        assert isinstance(value, (int, (binary_type, text_type))), tokens
+        compiled.append((variable, field, list(tokens)))
+    return compiled
 
-        if variable is not None:
-            variables[variable] = value
 
-        escape_func = {"html": lambda x:escape(x, quote=True),
-                       "none": lambda x:x}[escape_type]
+def template(request, content, escape_type="html"):
+    #TODO: There basically isn't any error handling here
+    compiled = template_cache.get(content, None,
+                                  lambda: (compile_template(content), 2 * len(content)))
 
-        # Should possibly support escaping for other contexts e.g. script
-        # TODO: read the encoding of the response
-        # cgi.escape() only takes text strings in Python 3.
-        if isinstance(value, binary_type):
-            value = value.decode("utf-8")
-        elif isinstance(value, int):
-            value = text_type(value)
-        return escape_func(value).encode("utf-8")
+    escape_func = {"html": lambda x:escape(x, quote=True),
+                   "none": lambda x:x}[escape_type]
 
-    template_regexp = re.compile(br"{{([^}]*)}}")
-    new_content = template_regexp.sub(config_replacement, content)
+    variables = {}
+    parts = []
+    for item in compiled:
+        if isinstance(item, binary_type):
+            parts.append(item)
+        else:
+            parts.append(substitute(request, item, variables, escape_func))
+    return b"".join(parts)
+
+
+def substitute(request, substitution, variables, escape_func):
+    """Get the value of a substitution from compile_template, escaped with
+    escape_func and encoded"""
+    variable, field, tokens = substitution
+
+    if field in variables:
+        value = variables[field]
+    elif hasattr(SubFunctions, field):
+        value = getattr(SubFunctions, field)
+    elif field == "headers":
+        value = request.headers
+    elif field == "GET":
+        value = FirstWrapper(request.GET)
+    elif field == "hosts":
+        value = request.server.config.all_domains
+    elif field == "domains":
+        value = request.server.config.all_domains[""]
+    elif field == "host":
+        value = request.server.config["browser_host"]
+    elif field in request.server.config:
+        value = request.server.config[field]
+    elif field == "location":
+        value = {"server": "%s://%s:%s" % (request.url_parts.scheme,
+                                           request.url_parts.hostname,
+                                           request.url_parts.port),
+                 "scheme": request.url_parts.scheme,
+                 "host": "%s:%s" % (request.url_parts.hostname,
+                                    request.url_parts.port),
+                 "hostname": request.url_parts.hostname,
+                 "port": request.url_parts.port,
+                 "path": request.url_parts.path,
+                 "pathname": request.url_parts.path,
+                 "query": "?%s" % request.url_parts.query}
+    elif field == "url_base":
+        value = request.url_base
+    else:
+        raise Exception("Undefined template variable %s" % field)
+
+    for ttype, field in tokens:
+        if ttype == "index":
+            value = value[field]
+        else:
+            value = value(request, *field)
+
+    assert isinstance(value, (int, (binary_type, text_type))), tokens
 
-    return new_content
+    if variable is not None:
+        variables[variable] = value
+
+    # Should possibly support escaping for other contexts e.g. script
+    # TODO: read the encoding of the response
+    # cgi.escape() only takes text strings in Python 3.
+    if isinstance(value, binary_type):
+        value = value.decode("utf-8")
+    elif isinstance(value, int):
+        value = text_type(value)
+    return escape_func(value).encode("utf-8")
 
 @pipe()
 def gzip(request, response):
@@ -538,16 +661,33 @@ def gzip(request, response):
 
     It sets (or overwrites) these HTTP headers:
     Content-Encoding is set to gzip
-    Content-Length is set to the length of the compressed content
+    Content-Length is set to the length of the compressed content if
+    the size of the body is known, i.e. it is a string or a regular file;
+    otherwise the body is compressed as it is sent and any Content-Length
+    header is removed
     """
-    content = resolve_content(response)
+    content = response.content
+    sized = (isinstance(content, (binary_type, text_type)) or
+             FileSlice.from_file(content) is not None)
+    chunks = iter_chunks(response)
     response.headers.set("Content-Encoding", "gzip")
 
-    out = StringIO()
-    with gzip_module.GzipFile(fileobj=out, mode="w") as f:
-        f.write(content)
-    response.content = out.getvalue()
-
-    response.headers.set("Content-Length", len(response.content))
+    def compress():
+        # wbits of 16 + MAX_WBITS produces the gzip format
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    if sized:
+        response.content = b"".join(compress())
+        response.headers.set("Content-Length", len(response.content))
+    else:
+        response.content = compress()
+        if "Content-Length" in response.headers:
+            del response.headers["Content-Length"]
 
     return response
@@ -244,6 +244,9 @@ class Request(object):
     def __init__(self, request_handler):
         self.doc_root = request_handler.server.router.doc_root
         self.route_match = None  # Set by the router
+        # dict of stage name to time in seconds, set by the server when it
+        # collects metrics
+        self.timings = None
 
         self.protocol_version = request_handler.protocol_version
         self.method = request_handler.command
@@ -2,6 +2,8 @@ from collections import OrderedDict
 from datetime import datetime, timedelta
 from six.moves.http_cookies import BaseCookie, Morsel
 import json
+import os
+import stat
 import uuid
 import socket
 from .constants import response_codes, h2_headers
@@ -237,6 +239,75 @@ class Response(object):
             self.logger.error(message)
 
 
+class FileSlice(object):
+    """Read-only file-like object giving access to a byte range of a file.
+
+    When a FileSlice is the content of a response it is written with
+    sendfile where possible, so only the bytes in the range are sent and
+    they aren't copied through userspace.
+
+    :param f: File object opened in binary mode. This is closed when the
+              FileSlice is closed.
+    :param start: Offset in f of the first byte of the range
+    :param length: Number of bytes in the range
+    """
+    def __init__(self, f, start, length):
+        self.file = f
+        self.start = start
+        self.length = length
+        self._pos = 0
+
+    @classmethod
+    def from_file(cls, f):
+        """Get a FileSlice covering the rest of a regular file, starting
+        from its current position, or None if f isn't a regular file."""
+        if isinstance(f, FileSlice):
+            return f
+        try:
+            fd = f.fileno()
+        except (AttributeError, IOError, ValueError):
+            return None
+        file_stat = os.fstat(fd)
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        start = f.tell()
+        return cls(f, start, max(file_stat.st_size - start, 0))
+
+    def slice(self, start, end=None):
+        """Get a FileSlice for part of this one. start and end have the same
+        meaning as when slicing a string."""
+        start, end, _ = slice(start, end).indices(self.length)
+        return FileSlice(self.file, self.start + start, max(end - start, 0))
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.length
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def read(self, size=-1):
+        remaining = max(self.length - self._pos, 0)
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if not size:
+            return b""
+        self.file.seek(self.start + self._pos)
+        data = self.file.read(size)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
 class MultipartContent(object):
     def __init__(self, boundary=None, default_content_type=None):
         self.items = []
@@ -425,6 +496,7 @@ class H2ResponseWriter(object):
         self._handler = handler
         self.stream_ended = False
         self.content_written = False
+        self.bytes_written = 0
         self.request = response.request
         self.logger = response.logger
 
@@ -460,7 +532,7 @@ class H2ResponseWriter(object):
                 end_stream=last or self.request.method == "HEAD"
             )
 
-            self.write(connection)
+        self.write()
 
     def write_data(self, item, last=False, stream_id=None):
         """
@@ -484,14 +556,24 @@ class H2ResponseWriter(object):
         data_len = data.tell()
         data.seek(0)
 
-        # If the data is longer than max payload size, need to write it in chunks
-        payload_size = self.get_max_payload_size()
-        while data_len > payload_size:
-            self.write_data_frame(data.read(payload_size), False, stream_id)
-            data_len -= payload_size
-            payload_size = self.get_max_payload_size()
-
-        self.write_data_frame(data.read(), last, stream_id)
+        if not data_len:
+            self.write_data_frame(b"", last, stream_id)
+            return
+
+        stream_id = self.request.h2_stream_id if stream_id is None else stream_id
+        # If the data is longer than max payload size, need to write it in chunks.
+        # The window is checked and used while holding the lock, as other streams
+        # share the window of the connection
+        while data_len:
+            with self.h2conn as connection:
+                window = self.h2conn.wait_for_window(stream_id)
+                payload = data.read(min(connection.max_outbound_frame_size, window))
+                data_len -= len(payload)
+                self.bytes_written += len(payload)
+                connection.send_data(stream_id=stream_id, data=payload,
+                                     end_stream=last and not data_len)
+            self.write()
+        self.stream_ended = last
 
     def write_data_frame(self, data, last, stream_id=None):
         with self.h2conn as connection:
@@ -500,7 +582,7 @@ class H2ResponseWriter(object):
                 data=data,
                 end_stream=last,
             )
-            self.write(connection)
+        self.write()
         self.stream_ended = last
 
     def write_push(self, promise_headers, push_stream_id=None, status=None, response_headers=None, response_data=None):
@@ -521,7 +603,7 @@ class H2ResponseWriter(object):
         with self.h2conn as connection:
             push_stream_id = push_stream_id if push_stream_id is not None else connection.get_next_available_stream_id()
             connection.push_stream(self.request.h2_stream_id, push_stream_id, promise_headers)
-            self.write(connection)
+        self.write()
 
         has_data = response_data is not None
         if response_headers is not None:
@@ -537,7 +619,7 @@ class H2ResponseWriter(object):
         """Ends the stream with the given ID, or the one that request was made on if no ID given."""
         with self.h2conn as connection:
             connection.end_stream(stream_id if stream_id is not None else self.request.h2_stream_id)
-            self.write(connection)
+        self.write()
         self.stream_ended = True
 
     def write_raw_header_frame(self, headers, stream_id=None, end_stream=False, end_headers=False, frame_cls=HeadersFrame):
@@ -570,7 +652,7 @@ class H2ResponseWriter(object):
                 frame.flags.add('END_HEADERS')
 
             data = frame.serialize()
-            self.write_raw(data)
+        self.write_raw(data)
 
     def write_raw_data_frame(self, data, stream_id=None, end_stream=False):
         """
@@ -612,21 +694,23 @@ class H2ResponseWriter(object):
 
 
     def get_max_payload_size(self, stream_id=None):
-        """Returns the maximum size of a payload for the given stream."""
+        """Returns the maximum size of a payload for the given stream. If the flow control
+        window of the stream is closed, waits until the client opens it."""
         stream_id = stream_id if stream_id is not None else self.request.h2_stream_id
         with self.h2conn as connection:
-            return min(connection.remote_settings.max_frame_size, connection.local_flow_control_window(stream_id)) - 9
+            window = self.h2conn.wait_for_window(stream_id)
+            return min(connection.max_outbound_frame_size, window)
 
-    def write(self, connection):
+    def write(self):
+        """Send the frames generated by the H2 Connection object through the socket"""
         self.content_written = True
-        data = connection.data_to_send()
-        self.socket.sendall(data)
+        self.h2conn.flush()
 
     def write_raw(self, raw_data):
         """Used for sending raw bytes/data through the socket"""
 
         self.content_written = True
-        self.socket.sendall(raw_data)
+        self.h2conn.send_raw(raw_data)
 
     def encode(self, data):
         """Convert unicode to bytes according to response.encoding."""
@@ -655,6 +739,7 @@ class ResponseWriter(object):
         self._headers_seen = set()
         self._headers_complete = False
         self.content_written = False
+        self.bytes_written = 0
         self.request = response.request
         self.file_chunk_size = 32 * 1024
         self.default_status = 200
@@ -704,10 +789,13 @@ class ResponseWriter(object):
             if not self._seen_header(name):
                 self.write_header(name, f())
 
-        if (isinstance(self._response.content, (binary_type, text_type)) and
-            not self._seen_header("content-length")):
-            #Would be nice to avoid double-encoding here
-            self.write_header("Content-Length", len(self.encode(self._response.content)))
+        if not self._seen_header("content-length"):
+            content = self._response.content
+            if isinstance(content, (binary_type, text_type)):
+                #Would be nice to avoid double-encoding here
+                self.write_header("Content-Length", len(self.encode(content)))
+            elif isinstance(content, FileSlice):
+                self.write_header("Content-Length", max(content.length - content.tell(), 0))
 
     def end_headers(self):
         """Finish writing headers and write the separator.
@@ -753,8 +841,10 @@ class ResponseWriter(object):
         """Write directly to the response, converting unicode to bytes
         according to response.encoding. Does not flush."""
         self.content_written = True
+        data = self.encode(data)
+        self.bytes_written += len(data)
         try:
-            self._wfile.write(self.encode(data))
+            self._wfile.write(data)
         except socket.error:
             # This can happen if the socket got closed by the remote end
             pass
@@ -763,16 +853,47 @@ class ResponseWriter(object):
         """Write a file-like object directly to the response in chunks.
         Does not flush."""
         self.content_written = True
+        if self._sendfile(data):
+            data.close()
+            return
         while True:
             buf = data.read(self.file_chunk_size)
             if not buf:
                 break
+            self.bytes_written += len(buf)
             try:
                 self._wfile.write(buf)
             except socket.error:
                 break
         data.close()
 
+    def _sendfile(self, data):
+        """Write the rest of a regular file, or of a FileSlice, to the
+        connection's socket using socket.sendfile, which avoids copying
+        the data through userspace where the OS supports it.
+
+        :returns: False if this isn't possible, in which case nothing
+                  was written."""
+        sock = getattr(self._handler, "connection", None)
+        if not hasattr(sock, "sendfile"):
+            # Python 2, or not a socket
+            return False
+        file_slice = FileSlice.from_file(data)
+        if file_slice is None:
+            return False
+
+        # Anything already buffered must go out before the file
+        count = file_slice.length - file_slice.tell()
+        if self.flush() and count > 0:
+            try:
+                self.bytes_written += sock.sendfile(file_slice.file,
+                                                    file_slice.start + file_slice.tell(),
+                                                    count)
+            except socket.error:
+                # This can happen if the socket got closed by the remote end
+                pass
+        return True
+
     def encode(self, data):
         """Convert unicode to bytes according to response.encoding."""
         if isinstance(data, binary_type):
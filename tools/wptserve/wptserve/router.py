@@ -72,18 +72,83 @@ class RouteCompiler(object):
         self.star_seen = True
         return "(.*"
 
-def compile_path_match(route_pattern):
-    """tokens: / or literal or match or *"""
-
+def tokenize_path_match(route_pattern):
     tokenizer = RouteTokenizer()
     tokens, unmatched = tokenizer.scan(route_pattern)
 
     assert unmatched == "", unmatched
 
+    return tokens
+
+def compile_path_match(route_pattern):
+    """tokens: / or literal or match or *"""
+
+    tokens = tokenize_path_match(route_pattern)
+
     compiler = RouteCompiler()
 
     return compiler.compile(tokens)
 
+def path_match_literals(route_pattern):
+    """Get the literal text that any path matching a route pattern
+    must start and end with.
+
+    :returns: Tuple of (prefix, suffix). For patterns without any
+              groups or stars the prefix is the whole path and the
+              suffix is empty."""
+    tokens = tokenize_path_match(route_pattern)
+    if not tokens or tokens[0][0] != "slash":
+        tokens = [("slash", None)] + tokens
+
+    parts = [token[1] if token[0] == "literal" else "/"
+             if token[0] == "slash" else None
+             for token in tokens]
+    if None not in parts:
+        return "".join(parts), ""
+    first = parts.index(None)
+    last = len(parts) - parts[::-1].index(None)
+    return "".join(parts[:first]), "".join(parts[last:])
+
+
+class RouteIndex(object):
+    """Index of the routes that apply to a single request method.
+
+    Routes are bucketed by the literal prefix that matching paths must
+    start with, and each route records the literal suffix that matching
+    paths must end with, so that for a given path only the regexps of
+    routes that can possibly match need to be tried.
+
+    :param routes: List of (regexp, handler, prefix, suffix) tuples, in
+                   priority order
+    """
+
+    def __init__(self, routes):
+        self.buckets = {}
+        for priority, (regexp, handler, prefix, suffix) in enumerate(routes):
+            self.buckets.setdefault(prefix, []).append((priority, suffix, regexp, handler))
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.buckets})
+
+    def candidates(self, path):
+        """Iterator over (regexp, handler) for the routes that may match
+        path, in priority order"""
+        matched = []
+        path_length = len(path)
+        for length in self.prefix_lengths:
+            if length > path_length:
+                break
+            bucket = self.buckets.get(path[:length])
+            if bucket is not None:
+                matched.append(bucket)
+
+        if len(matched) == 1:
+            entries = matched[0]
+        else:
+            entries = sorted(itertools.chain(*matched), key=lambda entry: entry[0])
+
+        for _, suffix, regexp, handler in entries:
+            if path.endswith(suffix):
+                yield regexp, handler
+
 class Router(object):
     """Object for matching handler functions to requests.
 
@@ -97,6 +162,8 @@ class Router(object):
     def __init__(self, doc_root, routes):
         self.doc_root = doc_root
         self.routes = []
+        self.route_literals = []
+        self.indexes = {}
         self.logger = get_logger()
         for route in reversed(routes):
             self.register(*route)
@@ -137,9 +204,31 @@ class Router(object):
         """
         if isinstance(methods, (binary_type, text_type)) or methods is any_method:
             methods = [methods]
+        literals = path_match_literals(path)
         for method in methods:
             self.routes.append((method, compile_path_match(path), handler))
+            self.route_literals.append(literals)
             self.logger.debug("Route pattern: %s" % self.routes[-1][1].pattern)
+        self.indexes = {}
+
+    def get_index(self, request_method):
+        """Get the RouteIndex of the routes applying to a request method,
+        building it on first use."""
+        index = self.indexes.get(request_method)
+        if index is None:
+            routes = []
+            for (method, regexp, handler), (prefix, suffix) in zip(reversed(self.routes),
+                                                                  reversed(self.route_literals)):
+                if (request_method == method or
+                    method in (any_method, "*") or
+                    (request_method == "HEAD" and method == "GET")):
+                    routes.append((regexp, handler, prefix, suffix))
+            index = RouteIndex(routes)
+            if len(self.indexes) > 32:
+                # Don't let requests with arbitrary methods grow this without bound
+                self.indexes = {}
+            self.indexes[request_method] = index
+        return index
 
     def get_handler(self, request):
         """Get a handler for a request or None if there is no handler.
@@ -147,22 +236,20 @@ class Router(object):
         :param request: Request to get a handler for.
         :rtype: Callable or None
         """
-        for method, regexp, handler in reversed(self.routes):
-            if (request.method == method or
-                method in (any_method, "*") or
-                (request.method == "HEAD" and method == "GET")):
-                m = regexp.match(request.url_parts.path)
-                if m:
-                    if not hasattr(handler, "__class__"):
-                        name = handler.__name__
-                    else:
-                        name = handler.__class__.__name__
-                    self.logger.debug("Found handler %s" % name)
-
-                    match_parts = m.groupdict().copy()
-                    if len(match_parts) < len(m.groups()):
-                        match_parts["*"] = m.groups()[-1]
-                    request.route_match = match_parts
-
-                    return handler
+        path = request.url_parts.path
+        for regexp, handler in self.get_index(request.method).candidates(path):
+            m = regexp.match(path)
+            if m:
+                if not hasattr(handler, "__class__"):
+                    name = handler.__name__
+                else:
+                    name = handler.__class__.__name__
+                self.logger.debug("Found handler %s" % name)
+
+                match_parts = m.groupdict().copy()
+                if len(match_parts) < len(m.groups()):
+                    match_parts["*"] = m.groups()[-1]
+                request.route_match = match_parts
+
+                return handler
         return None
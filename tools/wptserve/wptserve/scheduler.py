@@ -0,0 +1,165 @@
+import threading
+import time
+import traceback
+from collections import deque
+
+from .logger import get_logger
+
+
+class WorkerPool(object):
+    """Pool of daemon threads that run submitted tasks.
+
+    Threads are started as tasks are submitted, until there are
+    max_workers of them. Tasks submitted while all the threads are busy
+    are queued until one is free. Tasks may block until another task has
+    run, e.g. a handler waiting for a stash value that a later request
+    puts, so a task that has been queued for grow_after seconds is run on
+    an extra thread instead. Threads beyond max_workers exit once there
+    are no queued tasks.
+
+    :param max_workers: Number of threads that are kept for running tasks
+    :param grow_after: Number of seconds a task is queued before it's run
+                       on an extra thread
+    """
+
+    def __init__(self, max_workers, grow_after=0.1):
+        self.max_workers = max_workers
+        self.grow_after = grow_after
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # Used to wake the thread watching for tasks that have been queued
+        # for too long
+        self._queued = threading.Condition(self._lock)
+        # deque of (time queued, func, args)
+        self._tasks = deque()
+        self._threads = 0
+        self._idle = 0
+        self._watching = False
+        self._shutdown = False
+
+    @property
+    def threads(self):
+        """Number of threads that are running tasks or waiting for them"""
+        return self._threads
+
+    def submit(self, func, *args):
+        """Run func(*args) on one of the threads of the pool"""
+        with self._cond:
+            if self._shutdown:
+                raise ValueError("Can't submit tasks to a WorkerPool that's been shut down")
+            self._tasks.append((time.time(), func, args))
+            if self._idle >= len(self._tasks):
+                self._cond.notify()
+                return
+            if self._threads >= self.max_workers:
+                if self._watching:
+                    self._queued.notify()
+                    return
+                self._watching = True
+                target = self._watch
+            else:
+                self._threads += 1
+                target = self._run
+
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def shutdown(self):
+        """Stop the threads once they've run all the queued tasks"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            self._queued.notify_all()
+
+    def _watch(self):
+        with self._cond:
+            while not self._shutdown:
+                if not self._tasks:
+                    self._queued.wait()
+                    continue
+                wait = self._tasks[0][0] + self.grow_after - time.time()
+                if wait > 0:
+                    self._queued.wait(wait)
+                    continue
+                self._threads += 1
+                thread = threading.Thread(target=self._run, args=(self._tasks.popleft(),))
+                thread.daemon = True
+                thread.start()
+            self._watching = False
+
+    def _run(self, task=None):
+        while True:
+            if task is None:
+                with self._cond:
+                    while not self._tasks:
+                        if self._shutdown or self._threads > self.max_workers:
+                            self._threads -= 1
+                            return
+                        self._idle += 1
+                        self._cond.wait()
+                        self._idle -= 1
+                    task = self._tasks.popleft()
+
+            _, func, args = task
+            task = None
+            try:
+                func(*args)
+            except Exception:
+                self.logger.error(traceback.format_exc())
+
+
+class StreamScheduler(object):
+    """Processes the frames received on each stream of a connection using
+    a WorkerPool, rather than a thread for each stream.
+
+    Frames are processed in the order that they're dispatched, and each
+    stream is processed by at most one worker at a time, so a stream's
+    frames are never processed concurrently. A worker keeps processing a
+    stream until it has no more frames waiting.
+
+    :param pool: WorkerPool to use
+    :param process: Function called with (stream_id, frame) to process
+                    each frame
+    """
+
+    def __init__(self, pool, process):
+        self.pool = pool
+        self.process = process
+        self.logger = get_logger()
+        self._cond = threading.Condition(threading.Lock())
+        # Dict of {stream_id: deque of frames}, for streams that are being
+        # processed
+        self._streams = {}
+
+    def dispatch(self, stream_id, frame):
+        """Queue a frame to be processed for a stream"""
+        with self._cond:
+            frames = self._streams.get(stream_id)
+            if frames is not None:
+                frames.append(frame)
+                return
+            self._streams[stream_id] = deque([frame])
+        self.pool.submit(self._run, stream_id)
+
+    def join(self):
+        """Wait until all the dispatched frames have been processed"""
+        with self._cond:
+            while self._streams:
+                self._cond.wait()
+
+    def _run(self, stream_id):
+        while True:
+            with self._cond:
+                frames = self._streams[stream_id]
+                if not frames:
+                    del self._streams[stream_id]
+                    self._cond.notify_all()
+                    return
+                frame = frames.popleft()
+
+            try:
+                self.process(stream_id, frame)
+            except Exception:
+                self.logger.error(traceback.format_exc())
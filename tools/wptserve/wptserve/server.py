@@ -11,12 +11,12 @@ import traceback
 from six import binary_type, text_type
 import uuid
 from collections import OrderedDict
-
-from six.moves.queue import Queue
+from io import BytesIO
 
 from h2.config import H2Configuration
 from h2.connection import H2Connection
-from h2.events import RequestReceived, ConnectionTerminated, DataReceived, StreamReset, StreamEnded
+from h2.events import (RequestReceived, ConnectionTerminated, DataReceived, StreamReset, StreamEnded,
+                       WindowUpdated, RemoteSettingsChanged)
 
 from six.moves.urllib.parse import urlsplit, urlunsplit
 
@@ -26,6 +26,7 @@ from .logger import get_logger
 from .request import Server, Request, H2Request
 from .response import Response, H2Response
 from .router import Router
+from .scheduler import StreamScheduler, WorkerPool
 from .utils import HTTPException
 from .constants import h2_headers
 
@@ -118,10 +119,31 @@ class RequestRewriter(object):
                 request_handler.path = new_url
 
 
+def set_server_config(config, host, port):
+    """Set the configuration that handlers read through Server.config
+
+    :param config: Configuration to use, or None to use the default values
+    :param host: Host name the server was started with
+    :param port: Port the server is listening on
+    """
+    if config is not None:
+        Server.config = config
+    else:
+        get_logger().debug("Using default configuration")
+        with ConfigBuilder(browser_host=host,
+                           ports={"http": [port]}) as config:
+            assert config["ssl_config"] is None
+            Server.config = config
+
+
 class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
     allow_reuse_address = True
     acceptable_errors = (errno.EPIPE, errno.ECONNABORTED)
     request_queue_size = 2000
+    # Number of threads kept for handling HTTP/2 streams, across all
+    # connections. More are started while streams are waiting for all of
+    # them to be free; see WorkerPool.
+    h2_max_workers = 100
 
     # Ensure that we don't hang on shutdown waiting for requests
     daemon_threads = True
@@ -129,7 +151,8 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
     def __init__(self, server_address, request_handler_cls,
                  router, rewriter, bind_address,
                  config=None, use_ssl=False, key_file=None, certificate=None,
-                 encrypt_after_connect=False, latency=None, http2=False, **kwargs):
+                 encrypt_after_connect=False, latency=None, http2=False,
+                 reuse_port=False, metrics=None, **kwargs):
         """Server for HTTP(s) Requests
 
         :param server_address: tuple of (server_name, port)
@@ -163,14 +186,21 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
                             server_address parameter, but not to the address.
         :param latency: Delay in ms to wait before serving each response, or
                         callable that returns a delay in ms
+        :param reuse_port: Set SO_REUSEPORT on the listening socket, so that
+                           several processes can listen on the same port
+        :param metrics: Metrics object collecting the timings of requests,
+                        or None to not collect them
         """
         self.router = router
         self.rewriter = rewriter
+        self.metrics = metrics
 
         self.scheme = "http2" if http2 else "https" if use_ssl else "http"
         self.logger = get_logger()
 
         self.latency = latency
+        self.reuse_port = reuse_port
+        self.h2_worker_pool = WorkerPool(self.h2_max_workers) if http2 else None
 
         if bind_address:
             hostname_port = server_address
@@ -180,16 +210,7 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
         #super doesn't work here because BaseHTTPServer.HTTPServer is old-style
         BaseHTTPServer.HTTPServer.__init__(self, hostname_port, request_handler_cls, **kwargs)
 
-        if config is not None:
-            Server.config = config
-        else:
-            self.logger.debug("Using default configuration")
-            with ConfigBuilder(browser_host=server_address[0],
-                               ports={"http": [self.server_address[1]]}) as config:
-                assert config["ssl_config"] is None
-                Server.config = config
-
-
+        set_server_config(config, server_address[0], self.server_address[1])
 
         self.key_file = key_file
         self.certificate = certificate
@@ -209,6 +230,16 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
                                               certfile=self.certificate,
                                               server_side=True)
 
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        BaseHTTPServer.HTTPServer.server_bind(self)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        if self.h2_worker_pool is not None:
+            self.h2_worker_pool.shutdown()
+
     def handle_error(self, request, client_address):
         error = sys.exc_info()[1]
 
@@ -229,6 +260,32 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.logger = get_logger()
         BaseHTTPServer.BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
 
+    def handle(self):
+        metrics = self.server.metrics
+        if metrics is None:
+            return BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        metrics.connection_opened()
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        finally:
+            metrics.connection_closed()
+
+    def get_handler(self, request):
+        """Get the handler for a request from the server's router, or the
+        metrics handler for requests to the metrics path"""
+        metrics = self.server.metrics
+        if metrics is None:
+            return self.server.router.get_handler(request)
+
+        start = time.time()
+        request.timings = {}
+        if request.url_parts.path == metrics.path:
+            handler = metrics.handler
+        else:
+            handler = self.server.router.get_handler(request)
+        request.timings["route"] = time.time() - start
+        return handler
+
     def finish_handling_h1(self, request_line_is_valid):
 
         self.server.rewriter.rewrite(self)
@@ -246,7 +303,7 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             return
 
         self.logger.debug("%s %s" % (request.method, request.request_path))
-        handler = self.server.router.get_handler(request)
+        handler = self.get_handler(request)
         self.finish_handling(request, response, handler)
 
     def finish_handling(self, request, response, handler):
@@ -265,22 +322,28 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.logger.warning("Latency enabled. Sleeping %i ms" % latency)
             time.sleep(latency / 1000.)
 
+        timings = request.timings
         if handler is None:
             self.logger.debug("No Handler found!")
             response.set_error(404)
         else:
+            start = time.time()
             try:
                 handler(request, response)
             except HTTPException as e:
                 response.set_error(e.code, e.message)
             except Exception as e:
                 self.respond_with_error(response, e)
+            if timings is not None:
+                timings["handler"] = (time.time() - start -
+                                      timings.get("pipeline", 0))
         self.logger.debug("%i %s %s (%s) %i" % (response.status[0],
                                                 request.method,
                                                 request.request_path,
                                                 request.headers.get('Referer'),
                                                 request.raw_input.length))
 
+        start = time.time()
         if not response.writer.content_written:
             response.write()
 
@@ -289,6 +352,12 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if isinstance(response, H2Response) and not response.writer.stream_ended:
             response.writer.end_stream()
 
+        if timings is not None:
+            timings["write"] = time.time() - start
+            self.server.metrics.record_request(request.url_parts.path,
+                                               timings,
+                                               response.writer.bytes_written)
+
         # If we want to remove this in the future, a solution is needed for
         # scripts that produce a non-string iterable of content, since these
         # can't set a Content-Length header. A notable example of this kind of
@@ -335,12 +404,16 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
         and keep running throughout the duration of the interaction, and will read/write directly
         from the socket.
 
+        The frames received on each stream are processed by the server's pool of
+        workers, through a StreamScheduler, rather than by a thread for each stream.
+
         Because there can be multiple H2 connections active at the same
         time, a UUID is created for each so that it is easier to tell them apart in the logs.
         """
 
         config = H2Configuration(client_side=False)
-        self.conn = H2ConnectionGuard(H2Connection(config=config))
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn = H2ConnectionGuard(H2Connection(config=config), self.request)
         self.close_connection = False
 
         # Generate a UUID to make it easier to distinguish different H2 connection debug messages
@@ -350,13 +423,15 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
 
         with self.conn as connection:
             connection.initiate_connection()
-            data = connection.data_to_send()
             window_size = connection.remote_settings.initial_window_size
 
-        self.request.sendall(data)
+        self.conn.flush()
 
-        # Dict of { stream_id: (thread, queue) }
-        stream_queues = {}
+        # Dict of {stream_id: H2Stream}, only used by the workers processing each stream
+        self.streams = {}
+        scheduler = StreamScheduler(self.server.h2_worker_pool, self._process_frame)
+        # Ids of the streams that are still receiving frames
+        open_streams = set()
 
         try:
             while not self.close_connection:
@@ -369,6 +444,11 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
                 with self.conn as connection:
                     frames = connection.receive_data(data)
                     window_size = connection.remote_settings.initial_window_size
+                    if any(isinstance(frame, (WindowUpdated, RemoteSettingsChanged)) for frame in frames):
+                        self.conn.window_updated.notify_all()
+
+                # Send any acknowledgements of settings or pings
+                self.conn.flush()
 
                 self.logger.debug('(%s) Frames Received: ' % self.uid + str(frames))
 
@@ -378,99 +458,88 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
                         self.close_connection = True
 
                         # Flood all the streams with connection terminated, this will cause them to stop
-                        for stream_id, (thread, queue) in stream_queues.items():
-                            queue.put(frame)
+                        for stream_id in open_streams:
+                            scheduler.dispatch(stream_id, frame)
+
+                    elif isinstance(frame, WindowUpdated):
+                        # Handled by writers waiting for the flow control window
+                        continue
 
                     elif hasattr(frame, 'stream_id'):
-                        if frame.stream_id not in stream_queues:
-                            queue = Queue()
-                            stream_queues[frame.stream_id] = (self.start_stream_thread(frame, queue), queue)
-                        stream_queues[frame.stream_id][1].put(frame)
+                        open_streams.add(frame.stream_id)
+                        scheduler.dispatch(frame.stream_id, frame)
 
                         if isinstance(frame, StreamEnded) or (hasattr(frame, "stream_ended") and frame.stream_ended):
-                            del stream_queues[frame.stream_id]
+                            open_streams.discard(frame.stream_id)
 
         except (socket.timeout, socket.error) as e:
             self.logger.error('(%s) Closing Connection - \n%s' % (self.uid, str(e)))
             if not self.close_connection:
                 self.close_connection = True
-                for stream_id, (thread, queue) in stream_queues.items():
-                    queue.put(None)
+                for stream_id in open_streams:
+                    scheduler.dispatch(stream_id, None)
         except Exception as e:
             self.logger.error('(%s) Unexpected Error - \n%s' % (self.uid, str(e)))
         finally:
-            for stream_id, (thread, queue) in stream_queues.items():
-                thread.join()
+            self.conn.close()
+            scheduler.join()
 
-    def start_stream_thread(self, frame, queue):
-        """
-        This starts a new thread to handle frames for a specific stream.
-        :param frame: The first frame on the stream
-        :param queue: A queue object that the thread will use to check for new frames
-        :return: The thread object that has already been started
-        """
-        t = threading.Thread(
-            target=Http2WebTestRequestHandler._stream_thread,
-            args=(self, frame.stream_id, queue)
-        )
-        t.start()
-        return t
-
-    def _stream_thread(self, stream_id, queue):
+    def _process_frame(self, stream_id, frame):
         """
-        This thread processes frames for a specific stream. It waits for frames to be placed
-        in the queue, and processes them. When it receives a request frame, it will start processing
-        immediately, even if there are data frames to follow. One of the reasons for this is that it
-        can detect invalid requests before needing to read the rest of the frames.
+        Process a frame received on a stream. This is called by the StreamScheduler, which
+        processes the frames of each stream in order. When it receives a request frame, it
+        will start processing immediately, even if there are data frames to follow. One of
+        the reasons for this is that it can detect invalid requests before needing to read
+        the rest of the frames.
         """
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = self.streams[stream_id] = H2Stream()
 
-        # The file-like pipe object that will be used to share data to request object if data is received
-        wfile = None
-        request = None
-        response = None
-        req_handler = None
-        while not self.close_connection:
-            # Wait for next frame, blocking
-            frame = queue.get(True, None)
+        if self.close_connection or stream.closed:
+            return
 
-            self.logger.debug('(%s - %s) %s' % (self.uid, stream_id, str(frame)))
+        self.logger.debug('(%s - %s) %s' % (self.uid, stream_id, str(frame)))
 
-            if isinstance(frame, RequestReceived):
-                rfile, wfile = os.pipe()
-                rfile, wfile = os.fdopen(rfile, 'rb'), os.fdopen(wfile, 'wb')
+        if isinstance(frame, RequestReceived):
+            stream.rfile = H2RequestBody()
+            stream_handler = H2HandlerCopy(self, frame, stream.rfile)
 
-                stream_handler = H2HandlerCopy(self, frame, rfile)
+            stream_handler.server.rewriter.rewrite(stream_handler)
+            stream.request = H2Request(stream_handler)
+            stream.response = H2Response(stream_handler, stream.request)
 
-                stream_handler.server.rewriter.rewrite(stream_handler)
-                request = H2Request(stream_handler)
-                response = H2Response(stream_handler, request)
+            stream.handler = self.get_handler(stream.request)
 
-                req_handler = stream_handler.server.router.get_handler(request)
+            if hasattr(stream.handler, "frame_handler"):
+                # Convert this to a handler that will utilise H2 specific functionality, such as handling individual frames
+                stream.handler = self.frame_handler(stream.request, stream.response, stream.handler)
 
-                if hasattr(req_handler, "frame_handler"):
-                    # Convert this to a handler that will utilise H2 specific functionality, such as handling individual frames
-                    req_handler = self.frame_handler(request, response, req_handler)
+            if hasattr(stream.handler, 'handle_headers'):
+                stream.handler.handle_headers(frame, stream.request, stream.response)
 
-                if hasattr(req_handler, 'handle_headers'):
-                    req_handler.handle_headers(frame, request, response)
+        elif isinstance(frame, DataReceived):
+            stream.rfile.write(frame.data)
 
-            elif isinstance(frame, DataReceived):
-                wfile.write(frame.data)
+            # Let the client send more data, now that this has been processed
+            with self.conn as connection:
+                connection.acknowledge_received_data(frame.flow_controlled_length, stream_id)
+            self.conn.flush()
 
-                if hasattr(req_handler, 'handle_data'):
-                    req_handler.handle_data(frame, request, response)
+            if hasattr(stream.handler, 'handle_data'):
+                stream.handler.handle_data(frame, stream.request, stream.response)
 
-                if frame.stream_ended:
-                    wfile.close()
-            elif frame is None or isinstance(frame, (StreamReset, StreamEnded, ConnectionTerminated)):
-                self.logger.debug('(%s - %s) Stream Reset, Thread Closing' % (self.uid, stream_id))
-                break
+        elif frame is None or isinstance(frame, (StreamReset, StreamEnded, ConnectionTerminated)):
+            self.logger.debug('(%s - %s) Stream Reset, Stream Closing' % (self.uid, stream_id))
+            stream.closed = True
+            del self.streams[stream_id]
+            return
 
-            if request is not None:
-                request.frames.append(frame)
+        if stream.request is not None:
+            stream.request.frames.append(frame)
 
-            if hasattr(frame, "stream_ended") and frame.stream_ended:
-                self.finish_handling(request, response, req_handler)
+        if hasattr(frame, "stream_ended") and frame.stream_ended:
+            self.finish_handling(stream.request, stream.response, stream.handler)
 
     def frame_handler(self, request, response, handler):
         try:
@@ -483,12 +552,27 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
             response.write()
 
 class H2ConnectionGuard(object):
-    """H2Connection objects are not threadsafe, so this keeps thread safety"""
-    lock = threading.Lock()
+    """H2Connection objects are not threadsafe, so this keeps thread safety.
+
+    It also sends the data generated by the connection to the socket. Data
+    from several streams is combined into a single write when possible, and
+    writers can wait for the flow control window of a stream to open.
 
-    def __init__(self, obj):
+    :param obj: The H2Connection
+    :param socket: The socket of the connection
+    """
+
+    def __init__(self, obj, socket=None):
         assert isinstance(obj, H2Connection)
         self.obj = obj
+        self.socket = socket
+        self.lock = threading.Lock()
+        # Notified when the flow control windows may have changed
+        self.window_updated = threading.Condition(self.lock)
+        # Held while writing to the socket, so that data is sent in order
+        self._send_lock = threading.Lock()
+        self._flush_requested = False
+        self._closed = False
 
     def __enter__(self):
         self.lock.acquire()
@@ -497,6 +581,96 @@ class H2ConnectionGuard(object):
     def __exit__(self, exception_type, exception_value, traceback):
         self.lock.release()
 
+    def flush(self):
+        """Send the data that's waiting to be sent.
+
+        If another thread is already writing to the socket, this returns
+        immediately and that thread sends the data once it's done."""
+        with self.lock:
+            self._flush_requested = True
+
+        while True:
+            if not self._send_lock.acquire(False):
+                return
+            try:
+                with self.lock:
+                    data = self.obj.data_to_send()
+                    self._flush_requested = False
+                if data:
+                    self.socket.sendall(data)
+            finally:
+                self._send_lock.release()
+
+            with self.lock:
+                if not self._flush_requested:
+                    return
+
+    def send_raw(self, data):
+        """Send raw bytes to the socket, after any data that's waiting to be sent"""
+        with self._send_lock:
+            with self.lock:
+                pending = self.obj.data_to_send()
+            self.socket.sendall(pending + data)
+
+    def wait_for_window(self, stream_id):
+        """Wait until the flow control window for a stream is open. Must be
+        called while holding the lock, so that the window can't be used by
+        another stream before the caller sends its data.
+
+        :returns: The size of the window
+        """
+        while True:
+            if self._closed:
+                raise socket.error(errno.EPIPE, "Connection closed")
+            window = self.obj.local_flow_control_window(stream_id)
+            if window > 0:
+                return window
+            self.window_updated.wait()
+
+    def close(self):
+        """Wake up any writers waiting for the flow control window, once the
+        connection has been closed"""
+        with self.window_updated:
+            self._closed = True
+            self.window_updated.notify_all()
+
+
+class H2Stream(object):
+    """State of an HTTP/2 stream while its frames are being processed"""
+
+    def __init__(self):
+        self.rfile = None
+        self.request = None
+        self.response = None
+        self.handler = None
+        self.closed = False
+
+
+class H2RequestBody(object):
+    """File-like object holding the body of an HTTP/2 request. The data
+    of each DATA frame is written to it when the frame is processed, and
+    it's read by the request."""
+
+    def __init__(self):
+        self._buf = BytesIO()
+        self._read_position = 0
+
+    def write(self, data):
+        self._buf.seek(0, 2)
+        self._buf.write(data)
+
+    def read(self, size=-1):
+        self._buf.seek(self._read_position)
+        data = self._buf.read(size)
+        self._read_position += len(data)
+        return data
+
+    def readline(self, size=-1):
+        self._buf.seek(self._read_position)
+        data = self._buf.readline(size)
+        self._read_position += len(data)
+        return data
+
 
 class H2Headers(dict):
     def __init__(self, headers):
@@ -600,6 +774,12 @@ class WebTestHttpd(object):
     :param bind_address: Boolean indicating whether to bind server to IP address.
     :param latency: Delay in ms to wait before serving each response, or
                     callable that returns a delay in ms
+    :param reuse_port: Boolean indicating whether to set SO_REUSEPORT on the
+                       listening socket, so that the port can be shared by
+                       servers in several processes.
+    :param metrics: Metrics object in which to collect the timings of
+                    requests, which are then served from metrics.path, or
+                    None to not collect them.
 
     HTTP server designed for testing scenarios.
 
@@ -636,7 +816,8 @@ class WebTestHttpd(object):
                  use_ssl=False, key_file=None, certificate=None, encrypt_after_connect=False,
                  router_cls=Router, doc_root=os.curdir, routes=None,
                  rewriter_cls=RequestRewriter, bind_address=True, rewrites=None,
-                 latency=None, config=None, http2=False):
+                 latency=None, config=None, http2=False, reuse_port=False,
+                 metrics=None):
 
         if routes is None:
             routes = default_routes.routes
@@ -671,7 +852,9 @@ class WebTestHttpd(object):
                                     certificate=certificate,
                                     encrypt_after_connect=encrypt_after_connect,
                                     latency=latency,
-                                    http2=http2)
+                                    http2=http2,
+                                    reuse_port=reuse_port,
+                                    metrics=metrics)
             self.started = False
 
             _host, self.port = self.httpd.socket.getsockname()
@@ -1,23 +1,113 @@
 import base64
+import heapq
 import json
+import multiprocessing
 import os
+import time
 import uuid
 import threading
+from multiprocessing.connection import Client, Listener
 from multiprocessing.managers import AcquirerProxy, BaseManager, DictProxy
 from six import text_type
 
 
+class StashDict(dict):
+    """dict holding the data of a Stash.
+
+    In addition to the usual dict methods, this has put and take methods
+    that are atomic, so that each needs a single call through a proxy, and
+    take can wait for a value to be put. Values added with put expire
+    once their time to live has passed.
+
+    :param ttl: Default time to live of values, in seconds, or None for
+                values to never expire
+    """
+
+    def __init__(self, ttl=None):
+        dict.__init__(self)
+        self.ttl = ttl
+        self._cond = threading.Condition(threading.Lock())
+        # Heap of (expiry time, key), and dict of {key: expiry time} for the
+        # keys that are currently stored
+        self._expiry_heap = []
+        self._expiry = {}
+
+    def put(self, key, value, ttl=None):
+        """Store a value, unless there's already a value for the key.
+
+        :param ttl: Time to live of the value in seconds, defaulting to the
+                    ttl of the StashDict
+        :returns: The value that's already stored for the key, or None if
+                  the value was stored"""
+        with self._cond:
+            self._expire()
+            if key in self:
+                return dict.__getitem__(self, key)
+            dict.__setitem__(self, key, value)
+            if ttl is None:
+                ttl = self.ttl
+            if ttl is not None:
+                expiry = time.time() + ttl
+                self._expiry[key] = expiry
+                heapq.heappush(self._expiry_heap, (expiry, key))
+            self._cond.notify_all()
+        return None
+
+    def take(self, key, timeout=None):
+        """Remove the value for a key and return it.
+
+        :param timeout: Number of seconds to wait for a value to be put, if
+                        there isn't one yet. By default this doesn't wait.
+        :returns: The value, or None if there isn't one"""
+        with self._cond:
+            self._expire()
+            if timeout:
+                end_time = time.time() + timeout
+                while key not in self:
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                    self._expire()
+            self._expiry.pop(key, None)
+            return self.pop(key, None)
+
+    def _expire(self):
+        now = time.time()
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expiry, key = heapq.heappop(heap)
+            # The key may have been taken, and put again with a new expiry
+            if self._expiry.get(key) == expiry:
+                del self._expiry[key]
+                self.pop(key, None)
+
+
+class StashDictProxy(DictProxy):
+    _exposed_ = DictProxy._exposed_ + ("put", "take")
+
+    def put(self, key, value, ttl=None):
+        return self._callmethod("put", (key, value, ttl))
+
+    def take(self, key, timeout=None):
+        return self._callmethod("take", (key, timeout))
+
+
 class ServerDictManager(BaseManager):
-    shared_data = {}
+    shared_data = StashDict()
 
 
 def _get_shared():
     return ServerDictManager.shared_data
 
 
+def _init_shared(ttl):
+    ServerDictManager.shared_data.ttl = ttl
+
+
 ServerDictManager.register("get_dict",
                            callable=_get_shared,
-                           proxytype=DictProxy)
+                           proxytype=StashDictProxy)
 ServerDictManager.register('Lock', threading.Lock, AcquirerProxy)
 
 
@@ -25,27 +115,47 @@ class ClientDictManager(BaseManager):
     pass
 
 
-ClientDictManager.register("get_dict")
+ClientDictManager.register("get_dict", proxytype=StashDictProxy)
 ClientDictManager.register("Lock")
 
 
 class StashServer(object):
-    def __init__(self, address=None, authkey=None):
+    """Context manager running the server that holds the data of the stash.
+
+    :param ttl: Number of seconds after which values that haven't been
+                taken are removed, or None to keep them until they're
+                taken. Set by the stash_ttl config option of wpt serve.
+    :param backend: Either "manager", to use a multiprocessing manager, or
+                    "socket", to use a server with its own, simpler,
+                    protocol (see start_socket_server)
+    """
+
+    def __init__(self, address=None, authkey=None, ttl=None, backend="manager"):
+        if backend not in backends:
+            raise ValueError("Unknown stash backend %s" % backend)
         self.address = address
         self.authkey = authkey
+        self.ttl = ttl
+        self.backend = backend
         self.manager = None
 
     def __enter__(self):
-        self.manager, self.address, self.authkey = start_server(self.address, self.authkey)
-        store_env_config(self.address, self.authkey)
+        start = backends[self.backend]
+        self.manager, self.address, self.authkey = start(self.address, self.authkey, self.ttl)
+        store_env_config(self.address, self.authkey, self.backend)
 
     def __exit__(self, *args, **kwargs):
         if self.manager is not None:
             self.manager.shutdown()
+            # Any connection to the server that Stash made in this process
+            # can no longer be used
+            with Stash._initializing:
+                Stash._proxy = None
+                Stash.lock = None
 
 
 def load_env_config():
-    address, authkey = json.loads(os.environ["WPT_STASH_CONFIG"])
+    address, authkey = json.loads(os.environ["WPT_STASH_CONFIG"])[:2]
     if isinstance(address, list):
         address = tuple(address)
     else:
@@ -54,20 +164,163 @@ def load_env_config():
     return address, authkey
 
 
-def store_env_config(address, authkey):
+def load_env_backend():
+    """Get the backend of the StashServer that's running, defaulting to
+    "manager" if it's unknown"""
+    config = json.loads(os.environ.get("WPT_STASH_CONFIG", "[]"))
+    return config[2] if len(config) > 2 else "manager"
+
+
+def store_env_config(address, authkey, backend="manager"):
     authkey = base64.b64encode(authkey)
-    os.environ["WPT_STASH_CONFIG"] = json.dumps((address, authkey.decode("ascii")))
+    os.environ["WPT_STASH_CONFIG"] = json.dumps((address, authkey.decode("ascii"), backend))
 
 
-def start_server(address=None, authkey=None):
+def start_server(address=None, authkey=None, ttl=None):
     if isinstance(authkey, text_type):
         authkey = authkey.encode("ascii")
     manager = ServerDictManager(address, authkey)
-    manager.start()
+    manager.start(_init_shared, (ttl,))
 
     return (manager, manager._address, manager._authkey)
 
 
+def start_socket_server(address=None, authkey=None, ttl=None):
+    """Start a process running a stash server for SocketStashClient.
+
+    Unlike a multiprocessing manager, this server only knows about the
+    operations of the stash, so each one is a single small message in
+    each direction, and there are no proxy objects to create or track.
+    By default it listens on a Unix socket where those are available.
+
+    :returns: Tuple of (SocketServerProcess, address, authkey)
+    """
+    if isinstance(authkey, text_type):
+        authkey = authkey.encode("ascii")
+    if authkey is None:
+        authkey = os.urandom(32)
+
+    control, child_control = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve_socket,
+                                      args=(address, authkey, ttl, child_control),
+                                      name="StashServer")
+    process.start()
+    child_control.close()
+    try:
+        address = control.recv()
+    except EOFError:
+        process.join()
+        raise StashError("Failed to start the stash server")
+
+    return (SocketServerProcess(process, control), address, authkey)
+
+
+backends = {"manager": start_server,
+            "socket": start_socket_server}
+
+
+class SocketServerProcess(object):
+    """Handle for the process started by start_socket_server"""
+
+    def __init__(self, process, control):
+        self.process = process
+        self.control = control
+
+    def shutdown(self):
+        try:
+            self.control.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.control.close()
+
+
+def _serve_socket(address, authkey, ttl, control):
+    listener = Listener(address, authkey=authkey)
+    data = StashDict(ttl)
+    lock = threading.Lock()
+    operations = {"put": data.put,
+                  "take": data.take,
+                  "acquire": lock.acquire,
+                  "release": lock.release}
+
+    def handle(conn):
+        # Each client thread has its own connection, so a take that waits
+        # for a value only holds up the thread that's waiting
+        try:
+            while True:
+                message = conn.recv()
+                try:
+                    response = (True, operations[message[0]](*message[1:]))
+                except Exception as e:
+                    response = (False, e)
+                conn.send(response)
+        except (EOFError, IOError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except (EOFError, IOError, OSError, multiprocessing.AuthenticationError):
+                continue
+            thread = threading.Thread(target=handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    thread = threading.Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+
+    control.send(listener.address)
+    try:
+        control.recv()
+    except EOFError:
+        pass
+    listener.close()
+
+
+class SocketStashClient(object):
+    """Client for the server started by start_socket_server.
+
+    This has the put and take methods of StashDict, along with acquire
+    and release methods for the lock shared by all the clients. Each
+    thread uses its own connection to the server.
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _call(self, *message):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self.authkey)
+        conn.send(message)
+        success, result = conn.recv()
+        if not success:
+            raise result
+        return result
+
+    def put(self, key, value, ttl=None):
+        return self._call("put", key, value, ttl)
+
+    def take(self, key, timeout=None):
+        return self._call("take", key, timeout)
+
+    def acquire(self):
+        self._call("acquire")
+
+    def release(self):
+        self._call("release")
+
+
 class LockWrapper(object):
     def __init__(self, lock):
         self.lock = lock
@@ -85,15 +338,14 @@ class LockWrapper(object):
         self.release()
 
 
-#TODO: Consider expiring values after some fixed time for long-running
-#servers
-
 class Stash(object):
     """Key-value store for persisting data across HTTP/S and WS/S requests.
 
     This data store is specifically designed for persisting data across server
     requests. The synchronization is achieved by using the BaseManager from
     the multiprocessing module so different processes can acccess the same data.
+    Alternatively, with the "socket" backend, the data is held by the server
+    started by start_socket_server.
 
     Stash can be used interchangeably between HTTP, HTTPS, WS and WSS servers.
     A thing to note about WS/S servers is that they require additional steps in
@@ -110,20 +362,28 @@ class Stash(object):
     these properties make it difficult for data to accidentally leak
     between different resources or different requests for the same
     resource.
+
+    Values that are never taken may be given a time to live, after which
+    they expire so that they don't accumulate in long-running servers. The
+    default is the ttl of the StashServer, which by default keeps values
+    until they're taken.
+
+    :param backend: Backend of the StashServer, by default the one of the
+                    StashServer that stored its config in the environment
     """
 
     _proxy = None
     lock = None
     _initializing = threading.Lock()
 
-    def __init__(self, default_path, address=None, authkey=None):
+    def __init__(self, default_path, address=None, authkey=None, backend=None):
         self.default_path = default_path
-        self._get_proxy(address, authkey)
+        self._get_proxy(address, authkey, backend)
         self.data = Stash._proxy
 
-    def _get_proxy(self, address=None, authkey=None):
+    def _get_proxy(self, address=None, authkey=None, backend=None):
         if address is None and authkey is None:
-            Stash._proxy = {}
+            Stash._proxy = StashDict()
             Stash.lock = threading.Lock()
 
         # Initializing the proxy involves connecting to the remote process and
@@ -136,6 +396,14 @@ class Stash(object):
             if Stash.lock:
                 return
 
+            if backend is None:
+                backend = load_env_backend()
+            if backend == "socket":
+                client = SocketStashClient(address, authkey)
+                Stash._proxy = client
+                Stash.lock = LockWrapper(client)
+                return
+
             manager = ClientDictManager(address, authkey)
             manager.connect()
             Stash._proxy = manager.get_dict()
@@ -149,39 +417,35 @@ class Stash(object):
         # when writing to a subdict.
         return (str(path), str(uuid.UUID(key)))
 
-    def put(self, key, value, path=None):
+    def put(self, key, value, path=None, ttl=None):
         """Place a value in the shared stash.
 
         :param key: A UUID to use as the data's key.
         :param value: The data to store. This can be any python object.
         :param path: The path that has access to read the data (by default
-                     the current request path)"""
+                     the current request path)
+        :param ttl: Number of seconds after which the value is removed if it
+                    hasn't been taken (by default the ttl of the stash)"""
         if value is None:
             raise ValueError("SharedStash value may not be set to None")
         internal_key = self._wrap_key(key, path)
-        if internal_key in self.data:
+        old_value = self.data.put(internal_key, value, ttl)
+        if old_value is not None:
             raise StashError("Tried to overwrite existing shared stash value "
                              "for key %s (old value was %s, new value is %s)" %
-                             (internal_key, self.data[str(internal_key)], value))
-        else:
-            self.data[internal_key] = value
+                             (internal_key, old_value, value))
 
-    def take(self, key, path=None):
+    def take(self, key, path=None, timeout=None):
         """Remove a value from the shared stash and return it.
 
         :param key: A UUID to use as the data's key.
         :param path: The path that has access to read the data (by default
-                     the current request path)"""
+                     the current request path)
+        :param timeout: Number of seconds to wait for the value to be put,
+                        if it's not in the stash yet (by default the stash
+                        isn't waited on)"""
         internal_key = self._wrap_key(key, path)
-        value = self.data.get(internal_key, None)
-        if value is not None:
-            try:
-                self.data.pop(internal_key)
-            except KeyError:
-                # Silently continue when pop error occurs.
-                pass
-
-        return value
+        return self.data.take(internal_key, timeout)
 
 
 class StashError(Exception):